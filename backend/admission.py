@@ -0,0 +1,196 @@
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    """Raised when a stage's wait queue is full; the request should be answered with 503."""
+
+    def __init__(self, stage, retry_after):
+        super().__init__(f"The {stage} stage is at capacity, retry in {retry_after}s")
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+class Reservation:
+    """
+    A request's place in a stage's queue, taken when the request is admitted (see StageLimiter.reserve).
+    It has the limiter's slot() interface, so the pipeline enters the stage with it in place of the limiter.
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.held = True
+
+    @property
+    def name(self):
+        return self.limiter.name
+
+    def slot(self):
+        """Waits for a slot of the stage without being rejected: the place in the queue is already taken."""
+        return self.limiter.slot(self)
+
+    def release(self):
+        """Gives the place back if the stage was not entered (cached, not needed, or the request failed)."""
+        self.limiter.cancel(self)
+
+
+class StageLimiter:
+    """
+    Bounds how many pipelines run an expensive stage at once, and how many may wait for it.
+
+    Admitted requests reserve their place up front (reserve), so the check at admission and the wait
+    for a slot cannot race: requests that pass admission are never rejected later, mid-pipeline.
+
+    Args:
+        name (str): Stage name, as used by the pipeline graph.
+        max_concurrent (int): Pipelines allowed inside the stage at the same time.
+        max_queue (int): Pipelines allowed to wait for a slot; beyond that, Overloaded is raised.
+    """
+
+    def __init__(self, name, max_concurrent, max_queue):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.running = 0
+        self.waiting = 0
+        # Admitted requests that have not entered the stage yet
+        self.reserved = 0
+        self.admitted = 0
+        self.rejected = 0
+        # Exponential moving average of the time spent in the stage, for Retry-After estimates
+        self.avg_seconds = None
+        self._cond = threading.Condition()
+
+    def is_full(self):
+        return self.running + self.waiting + self.reserved >= self.max_concurrent + self.max_queue
+
+    def reserve(self):
+        """
+        Takes a place in the stage's queue for a request being admitted.
+
+        Returns:
+            Reservation: To enter the stage with, or release.
+
+        Raises:
+            Overloaded: Right away, if the queue is full.
+        """
+        with self._cond:
+            if self.is_full():
+                self.rejected += 1
+                raise Overloaded(self.name, self.retry_after())
+            self.reserved += 1
+            return Reservation(self)
+
+    def cancel(self, reservation):
+        with self._cond:
+            if reservation.held:
+                reservation.held = False
+                self.reserved -= 1
+
+    def retry_after(self):
+        seconds = self.avg_seconds if self.avg_seconds is not None else 10.0
+        return max(1, math.ceil(seconds * (self.waiting + self.reserved + 1) / self.max_concurrent))
+
+    @contextmanager
+    def slot(self, reservation=None):
+        """
+        Waits for a free slot and holds it. Without a held reservation, raises Overloaded when the queue
+        is full.
+        """
+        with self._cond:
+            if reservation is not None and reservation.held:
+                # The place in the queue was taken at admission
+                reservation.held = False
+                self.reserved -= 1
+            elif self.is_full():
+                self.rejected += 1
+                raise Overloaded(self.name, self.retry_after())
+            self.waiting += 1
+            try:
+                while self.running >= self.max_concurrent:
+                    self._cond.wait()
+            finally:
+                self.waiting -= 1
+            self.running += 1
+            self.admitted += 1
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._cond:
+                self.running -= 1
+                self.avg_seconds = elapsed if self.avg_seconds is None else 0.8 * self.avg_seconds + 0.2 * elapsed
+                self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "running": self.running,
+                "waiting": self.waiting,
+                "reserved": self.reserved,
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "avg_seconds": self.avg_seconds,
+            }
+
+
+class AdmissionController:
+    """The limiters of every expensive stage, plus request-level counters."""
+
+    def __init__(self, limits):
+        """
+        Args:
+            limits (dict): Stage name -> (max_concurrent, max_queue).
+        """
+        self.limiters = {name: StageLimiter(name, *limit) for name, limit in limits.items()}
+        self.requests_admitted = 0
+        self.requests_rejected = 0
+        self._lock = threading.Lock()
+
+    def admit(self, stages):
+        """
+        Reserves, at request entry, a place in the queue of every stage the request will use.
+
+        Args:
+            stages (iterable): Names of the limited stages the request goes through.
+
+        Returns:
+            dict: Stage name -> Reservation, to pass to PipelineGraph.run in place of the limiters. Give
+                  them back with release() once the request is done.
+
+        Raises:
+            Overloaded: If a stage's queue is full; nothing stays reserved.
+        """
+        reservations = {}
+        try:
+            for name in stages:
+                if name in self.limiters:
+                    reservations[name] = self.limiters[name].reserve()
+        except Overloaded:
+            self.release(reservations)
+            with self._lock:
+                self.requests_rejected += 1
+            raise
+        with self._lock:
+            self.requests_admitted += 1
+        return reservations
+
+    @staticmethod
+    def release(reservations):
+        """Gives back the places of admit() that were not used, e.g. of stages served from the cache."""
+        for reservation in reservations.values():
+            reservation.release()
+
+    def stats(self):
+        with self._lock:
+            requests = {"admitted": self.requests_admitted, "rejected": self.requests_rejected}
+        return {
+            "requests": requests,
+            "stages": {name: limiter.stats() for name, limiter in self.limiters.items()},
+        }
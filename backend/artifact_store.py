@@ -0,0 +1,238 @@
+import os
+import gzip
+import time
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pipeline import hash_file
+
+try:
+    import brotli
+except ImportError:  # gzip variants only
+    brotli = None
+
+# Precompressed variants, in order of preference, stored next to the artifact as <name><suffix>
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+GZIP_LEVEL = 9
+# Quality 9 keeps most of brotli's gain over gzip on OBJ text at a fraction of the time of quality 11
+BROTLI_QUALITY = 9
+
+
+class ArtifactStore:
+    """
+    Rendered meshes kept on disk under stable content-hash names.
+
+    Artifacts expire ttl_seconds after their last access, and the least recently used ones are
+    evicted whenever the store grows beyond max_bytes. The last access time is the file's mtime,
+    so the store survives restarts without an index.
+
+    Every artifact also gets gzip (and, with the brotli package, brotli) variants, compressed once in a
+    background thread so that downloads never compress on the fly. They are evicted with their artifact.
+
+    Args:
+        root (str): Directory holding the artifacts.
+        max_bytes (int): Disk budget for the whole store.
+        ttl_seconds (float): Time after the last access at which an artifact expires.
+    """
+
+    def __init__(self, root, max_bytes, ttl_seconds):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # Maps request keys (input hash + parameters) to artifact names, so a repeated request skips the pipeline
+        self._aliases = {}
+        self._lock = threading.Lock()
+        self._compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="artifact-compress")
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.root, os.path.basename(name))
+
+    def put(self, src_path, request_key=None):
+        """
+        Moves a rendered file into the store.
+
+        Args:
+            src_path (str): The file to store; it is moved, not copied.
+            request_key (str): Optional key of the request that produced it, for lookup().
+
+        Returns:
+            str: The artifact name, <hash of the content>.<extension>.
+        """
+        extension = os.path.splitext(src_path)[1].lower()
+        name = hash_file(src_path) + extension
+        dst_path = self.path(name)
+        with self._lock:
+            if os.path.exists(dst_path):
+                os.remove(src_path)
+                os.utime(dst_path)
+            else:
+                shutil.move(src_path, dst_path)
+            if request_key is not None:
+                self._aliases[request_key] = name
+        self.evict()
+        self._compressor.submit(self.precompress, name)
+        return name
+
+    def precompress(self, name):
+        """Writes the missing compressed variants of an artifact, then evicts to count them against max_bytes."""
+        file_path = self.path(name)
+        for encoding, suffix in ENCODING_SUFFIXES.items():
+            if encoding == "br" and brotli is None:
+                continue
+            variant_path = file_path + suffix
+            if os.path.exists(variant_path):
+                continue
+            try:
+                with open(file_path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                break  # Evicted in the meantime
+            if encoding == "br":
+                data = brotli.compress(data, quality=BROTLI_QUALITY)
+            else:
+                data = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+            # Written under a temporary name and renamed, so a half-written variant is never served
+            tmp_path = variant_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            with self._lock:
+                if not os.path.exists(file_path):
+                    # Evicted while compressing: the variant would be orphaned
+                    os.remove(tmp_path)
+                    break
+                os.replace(tmp_path, variant_path)
+        # Also drops the variants already written when the artifact was evicted in the meantime
+        self.evict()
+
+    def variant(self, name, accept_encoding):
+        """
+        Picks what to send for an artifact given the request's Accept-Encoding.
+
+        Returns:
+            (str, str): The file path and its content encoding (None for the uncompressed artifact).
+        """
+        file_path = self.path(name)
+        available = [enc for enc, suffix in ENCODING_SUFFIXES.items() if os.path.exists(file_path + suffix)]
+        encoding = choose_encoding(accept_encoding, available)
+        if encoding is None:
+            return file_path, None
+        return file_path + ENCODING_SUFFIXES[encoding], encoding
+
+    def get(self, name):
+        """Returns the path of a live artifact and marks it as used, or None if it is unknown or expired."""
+        file_path = self.path(name)
+        with self._lock:
+            try:
+                last_access = os.path.getmtime(file_path)
+            except OSError:
+                return None
+            if time.time() - last_access > self.ttl_seconds:
+                self._remove(name)
+                return None
+            os.utime(file_path)
+        return file_path
+
+    def lookup(self, request_key):
+        """Returns the name of the artifact produced by an identical earlier request, if it is still stored."""
+        name = self._aliases.get(request_key)
+        if name is not None and self.get(name) is None:
+            with self._lock:
+                self._aliases.pop(request_key, None)
+            return None
+        return name
+
+    def evict(self):
+        """Drops expired artifacts, then the least recently used ones until the store fits its budget."""
+        now = time.time()
+        with self._lock:
+            artifacts = {}
+            variant_sizes = {}
+            for entry in os.scandir(self.root):
+                if not entry.is_file() or entry.name.endswith(".tmp"):
+                    continue
+                stat = entry.stat()
+                base, suffix = os.path.splitext(entry.name)
+                if suffix in ENCODING_SUFFIXES.values():
+                    # Variants count towards their artifact's size and share its last access time
+                    variant_sizes[base] = variant_sizes.get(base, 0) + stat.st_size
+                else:
+                    artifacts[entry.name] = stat
+
+            # Variants of artifacts evicted while they were being compressed
+            for base in variant_sizes.keys() - artifacts.keys():
+                self._remove(base)
+
+            entries = []
+            for name, stat in artifacts.items():
+                if now - stat.st_mtime > self.ttl_seconds:
+                    self._remove(name)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size + variant_sizes.get(name, 0), name))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(name)
+                total -= size
+
+    def _remove(self, name):
+        try:
+            os.remove(self.path(name))
+            print(f"Evicted artifact: {name}")
+        except OSError:
+            pass
+        for suffix in ENCODING_SUFFIXES.values():
+            try:
+                os.remove(self.path(name) + suffix)
+            except OSError:
+                pass
+        for key in [key for key, value in self._aliases.items() if value == name]:
+            del self._aliases[key]
+
+
+def etag_for(name, encoding=None):
+    """Artifact names are content hashes, so the name itself is a strong ETag; each encoding gets its own."""
+    tag = os.path.splitext(os.path.basename(name))[0]
+    return f'"{tag}-{encoding}"' if encoding else f'"{tag}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def choose_encoding(accept_encoding, available):
+    """
+    Picks the preferred available encoding acceptable to the client.
+
+    Args:
+        accept_encoding (str): The request's Accept-Encoding header (may be None).
+        available (list): Encodings that have a variant on disk.
+
+    Returns:
+        str: 'br', 'gzip' or None for identity.
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[token.strip().lower()] = weight
+
+    def weight_of(encoding):
+        return weights.get(encoding, weights.get("*", 0.0))
+
+    acceptable = [enc for enc in ENCODING_SUFFIXES if enc in available and weight_of(enc) > 0]
+    # The client's weights decide; ties go to the smaller encoding (ENCODING_SUFFIXES order)
+    return max(acceptable, key=weight_of, default=None)
@@ -0,0 +1,223 @@
+# Cap BLAS/OpenMP thread pools before numpy, scipy and Open3D are imported
+import resources
+resources.apply_thread_limits()
+
+import os
+import time
+import queue
+import threading
+import cv2
+from midas_depth_map import get_midas_model, depth_from_array
+from neural_style_transfer import load_model, stylize_array
+from compute_mesh import working_grid_shape
+from open_3d import project_cylindrical, delauny_method, slice_method, poisson_method
+from mesh_io import write_triangle_mesh
+
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'bmp', 'tiff'}
+DONE_FILE = ".batch_done"
+
+# Sentinel pushed through the queues once the producer runs out of work
+_STOP = object()
+
+
+def collect_inputs(source):
+    """
+    Lists the images to process.
+
+    Args:
+        source (str): A directory (searched recursively) or a manifest file with one image path per line.
+                      Blank lines and lines starting with '#' are ignored; relative paths are resolved
+                      against the manifest's directory.
+
+    Returns:
+        list: (key, path) tuples, where key is the path relative to the source used for output naming.
+    """
+    if os.path.isdir(source):
+        inputs = []
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if '.' in name and name.rsplit('.', 1)[1].lower() in IMAGE_EXTENSIONS:
+                    path = os.path.join(root, name)
+                    inputs.append((os.path.relpath(path, source), path))
+        return sorted(inputs)
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    inputs = []
+    with open(source) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            path = line if os.path.isabs(line) else os.path.join(base_dir, line)
+            inputs.append((line, path))
+    return inputs
+
+
+def load_done(output_dir):
+    """Returns the set of input keys already exported by a previous (possibly interrupted) run."""
+    done_path = os.path.join(output_dir, DONE_FILE)
+    if not os.path.exists(done_path):
+        return set()
+    with open(done_path) as f:
+        return {line.rstrip('\n') for line in f if line.strip()}
+
+
+def output_path_for(output_dir, key):
+    return os.path.join(output_dir, os.path.splitext(key)[0] + ".obj")
+
+
+class StageStats:
+    """Counts images and busy time for one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.failed = 0
+        self.busy = 0.0
+
+    def images_per_minute(self):
+        return 60.0 * self.count / self.busy if self.busy > 0 else 0.0
+
+
+def _run_stage(name, fn, inbox, outbox, stats, errors):
+    """Consumes items from inbox, applies fn and forwards the result until the stop sentinel arrives."""
+    while True:
+        item = inbox.get()
+        if item is _STOP:
+            if outbox is not None:
+                outbox.put(_STOP)
+            return
+        start = time.perf_counter()
+        try:
+            result = fn(item)
+        except Exception as e:
+            stats.failed += 1
+            errors.append((item["key"], name, str(e)))
+            print(f"[{name}] failed on {item['key']}: {e}")
+            continue
+        stats.busy += time.perf_counter() - start
+        stats.count += 1
+        if outbox is not None:
+            outbox.put(result)
+
+
+def report(stats, elapsed, total):
+    print(f"Processed {stats[-1].count}/{total} images in {elapsed:.1f}s "
+          f"({60.0 * stats[-1].count / elapsed if elapsed > 0 else 0.0:.2f} images/min overall)")
+    for s in stats:
+        print(f"  {s.name:<8} {s.count:>6} ok {s.failed:>4} failed {s.images_per_minute():>9.2f} images/min")
+
+
+def run_batch(source, output_dir, style=None, scale=1.5, method="delaunay", queue_size=4,
+              model_type="DPT_Large", model_path="models/midas/dpt_large-midas-2f21e586.pt", target_points=None):
+    """
+    Converts every image under source into an OBJ mesh in output_dir.
+
+    Decoding, depth inference, style transfer, projection/meshing and export run in their own
+    threads connected by bounded queues, so the stages overlap while memory stays bounded.
+    Models are loaded once up front. Finished inputs are appended to output_dir/.batch_done,
+    and a rerun skips them, so an interrupted backfill resumes where it stopped.
+
+    Returns:
+        list: The StageStats of each stage, in pipeline order.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    inputs = collect_inputs(source)
+    done = load_done(output_dir)
+    todo = [(key, path) for key, path in inputs if key not in done]
+    print(f"{len(inputs)} inputs, {len(inputs) - len(todo)} already done, {len(todo)} to process")
+    if not todo:
+        return []
+
+    # Load models once for the whole run
+    get_midas_model(model_type=model_type, model_path=model_path)
+    styled = style is not None and style != "photorealistic"
+    if styled:
+        load_model()
+
+    done_file = open(os.path.join(output_dir, DONE_FILE), "a")
+
+    def decode(item):
+        color_raw = cv2.imread(item["path"], cv2.IMREAD_COLOR)
+        if color_raw is None:
+            raise FileNotFoundError(f"Image not found at {item['path']}")
+        item["color"] = cv2.cvtColor(color_raw, cv2.COLOR_BGR2RGB)
+        return item
+
+    def depth(item):
+        item["depth"] = depth_from_array(item["color"], model_type=model_type, model_path=model_path,
+                                         output_size=working_grid_shape(item["color"].shape, target_points))
+        return item
+
+    def stylize(item):
+        if styled:
+            item["color"] = stylize_array(item["color"], style)
+        return item
+
+    def mesh(item):
+        pcd = project_cylindrical(item.pop("color"), item.pop("depth"), depth_scale_factor=scale)
+        if method == "slices":
+            item["mesh"] = slice_method(pcd)
+        elif method == "poisson":
+            item["mesh"] = poisson_method(pcd)
+        else:
+            item["mesh"] = delauny_method(pcd)
+        return item
+
+    def export(item):
+        out_path = output_path_for(output_dir, item["key"])
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        # Write next to the target and rename, so a crash never leaves a truncated mesh behind
+        tmp_path = out_path + ".tmp.obj"
+        write_triangle_mesh(tmp_path, item.pop("mesh"))
+        os.replace(tmp_path, out_path)
+        done_file.write(item["key"] + "\n")
+        done_file.flush()
+        return item
+
+    stages = [("decode", decode), ("depth", depth), ("style", stylize), ("mesh", mesh), ("export", export)]
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    stats = [StageStats(name) for name, _ in stages]
+    errors = []
+    threads = []
+    for i, (name, fn) in enumerate(stages):
+        outbox = queues[i + 1] if i + 1 < len(stages) else None
+        t = threading.Thread(target=_run_stage, args=(name, fn, queues[i], outbox, stats[i], errors),
+                             name=f"batch-{name}", daemon=True)
+        t.start()
+        threads.append(t)
+
+    start = time.perf_counter()
+    try:
+        for key, path in todo:
+            queues[0].put({"key": key, "path": path})
+        queues[0].put(_STOP)
+        for t in threads:
+            t.join()
+    finally:
+        done_file.close()
+
+    report(stats, time.perf_counter() - start, len(todo))
+    for key, name, message in errors:
+        print(f"  failed: {key} ({name}): {message}")
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert a directory or manifest of panoramas into 3D meshes")
+    parser.add_argument("--input", type=str, required=True, help="Directory of images or a manifest file with one path per line")
+    parser.add_argument("--output", type=str, required=True, help="Directory to write the OBJ meshes to")
+    parser.add_argument("--style", type=str, default="photorealistic", help="Style name from nst_styles/ or 'photorealistic'")
+    parser.add_argument("--scale", type=float, default=1.5, help="Depth scale factor")
+    parser.add_argument("--method", type=str, default="delaunay", choices=["delaunay", "slices", "poisson"], help="Meshing method")
+    parser.add_argument("--target_points", type=int, default=None, help="Working resolution as a point count (default: every pixel)")
+    parser.add_argument("--queue_size", type=int, default=4, help="Maximum number of images waiting between two stages")
+    parser.add_argument("--model_type", type=str, default="DPT_Large", choices=["DPT_Large", "DPT_Hybrid", "MiDaS_small"], help="Type of MiDaS model to use")
+    parser.add_argument("--model_path", type=str, default="models/midas/dpt_large-midas-2f21e586.pt", help="Path to the downloaded MiDaS model weights")
+    args = parser.parse_args()
+
+    run_batch(args.input, args.output, style=args.style, scale=args.scale, method=args.method,
+              queue_size=args.queue_size, model_type=args.model_type, model_path=args.model_path,
+              target_points=args.target_points)
@@ -1,65 +1,163 @@
 import open3d as o3d
 import numpy as np
 import cv2
+import math
+from scipy.spatial import cKDTree
 
-def depth_map_to_point_cloud(depth_image_path, intrinsic_matrix, rgb_image_path = None):
-    # Load the depth image
-    depth_image = o3d.io.read_image(depth_image_path)
-    depth_image_np = np.array(depth_image)
-    print(depth_image_np)
-    
-    # Extract the intrinsic parameters from the matrix
-    fx = intrinsic_matrix[0, 0]  # fx
-    fy = intrinsic_matrix[1, 1]  # fy
-    cx = intrinsic_matrix[0, 2]  # cx
-    cy = intrinsic_matrix[1, 2]  # cy
-
-    # Create the intrinsic camera object
-    intrinsic = o3d.camera.PinholeCameraIntrinsic()
-    
-    height, width = np.array(depth_image).shape
+# Rough cost of Poisson reconstruction per octree node/point, used to fit the octree depth to a time budget
+POISSON_SECONDS_PER_NODE = 2e-6
 
-    intrinsic.set_intrinsics(width, height, fx, fy, cx, cy)
+def pixel_grid(shape, stride=1, mask=None):
+    """
+    Selects the pixels that become points.
 
-    # Convert depth image to point cloud
-    pcd = o3d.geometry.PointCloud.create_from_depth_image(depth_image, intrinsic)
+    Args:
+        shape (tuple): (height, width) of the depth map.
+        stride (int): Keep every stride-th pixel along both axes.
+        mask (np.ndarray): Optional HxW boolean validity mask; pixels where it is False are skipped.
 
-    if rgb_image_path is not None:
-        # Load the RGB image
-        color_image = o3d.io.read_image(rgb_image_path)
+    Returns:
+        (np.ndarray, np.ndarray): Row (v) and column (u) indices of the selected pixels.
+    """
+    height, width = shape[:2]
+    v, u = np.mgrid[0:height:stride, 0:width:stride]
+    if mask is not None:
+        keep = np.asarray(mask, dtype=bool)[::stride, ::stride]
+        return v[keep], u[keep]
+    return v.ravel(), u.ravel()
+
+def working_grid_shape(shape, target_points=None):
+    """
+    Returns the (height, width) grid to resample an image to so it yields about target_points points.
+
+    The aspect ratio is kept and the grid is never larger than the image itself.
+
+    Args:
+        shape (tuple): (height, width, ...) of the full-resolution image.
+        target_points (int): Desired number of grid cells; None keeps the full resolution.
+    """
+    height, width = shape[:2]
+    if target_points is None or height * width <= target_points:
+        return height, width
+    scale = (target_points / (height * width)) ** 0.5
+    return max(1, int(round(height * scale))), max(1, int(round(width * scale)))
+
+def sample_colors(color, v, u):
+    """Returns the float32 colors in [0, 1] at the given pixels, or None when there is no color image."""
+    if color is None:
+        return None
+    return color[v, u, :3].astype(np.float32) * np.float32(1.0 / 255.0)
+
+def bin_points(points, colors, pixel_index, grid_shape, bin_size=2):
+    """
+    Averages the points (and colors) whose source pixels fall in the same bin_size x bin_size block of
+    the image grid. A numpy alternative to Open3D's voxel_down_sample that runs before any Open3D
+    object is built, so only the reduced set is ever converted.
+
+    Args:
+        points (np.ndarray): Nx3 array of positions.
+        colors (np.ndarray): Nx3 array of colors, or None.
+        pixel_index (np.ndarray): N flat (row-major) grid indices of the pixels the points came from.
+        grid_shape (tuple): (height, width) of the grid the indices refer to.
+        bin_size (int): Side of a block in grid pixels; 1 returns the input unchanged.
 
-        # Convert the RGB image to a numpy array and normalize
-        color_array = np.array(color_image) / 255.0
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray): The averaged float32 points and colors, and for every
+        block the grid index of its first pixel.
+    """
+    if bin_size <= 1 or len(points) == 0:
+        return points, colors, pixel_index
 
-        # Map RGB values to the point cloud based on the number of points
-        pcd.colors = o3d.utility.Vector3dVector(color_array.reshape(-1, 3))
+    width = grid_shape[1]
+    v, u = np.divmod(pixel_index, width)
+    blocks_per_row = -(-width // bin_size)
+    cell = (v // bin_size) * blocks_per_row + (u // bin_size)
 
+    # Group by block with one stable sort, then reduce each contiguous run
+    order = np.argsort(cell, kind="stable")
+    cell = cell[order]
+    starts = np.flatnonzero(np.r_[True, cell[1:] != cell[:-1]])
+    counts = np.diff(np.r_[starts, len(cell)]).astype(np.float32)[:, None]
+
+    binned_points = (np.add.reduceat(points[order], starts, axis=0) / counts).astype(np.float32)
+    binned_colors = None
+    if colors is not None:
+        binned_colors = (np.add.reduceat(colors[order], starts, axis=0) / counts).astype(np.float32)
+    return binned_points, binned_colors, pixel_index[order[starts]]
+
+def points_to_point_cloud(points, colors=None):
+    """
+    Builds an Open3D point cloud from numpy arrays. Shared by the pinhole and cylindrical projections.
+
+    Args:
+        points (np.ndarray): Nx3 array of positions.
+        colors (np.ndarray): Optional Nx3 array of RGB colors in [0, 1].
+
+    Returns:
+        o3d.geometry.PointCloud: The point cloud.
+    """
+    pcd = o3d.geometry.PointCloud()
+    pcd.points = o3d.utility.Vector3dVector(np.asarray(points, dtype=np.float64))
+    if colors is not None:
+        pcd.colors = o3d.utility.Vector3dVector(np.asarray(colors, dtype=np.float64))
     return pcd
 
-def depth_map_to_color_point_cloud(depth_image_path, intrinsic_matrix, rgb_image_path):
-    
-    depth_image = o3d.io.read_image(depth_image_path)
-    rgb_image = o3d.io.read_image(rgb_image_path)
+def backproject_pinhole(depth, intrinsic_matrix, color=None, stride=1, mask=None, depth_scale=1.0):
+    """
+    Back-projects a depth map through a pinhole camera, fully vectorized.
+
+    Args:
+        depth (np.ndarray): HxW depth map.
+        intrinsic_matrix (np.ndarray): 3x3 camera matrix (fx, fy, cx, cy are read from it).
+        color (np.ndarray): Optional HxWx3 uint8 RGB image aligned with depth.
+        stride (int): Keep every stride-th pixel along both axes.
+        mask (np.ndarray): Optional HxW boolean validity mask.
+        depth_scale (float): Depth values are divided by this (e.g. 1000 for millimetre PNGs).
 
-    # Intrinsic camera parameters
+    Returns:
+        (np.ndarray, np.ndarray): Nx3 float32 points and Nx3 float32 colors (None without a color image).
+    """
     fx, fy, cx, cy = intrinsic_matrix[0, 0], intrinsic_matrix[1, 1], intrinsic_matrix[0, 2], intrinsic_matrix[1, 2]
 
+    v, u = pixel_grid(depth.shape, stride=stride, mask=mask)
+    z = depth[v, u].astype(np.float32) / np.float32(depth_scale)
+
+    points = np.empty((len(z), 3), dtype=np.float32)
+    points[:, 0] = (u - cx) * z / fx
+    points[:, 1] = (v - cy) * z / fy
+    points[:, 2] = z
+
+    return points, sample_colors(color, v, u)
+
+def read_depth_and_color(depth_image_path, rgb_image_path=None):
+    """Reads a depth image unchanged and an optional color image as RGB."""
+    depth = cv2.imread(depth_image_path, cv2.IMREAD_UNCHANGED)
+    if depth is None:
+        raise FileNotFoundError(f"Depth image not found at {depth_image_path}")
+    if depth.ndim == 3:
+        depth = depth[..., 0]
+
+    color = None
+    if rgb_image_path is not None:
+        color = cv2.imread(rgb_image_path, cv2.IMREAD_COLOR)
+        if color is None:
+            raise FileNotFoundError(f"Image not found at {rgb_image_path}")
+        color = cv2.cvtColor(color, cv2.COLOR_BGR2RGB)
+    return depth, color
+
+def depth_map_to_point_cloud(depth_image_path, intrinsic_matrix, rgb_image_path = None, stride=1, depth_scale=1000.0):
+    # Load the depth (and color) image; zero depth is treated as missing, as Open3D does
+    depth, color = read_depth_and_color(depth_image_path, rgb_image_path)
+    points, colors = backproject_pinhole(depth, intrinsic_matrix, color=color, stride=stride,
+                                         mask=depth > 0, depth_scale=depth_scale)
+    return points_to_point_cloud(points, colors)
+
+def depth_map_to_color_point_cloud(depth_image_path, intrinsic_matrix, rgb_image_path, stride=1):
+    depth, color = read_depth_and_color(depth_image_path, rgb_image_path)
+
     # Generate point cloud and map colors
-    points = []
-    colors = []
-    for v in range(depth_image.shape[0]):  # Height
-        for u in range(depth_image.shape[1]):  # Width
-            z = depth_image[v, u] # Convert depth to meters if needed
-            x = (u - cx) * z / fx
-            y = (v - cy) * z / fy
-            points.append([x, y, z])
-            colors.append(rgb_image[v, u] / 255.0)  # Normalize RGB
-
-    # Create point cloud
-    point_cloud = o3d.geometry.PointCloud()
-    point_cloud.points = o3d.utility.Vector3dVector(np.array(points))
-    # Map colors
-    point_cloud.colors = o3d.utility.Vector3dVector(np.array(colors))
+    points, colors = backproject_pinhole(depth, intrinsic_matrix, color=color, stride=stride)
+    point_cloud = points_to_point_cloud(points, colors)
 
     # downsample the point cloud to remove noise
     point_cloud = point_cloud.voxel_down_sample(voxel_size=0.05)
@@ -69,16 +167,66 @@ def depth_map_to_color_point_cloud(depth_image_path, intrinsic_matrix, rgb_image
 
     return point_cloud
 
-def point_cloud_to_mesh(point_cloud, smooth=True, decimate=False):
+def choose_poisson_depth(num_points, time_budget=None, min_depth=6, max_depth=11):
+    """
+    Picks the Poisson octree depth from the point count and an optional time budget.
+
+    The finest octree level of a surface holds roughly 4**depth nodes, so the depth that gives about
+    one node per input point is used, then lowered until the estimated run time fits the budget.
+
+    Args:
+        num_points (int): Number of points in the cloud.
+        time_budget (float): Optional budget in seconds for the reconstruction.
+        min_depth (int): Lowest depth ever returned.
+        max_depth (int): Highest depth ever returned.
+
+    Returns:
+        int: The octree depth.
+    """
+    depth = math.ceil(math.log(max(num_points, 1), 4))
+    depth = max(min_depth, min(max_depth, depth))
+    if time_budget is not None:
+        while depth > min_depth and POISSON_SECONDS_PER_NODE * (4 ** depth + num_points) > time_budget:
+            depth -= 1
+    return depth
+
+def orient_normals_towards_origin(point_cloud, origin=(0.0, 0.0, 0.0)):
+    """
+    Orients normals towards the camera. Our clouds are seen from a known camera position, so a single
+    vectorized flip replaces the expensive orient_normals_consistent_tangent_plane graph traversal.
+    """
+    if not point_cloud.has_normals():
+        point_cloud.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=1.0, max_nn=30))
+    point_cloud.orient_normals_towards_camera_location(camera_location=np.asarray(origin, dtype=np.float64))
+    return point_cloud
+
+def remove_low_density_vertices(mesh, densities, quantile=0.1):
+    """Removes, in one masked call, the mesh vertices whose Poisson density is below the given quantile."""
+    densities = np.asarray(densities)
+    if quantile > 0 and len(densities):
+        mesh.remove_vertices_by_mask(densities < np.quantile(densities, quantile))
+    return mesh
+
+def transfer_colors(mesh, point_cloud):
+    """Colors every mesh vertex with its nearest point's color, using one batched KD-tree query."""
+    _, idx = cKDTree(np.asarray(point_cloud.points)).query(np.asarray(mesh.vertices), k=1)
+    mesh.vertex_colors = o3d.utility.Vector3dVector(np.asarray(point_cloud.colors)[idx])
+    return mesh
+
+def point_cloud_to_mesh(point_cloud, smooth=True, decimate=False, depth=None, time_budget=None):
     # # Estimate normals of the point cloud
     point_cloud.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=0.1, max_nn=30))
+    # The pinhole camera sits at the origin, looking down +Z
+    orient_normals_towards_origin(point_cloud)
     
     # point_cloud, ind = point_cloud.remove_statistical_outlier(nb_neighbors=20, std_ratio=2.0)
     # point_cloud = point_cloud.voxel_down_sample(voxel_size=0.05)
 
     # Apply Poisson Surface Reconstruction
+    if depth is None:
+        depth = choose_poisson_depth(len(point_cloud.points), time_budget=time_budget)
     mesh, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(
-        point_cloud, depth=9
+        point_cloud, depth=depth
     )
 
     # radii = [0.005, 0.01, 0.02, 0.04]
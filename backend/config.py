@@ -0,0 +1,73 @@
+import os
+
+# Server settings. Every value can be overridden with an environment variable of the same name
+# prefixed with MEMORYMAKE_ (e.g. MEMORYMAKE_ARTIFACT_TTL_SECONDS=3600).
+
+
+def _env(name, default, cast=str):
+    value = os.getenv(f"MEMORYMAKE_{name}")
+    return default if value is None else cast(value)
+
+
+def _flag(value):
+    return value.lower() in ("1", "true", "yes")
+
+
+# Rendered-artifact store
+ARTIFACT_DIR = _env("ARTIFACT_DIR", "rendered")
+ARTIFACT_MAX_BYTES = _env("ARTIFACT_MAX_BYTES", 2 * 1024 ** 3, int)
+ARTIFACT_TTL_SECONDS = _env("ARTIFACT_TTL_SECONDS", 7 * 24 * 3600, float)
+ARTIFACT_CACHE_MAX_AGE = _env("ARTIFACT_CACHE_MAX_AGE", 365 * 24 * 3600, int)
+
+# Upload ingestion
+UPLOAD_MAX_BYTES = _env("UPLOAD_MAX_BYTES", 50 * 1024 ** 2, int)
+# Uploads larger than this are decoded at reduced resolution / downscaled before any processing
+INGEST_MAX_PIXELS = _env("INGEST_MAX_PIXELS", 4096 * 2048, int)
+
+# Working resolution of the pipeline, as the number of depth samples projected into the point cloud
+TARGET_POINTS = _env("TARGET_POINTS", 1_000_000, int)
+
+# Admission control: (max concurrent, max waiting) per expensive pipeline stage
+DEPTH_LIMIT = (_env("DEPTH_CONCURRENCY", 1, int), _env("DEPTH_QUEUE", 4, int))
+STYLE_LIMIT = (_env("STYLE_CONCURRENCY", 1, int), _env("STYLE_QUEUE", 4, int))
+MESH_LIMIT = (_env("MESH_CONCURRENCY", 2, int), _env("MESH_QUEUE", 4, int))
+
+# CPU partitioning (see resources.py); 0 leaves the library default of one thread per core
+TORCH_THREADS = _env("TORCH_THREADS", 0, int)
+TORCH_INTEROP_THREADS = _env("TORCH_INTEROP_THREADS", 0, int)
+TF_INTRA_THREADS = _env("TF_INTRA_THREADS", 0, int)
+TF_INTER_THREADS = _env("TF_INTER_THREADS", 0, int)
+BLAS_THREADS = _env("BLAS_THREADS", 0, int)
+# Optional per-stage CPU affinity, e.g. "depth=0-3;style=4-5;mesh=6-7"
+STAGE_AFFINITY = _env("STAGE_AFFINITY", "")
+
+# Per-request memory budget (see memory_guard.py): requests estimated above it are run at a lower
+# working resolution, or rejected if even MIN_TARGET_POINTS does not fit
+MEMORY_BUDGET_BYTES = _env("MEMORY_BUDGET_BYTES", 4 * 1024 ** 3, int)
+MIN_TARGET_POINTS = _env("MIN_TARGET_POINTS", 65_536, int)
+# Also record tracemalloc deltas per stage (slows Python allocations down noticeably)
+MEMORY_TRACE = _env("MEMORY_TRACE", False, _flag)
+
+# Frameworks and models loaded at startup instead of on first use, e.g. "open3d,midas,style_model"
+# (see warmup.PRELOADERS). Empty keeps startup fast and loads everything lazily.
+PRELOAD = [name.strip() for name in _env("PRELOAD", "").split(",") if name.strip()]
+
+# Local model store (see model_store.py): a clone of https://github.com/isl-org/MiDaS provides the
+# architecture, the weights are memory-mapped from models/midas/. MODELS_OFFLINE forbids downloads.
+MIDAS_REPO_DIR = _env("MIDAS_REPO_DIR", "models/midas/MiDaS")
+MODELS_OFFLINE = _env("MODELS_OFFLINE", False, _flag)
+# Load PRELOAD at import time instead of at startup, for servers that fork workers after importing the app
+PRELOAD_BEFORE_FORK = _env("PRELOAD_BEFORE_FORK", False, _flag)
+
+# Width neural style transfer runs at (see neural_style_transfer.stylize_array); wider images are stylized
+# at this width and guided-upsampled. 0 stylizes at full resolution.
+STYLE_WORKING_WIDTH = _env("STYLE_WORKING_WIDTH", 0, int)
+
+# Rendered meshes whose geometry (mesh, panorama coordinates and content image) is kept for /restyle
+GEOMETRY_CACHE_ENTRIES = _env("GEOMETRY_CACHE_ENTRIES", 4, int)
+
+# Memory the in-process caches may hold on top of MEMORY_BUDGET_BYTES: the pipeline's intermediates
+# (depth maps, clouds and meshes shared across requests, see open_3d.STAGE_CACHE) and the geometry kept
+# for /restyle and /reproject
+STAGE_CACHE_MAX_BYTES = _env("STAGE_CACHE_MAX_BYTES", 1024 ** 3, int)
+GEOMETRY_CACHE_MAX_BYTES = _env("GEOMETRY_CACHE_MAX_BYTES", 1024 ** 3, int)
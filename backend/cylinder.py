@@ -1,104 +1,222 @@
 import numpy as np
-from scipy.spatial import Delaunay
+from concurrent.futures import ThreadPoolExecutor
+from scipy.spatial import Delaunay, QhullError
 import open3d as o3d
 
-def cartesian_to_cylindrical(points):
+def cartesian_to_cylindrical(points, up_axis=2):
     """
     Convert Cartesian coordinates to cylindrical coordinates.
     Args:
         points (np.ndarray): Nx3 array of points (x, y, z).
+        up_axis (int): Index of the cylinder axis (2 for z-up, 1 for the y-up clouds from open_3d).
     Returns:
-        np.ndarray: Nx3 array of cylindrical coordinates (r, theta, z).
+        np.ndarray: Nx3 array of cylindrical coordinates (r, theta, h), h being the coordinate along up_axis.
     """
-    x, y, z = points[:, 0], points[:, 1], points[:, 2]
+    a, b = [axis for axis in range(3) if axis != up_axis]
+    x, y, h = points[:, a], points[:, b], points[:, up_axis]
     r = np.sqrt(x**2 + y**2)
     theta = np.arctan2(y, x)
-    return np.column_stack((r, theta, z))
+    return np.column_stack((r, theta, h))
 
-def triangulate_slice(slice_points):
+def angular_extent(theta):
     """
-    Perform 2D Delaunay triangulation on a slice.
+    The sector of the circle the points occupy, found as the complement of the widest empty one.
+    Args:
+        theta (np.ndarray): Angles of the points, in [-pi, pi].
+    Returns:
+        (float, float): The angle the sector starts at and its width, going counterclockwise.
+    """
+    sorted_theta = np.sort(theta)
+    gaps = np.diff(np.append(sorted_theta, sorted_theta[0] + 2 * np.pi))
+    widest = np.argmax(gaps)
+    return sorted_theta[(widest + 1) % len(sorted_theta)], 2 * np.pi - gaps[widest]
+
+def unroll(cylindrical_points, radius=None):
+    """
+    Unroll cylindrical points onto the plane of the cylinder's surface.
+    Args:
+        cylindrical_points (np.ndarray): Nx3 array of cylindrical points (r, theta, h).
+        radius (float): Radius the angles are measured at (default: the points' median radius).
+    Returns:
+        np.ndarray: Nx2 array of (arc length, height).
+    """
+    if radius is None:
+        radius = np.median(cylindrical_points[:, 0])
+    return np.column_stack((cylindrical_points[:, 1] * radius, cylindrical_points[:, 2]))
+
+def planar_triangles(planar_points):
+    """
+    2D Delaunay triangulation without its zero-area triangles.
+    Args:
+        planar_points (np.ndarray): Nx2 array of points.
+    Returns:
+        np.ndarray: Mx3 int32 triangles (empty when the points are all on one line).
+    """
+    try:
+        simplices = Delaunay(planar_points).simplices
+    except QhullError:
+        return np.empty((0, 3), dtype=np.int32)
+    # Nearly collinear rows of points (a grid column, up to rounding) leave needles along the hull
+    a, b, c = (planar_points[simplices[:, i]] for i in range(3))
+    ab, ac = b - a, c - a
+    doubled_area = np.abs(ab[:, 0] * ac[:, 1] - ab[:, 1] * ac[:, 0])
+    longest = np.maximum.reduce([np.hypot(*ab.T), np.hypot(*ac.T), np.hypot(*(c - b).T)])
+    return simplices[doubled_area > 1e-9 * longest ** 2].astype(np.int32)
+
+def triangulate_slice(slice_points, radius=None):
+    """
+    Perform 2D Delaunay triangulation on a slice, unrolled onto the cylinder (see unroll).
     Args:
         slice_points (np.ndarray): Nx3 array of cylindrical points (r, theta, z).
+        radius (float): Unrolling radius (see unroll).
     Returns:
-        scipy.spatial.Delaunay: Delaunay triangulation object.
+        np.ndarray: Mx3 int32 triangles over the slice's points, or None for a slice of fewer than 3 points.
     """
     if len(slice_points) < 3:
         return None  # Not enough points for triangulation
 
-    r_z = slice_points[:, [0, 2]]  # Project to 2D plane (r, z)
-    return Delaunay(r_z)
+    return planar_triangles(unroll(slice_points, radius))
 
-def connect_slices(slice1, slice2):
+def connect_slices(slice1, slice2, radius=None):
     """
-    Connect points between two adjacent slices to form tetrahedra.
+    Stitch two adjacent slices: the points of both near their shared boundary are triangulated unrolled
+    onto the cylinder (arc length, height), and the triangles that span the seam are kept.
     Args:
-        slice1 (np.ndarray): Points from the first slice.
-        slice2 (np.ndarray): Points from the second slice.
+        slice1 (np.ndarray): Nx3 cylindrical points (r, theta, h) of the first slice, near the boundary.
+        slice2 (np.ndarray): Mx3 cylindrical points of the second slice, near the boundary; theta must be
+                             continuous with slice1's across the seam.
+        radius (float): Unrolling radius (see unroll); the slices' own should be the same.
     Returns:
-        list: List of tetrahedra (4 indices each).
+        np.ndarray: Kx3 int32 triangles over the points of slice1 followed by those of slice2.
     """
-    connections = []
-    for i, p1 in enumerate(slice1):
-        distances = np.linalg.norm(slice2 - p1, axis=1)
-        closest_idx = np.argmin(distances)
-        connections.append((i, closest_idx))
-
-    # Convert connections to tetrahedra (you may need to refine this logic)
-    tetrahedra = []
-    for c in connections:
-        tetrahedra.append([c[0], c[1], (c[0] + 1) % len(slice1), (c[1] + 1) % len(slice2)])
-    return tetrahedra
-
-def create_cylindrical_mesh(points, num_slices=10):
+    points = np.concatenate((slice1, slice2))
+    if len(slice1) == 0 or len(slice2) == 0 or len(points) < 3:
+        return np.empty((0, 3), dtype=np.int32)
+    simplices = planar_triangles(unroll(points, radius))
+    from_first = simplices < len(slice1)
+    seam = from_first.any(axis=1) & ~from_first.all(axis=1)
+    return simplices[seam]
+
+def create_cylindrical_mesh(points, num_slices=10, colors=None, up_axis=2, max_workers=None):
     """
-    Create a cylindrical mesh using radial Delaunay triangulation.
+    Create a cylindrical mesh using Delaunay triangulation of angular slices, unrolled onto the cylinder.
     Args:
         points (np.ndarray): Nx3 array of Cartesian points.
         num_slices (int): Number of angular slices.
+        colors (np.ndarray): Optional Nx3 array of RGB colors in [0, 1], one per point.
+        up_axis (int): Index of the cylinder axis in points (see cartesian_to_cylindrical).
+        max_workers (int): Size of the thread pool used to triangulate slices (None = executor default).
     Returns:
         o3d.geometry.TriangleMesh: The cylindrical mesh.
     """
-    # Convert points to cylindrical coordinates
-    cylindrical_points = cartesian_to_cylindrical(points)
-
-    # Slice the points into angular segments
-    
-
-    theta = cylindrical_points[:, 1]  # Theta values
-    slice_indices = np.digitize(theta, np.linspace(-np.pi, np.pi, num_slices + 1))
-    slices = [points[slice_indices == i] for i in range(1, num_slices + 1)]
-    
-
-    # Perform Delaunay triangulation on each slice
-    triangles = []
-    vertices = []
-    vertex_offset = 0
-
-    for slice_points in slices:
-        if len(slice_points) < 3:
-            continue
-
-        delaunay = triangulate_slice(slice_points)
-        if delaunay is not None:
-            # Append triangles with the vertex offset
-            triangles.extend(delaunay.simplices + vertex_offset)
-            vertices.extend(slice_points)
-            vertex_offset += len(slice_points)
-
-    # Convert triangles to a NumPy array
-    triangles = np.array(triangles, dtype=np.int32)
-
-    # Convert vertices to a NumPy array
-    vertices = np.array(vertices, dtype=np.float32)
+    vertex_index, triangles = cylindrical_mesh_arrays(points, num_slices=num_slices, up_axis=up_axis,
+                                                      max_workers=max_workers)
+    vertices = np.asarray(points, dtype=np.float32)[vertex_index]
 
     # Convert to Open3D mesh
     mesh = o3d.geometry.TriangleMesh()
     mesh.vertices = o3d.utility.Vector3dVector(vertices[:, :3])  # Convert back to Cartesian
     mesh.triangles = o3d.utility.Vector3iVector(triangles)
+    if colors is not None:
+        mesh.vertex_colors = o3d.utility.Vector3dVector(np.asarray(colors)[vertex_index])
     mesh.compute_vertex_normals()
     return mesh
 
+def cylindrical_mesh_arrays(points, num_slices=10, up_axis=2, max_workers=None):
+    """
+    The slice triangulation of create_cylindrical_mesh, as arrays.
+    Every slice is triangulated on its own, then each pair of adjacent slices is stitched along the
+    boundary they share (see connect_slices), using the points near it.
+    Returns:
+        (np.ndarray, np.ndarray): For every mesh vertex the index of its point in points, and the
+        Mx3 int32 triangles over the mesh vertices.
+    """
+    # Convert points to cylindrical coordinates
+    cylindrical_points = cartesian_to_cylindrical(points, up_axis=up_axis)
+
+    if len(points) == 0:
+        return np.empty(0, dtype=np.int64), np.empty((0, 3), dtype=np.int32)
+
+    # Slice the sector the points span, with theta measured from its start: the projected panoramas
+    # cover about half the circle with an edge at theta = +-pi, and slicing the whole circle from -pi
+    # would split the points at that edge between the first and the last slice. A cloud that closes
+    # the circle is sliced all around, and its last slice is stitched to the first.
+    start, span = angular_extent(cylindrical_points[:, 1])
+    closed = 2 * np.pi - span < span / num_slices
+    if closed:
+        span = 2 * np.pi
+    cylindrical_points[:, 1] = np.mod(cylindrical_points[:, 1] - start, 2 * np.pi)
+    theta = cylindrical_points[:, 1]  # Theta values
+    # One unrolling radius for every slice and seam, so that they share a parametrization
+    radius = np.median(cylindrical_points[:, 0])
+
+    # A single stable sort groups the point indices by slice, instead of building one boolean mask
+    # per slice. The points at the end of the sector would fall past the last edge.
+    edges = np.linspace(0, span, num_slices + 1)
+    slice_indices = np.minimum(np.digitize(theta, edges), num_slices)
+    order = np.argsort(slice_indices, kind="stable")
+    bounds = np.searchsorted(slice_indices[order], np.arange(1, num_slices + 2))
+    slices = {i: order[bounds[i]:bounds[i + 1]] for i in range(num_slices) if bounds[i + 1] - bounds[i] >= 3}
+
+    band = span / num_slices / 8
+    # Pairs of adjacent slices, with the points of each within an eighth of a slice of their shared boundary,
+    # or of the slice's outermost point when that is further (sparse clouds)
+    pairs = []
+    for i in slices:
+        j = i + 1
+        wraps = j == num_slices
+        if wraps:
+            if not closed or num_slices < 2:
+                continue
+            j = 0
+        if j not in slices:
+            continue
+        edge = edges[i + 1]
+        left_theta = theta[slices[i]]
+        right_theta = theta[slices[j]] + (2 * np.pi if wraps else 0.0)
+        left = slices[i][left_theta >= min(edge, left_theta.max()) - band]
+        right = slices[j][right_theta <= max(edge, right_theta.min()) + band]
+        pairs.append((left, right, wraps))
+
+    def stitch(pair):
+        left, right, wraps = pair
+        right_points = cylindrical_points[right]
+        if wraps:
+            right_points = right_points + np.array([0.0, 2 * np.pi, 0.0])
+        return connect_slices(cylindrical_points[left], right_points, radius)
+
+    # Perform Delaunay triangulation on each slice and seam in parallel (Qhull releases the GIL)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(lambda idx: triangulate_slice(cylindrical_points[idx], radius), slices.values()))
+        seams = list(executor.map(stitch, pairs))
+    parts = [(idx, simplices) for idx, simplices in zip(slices.values(), results) if simplices is not None]
+
+    # Assemble the slices into preallocated arrays
+    num_vertices = sum(len(idx) for idx, _ in parts)
+    num_triangles = sum(len(simplices) for _, simplices in parts)
+    vertex_index = np.empty(num_vertices, dtype=np.int64)
+    triangles = np.empty((num_triangles, 3), dtype=np.int32)
+
+    vertex_offset = 0
+    triangle_offset = 0
+    for idx, simplices in parts:
+        vertex_index[vertex_offset:vertex_offset + len(idx)] = idx
+        # Append triangles with the vertex offset
+        triangles[triangle_offset:triangle_offset + len(simplices)] = simplices + vertex_offset
+        vertex_offset += len(idx)
+        triangle_offset += len(simplices)
+
+    # Seam triangles index the slices' points; map them onto the mesh vertices
+    vertex_of_point = np.full(len(points), -1, dtype=np.int64)
+    vertex_of_point[vertex_index] = np.arange(num_vertices)
+    stitched = [triangles]
+    for (left, right, _), seam in zip(pairs, seams):
+        seam_vertices = vertex_of_point[np.concatenate((left, right))][seam]
+        stitched.append(seam_vertices[(seam_vertices >= 0).all(axis=1)].astype(np.int32))
+    triangles = np.concatenate(stitched)
+
+    return vertex_index, triangles
+
 def visualize_mesh(mesh):
     """
     Visualize the mesh using Open3D.
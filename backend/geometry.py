@@ -0,0 +1,98 @@
+import numpy as np
+import open3d as o3d
+from mesh_io import write_arrays, colors_to_uint8
+
+
+class Geometry:
+    """
+    A point cloud or triangle mesh as contiguous numpy arrays, passed between pipeline stages.
+
+    Positions are float32, colors uint8, triangle indices int32 and pixel_index holds, per vertex, the
+    flat working-grid index of the pixel it came from. Open3D objects are only built (to_point_cloud,
+    to_triangle_mesh) around the Open3D algorithms that need them, instead of every stage converting
+    back and forth through float64 Vector3dVector copies.
+    """
+
+    __slots__ = ("positions", "colors", "indices", "pixel_index", "normals")
+
+    def __init__(self, positions, colors=None, indices=None, pixel_index=None, normals=None):
+        self.positions = np.ascontiguousarray(positions, dtype=np.float32)
+        self.colors = None if colors is None else np.ascontiguousarray(colors_to_uint8(np.asarray(colors)))
+        self.indices = None if indices is None else np.ascontiguousarray(indices, dtype=np.int32)
+        self.pixel_index = None if pixel_index is None else np.ascontiguousarray(pixel_index, dtype=np.int32)
+        self.normals = None if normals is None else np.ascontiguousarray(normals, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def is_mesh(self):
+        return self.indices is not None
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.positions, self.colors, self.indices, self.pixel_index,
+                                              self.normals) if array is not None)
+
+    def float_colors(self):
+        """Colors as float32 in [0, 1], or None."""
+        if self.colors is None:
+            return None
+        return self.colors.astype(np.float32) * np.float32(1.0 / 255.0)
+
+    def with_colors(self, colors):
+        """A geometry sharing this one's arrays, with other vertex colors."""
+        return Geometry(self.positions, colors, self.indices, self.pixel_index, self.normals)
+
+    def to_point_cloud(self):
+        pcd = o3d.geometry.PointCloud()
+        pcd.points = o3d.utility.Vector3dVector(self.positions.astype(np.float64))
+        if self.colors is not None:
+            pcd.colors = o3d.utility.Vector3dVector(self.float_colors().astype(np.float64))
+        if self.normals is not None:
+            pcd.normals = o3d.utility.Vector3dVector(self.normals.astype(np.float64))
+        return pcd
+
+    def to_triangle_mesh(self):
+        mesh = o3d.geometry.TriangleMesh()
+        mesh.vertices = o3d.utility.Vector3dVector(self.positions.astype(np.float64))
+        mesh.triangles = o3d.utility.Vector3iVector(self.indices)
+        if self.colors is not None:
+            mesh.vertex_colors = o3d.utility.Vector3dVector(self.float_colors().astype(np.float64))
+        if self.normals is not None:
+            mesh.vertex_normals = o3d.utility.Vector3dVector(self.normals.astype(np.float64))
+        return mesh
+
+    @classmethod
+    def from_open3d(cls, geometry):
+        """Copies an Open3D PointCloud or TriangleMesh into a Geometry (pixel indices are not known)."""
+        if isinstance(geometry, o3d.geometry.TriangleMesh):
+            return cls(np.asarray(geometry.vertices),
+                       np.asarray(geometry.vertex_colors) if geometry.has_vertex_colors() else None,
+                       np.asarray(geometry.triangles),
+                       normals=np.asarray(geometry.vertex_normals) if geometry.has_vertex_normals() else None)
+        return cls(np.asarray(geometry.points),
+                   np.asarray(geometry.colors) if geometry.has_colors() else None,
+                   normals=np.asarray(geometry.normals) if geometry.has_normals() else None)
+
+    def write(self, target, format=None):
+        """Writes the geometry with mesh_io (see mesh_io.write_arrays for target and format)."""
+        write_arrays(target, self.positions, self.indices, self.colors, self.normals, format=format)
+
+
+def vertex_normals(positions, indices):
+    """Area-weighted, normalized vertex normals of a triangle mesh, as Open3D's compute_vertex_normals."""
+    normals = np.zeros((len(positions), 3), dtype=np.float64)
+    accumulate_normals(positions, indices, normals)
+    normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+    return normals.astype(np.float32)
+
+
+def accumulate_normals(positions, indices, normals):
+    """Adds the area-weighted normals of the triangles to their vertices' rows of normals."""
+    positions = positions.astype(np.float64, copy=False)
+    a, b, c = (positions[indices[:, i]] for i in range(3))
+    face_normals = np.cross(b - a, c - a)
+    for i in range(3):
+        for axis in range(3):
+            normals[:, axis] += np.bincount(indices[:, i], weights=face_normals[:, axis], minlength=len(normals))
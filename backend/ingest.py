@@ -0,0 +1,85 @@
+import io
+import hashlib
+import numpy as np
+import cv2
+from PIL import Image
+
+# OpenCV decodes JPEGs at 1/2, 1/4 or 1/8 scale directly in the DCT domain with these flags
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload exceeds the configured size limit."""
+
+
+async def read_upload(upload, max_bytes, chunk_size=1 << 20):
+    """
+    Reads an UploadFile in chunks, hashing it on the way and stopping as soon as it exceeds max_bytes.
+
+    Args:
+        upload (fastapi.UploadFile): The uploaded file.
+        max_bytes (int): Largest accepted upload.
+        chunk_size (int): Bytes read per chunk.
+
+    Returns:
+        (bytearray, str): The file contents, in the buffer they were read into (not copied to bytes), and
+        their SHA-256 hex digest.
+    """
+    digest = hashlib.sha256()
+    data = bytearray()
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        if len(data) + len(chunk) > max_bytes:
+            raise UploadTooLarge(f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit")
+        digest.update(chunk)
+        data += chunk
+    return data, digest.hexdigest()
+
+
+def image_size(data):
+    """Returns (width, height) from the image header without decoding the pixels."""
+    with Image.open(io.BytesIO(data)) as image:
+        return image.size
+
+
+def decode_image(data, max_pixels=None):
+    """
+    Decodes an encoded image from memory into an RGB array of at most max_pixels pixels.
+
+    When the image is at least twice as large (per side) as needed, it is decoded at a reduced
+    resolution, which for JPEGs skips most of the decoding work; any remaining excess is removed
+    with an area resize.
+
+    Args:
+        data (bytes or bytearray): The encoded image.
+        max_pixels (int): Optional upper bound on width * height of the result.
+
+    Returns:
+        numpy.ndarray: HxWx3 uint8 RGB image.
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    flag = cv2.IMREAD_COLOR
+    if max_pixels is not None:
+        width, height = image_size(data)
+        for factor, reduced_flag in REDUCED_DECODE_FLAGS:
+            if (width // factor) * (height // factor) >= max_pixels:
+                flag = reduced_flag
+                break
+
+    color_raw = cv2.imdecode(buffer, flag)
+    if color_raw is None:
+        raise ValueError("Could not decode the uploaded image")
+
+    height, width = color_raw.shape[:2]
+    if max_pixels is not None and width * height > max_pixels:
+        scale = (max_pixels / (width * height)) ** 0.5
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        color_raw = cv2.resize(color_raw, size, interpolation=cv2.INTER_AREA)
+
+    return cv2.cvtColor(color_raw, cv2.COLOR_BGR2RGB)
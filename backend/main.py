@@ -1,12 +1,35 @@
-from fastapi import FastAPI, File, UploadFile, Form, BackgroundTasks
-from fastapi.responses import FileResponse
+# Cap BLAS/OpenMP thread pools before numpy, scipy and Open3D are imported
+import resources
+resources.apply_thread_limits()
+
+import time
+_import_start = time.perf_counter()
+
+from fastapi import FastAPI, File, UploadFile, Form, BackgroundTasks, Request
+from fastapi.responses import FileResponse, Response, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import os
-import shutil
-import asyncio, time
-from open_3d import open_3d_main
+import asyncio
+from open_3d import open_3d_main, open_3d_from_array, render_styles, mesh_geometry, restyle_mesh, reproject_mesh, \
+    STAGE_CACHE
 import stable_diffusion
 from neural_style_transfer import apply_style_transfer
+from pipeline import StageCache
+from artifact_store import ArtifactStore, etag_for, etag_matches
+from ingest import read_upload, decode_image, image_size, UploadTooLarge
+from admission import AdmissionController, Overloaded
+from memory_guard import MemoryRecorder, MemoryBudgetExceeded, plan_request, RECENT_RECORDS
+from progress import JobRegistry, sse_format
+import config
+import warmup
+
+# torch and TensorFlow are not imported yet: they load with the first stage that needs them, or at startup via MEMORYMAKE_PRELOAD
+warmup.STARTUP_REPORT["server_imports"] = round(time.perf_counter() - _import_start, 3)
+
+# With MEMORYMAKE_PRELOAD_BEFORE_FORK the models load while this module is imported, so a pre-forking server
+# (gunicorn --preload -k uvicorn.workers.UvicornWorker main:app) loads them once and its workers share the pages
+if config.PRELOAD_BEFORE_FORK:
+    warmup.preload(config.PRELOAD)
 
 app = FastAPI()
 
@@ -17,100 +40,502 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Artifact-Name"],
 )
 
 # Define directories for uploads and rendered files
 UPLOAD_FOLDER = 'uploads'
-RENDERED_FOLDER = 'rendered'
+RENDERED_FOLDER = config.ARTIFACT_DIR
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'bmp', 'tiff'}
+STYLE_FOLDER = 'nst_styles'
 PUBLIC_DIR = os.path.join(os.getcwd(), "public")
 
 # Ensure the upload and rendered directories exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RENDERED_FOLDER, exist_ok=True)
 
+# Rendered meshes are kept under content-hash names and evicted by TTL and disk budget
+artifact_store = ArtifactStore(RENDERED_FOLDER, max_bytes=config.ARTIFACT_MAX_BYTES, ttl_seconds=config.ARTIFACT_TTL_SECONDS)
+
+# What /upload and /jobs can return: a mesh, or a point cloud for splat rendering
+OUTPUTS = ("mesh", "points")
+
+# Upper bound of the depth and vertical scales accepted by /reproject
+REPROJECT_MAX_SCALE = 10.0
+
+# Geometry of recently rendered meshes by artifact name, so /restyle only recolors
+geometry_cache = StageCache(max_entries=config.GEOMETRY_CACHE_ENTRIES, max_bytes=config.GEOMETRY_CACHE_MAX_BYTES)
+# Artifact names whose geometry is being recomputed (see recover_geometry)
+recovering = set()
+
+# Progress channels of the jobs started through /jobs
+jobs = JobRegistry()
+
+# Concurrency limits and bounded wait queues for the expensive pipeline stages
+admission = AdmissionController({
+    "depth": config.DEPTH_LIMIT,
+    "style": config.STYLE_LIMIT,
+    "mesh": config.MESH_LIMIT,
+})
+
+@app.on_event("startup")
+async def preload_models():
+    if not config.PRELOAD_BEFORE_FORK:
+        await asyncio.to_thread(warmup.preload, config.PRELOAD)
+    print("Startup times:")
+    warmup.report()
+
+def limited_stages(style: str):
+    # Photorealistic requests pass straight through the style stage and must not queue behind NST
+    return ["depth", "mesh"] if style in (None, "photorealistic") else ["depth", "style", "mesh"]
+
+def overloaded_response(e: Overloaded):
+    return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": str(e.retry_after)})
+
+def plan_memory(width: int, height: int, style: str, output: str = "mesh", styles: int = 1):
+    """
+    Picks the working resolution that keeps the request within the memory budget, before decoding.
+    styles is the number of artistic styles stylized in one batch (see /upload_styles).
+    """
+    target_points, max_pixels, estimate = plan_request(
+        height, width, config.TARGET_POINTS, config.MEMORY_BUDGET_BYTES, config.MIN_TARGET_POINTS,
+        styled=style not in (None, "photorealistic"), method="points" if output == "points" else "delaunay",
+        max_pixels=config.INGEST_MAX_PIXELS, style_width=config.STYLE_WORKING_WIDTH, styles=styles)
+    if target_points < min(config.TARGET_POINTS, width * height):
+        print(f"Downscaling to {target_points} points / {max_pixels} pixels to fit the memory budget "
+              f"(estimated {estimate / 1024 ** 2:.0f} MB)")
+    return target_points, max_pixels
+
+def plan_restyle(width: int, height: int):
+    """
+    Largest size style transfer on a stored image may run at within the memory budget. The image was
+    decoded for its original style, so a mesh first rendered photorealistic never had style transfer
+    budgeted. Raises MemoryBudgetExceeded.
+    """
+    # Only style transfer runs: leave the working resolution at its minimum and let the image size give way
+    _, max_pixels, estimate = plan_request(
+        height, width, config.MIN_TARGET_POINTS, config.MEMORY_BUDGET_BYTES, config.MIN_TARGET_POINTS,
+        styled=True, style_width=config.STYLE_WORKING_WIDTH)
+    if max_pixels < width * height:
+        print(f"Restyling at {max_pixels} pixels to fit the memory budget (estimated {estimate / 1024 ** 2:.0f} MB)")
+    return max_pixels
+
+def upload_request_key(digest: str, style: str, output: str = "mesh") -> str:
+    # Meshes keep the original key, which /restyle and /reproject build on
+    return f"{digest}:{style}" if output == "mesh" else f"{digest}:{style}:{output}"
+
+def known_style(style: str) -> bool:
+    return style == "photorealistic" or (os.path.basename(style) == style and os.path.exists(os.path.join(STYLE_FOLDER, f"{style}.jpg")))
+
 def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def artifact_response(name: str, request: Request = None):
+    """
+    Serves a stored artifact with a strong ETag and long-lived cache headers; FileResponse handles Range.
+    Clients that accept brotli or gzip get the precompressed variant, when it has been written.
+    """
+    path, encoding = artifact_store.variant(name, request.headers.get("accept-encoding") if request is not None else None)
+    etag = etag_for(name, encoding)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={config.ARTIFACT_CACHE_MAX_AGE}, immutable",
+        "X-Artifact-Name": name,
+        "Vary": "Accept-Encoding",
+    }
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    if request is not None and etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type='application/octet-stream', filename=name, headers=headers)
+
+def admit_upload(data: bytes, style: str, output: str = "mesh", styles: int = 1):
+    """
+    Everything that can refuse an upload before work starts: the memory budget (sized from the image
+    header) and admission control. Raises MemoryBudgetExceeded or Overloaded.
+    """
+    # Size the request from the image header: run it smaller, or refuse it, if it would not fit in memory
+    target_points, max_pixels = plan_memory(*image_size(data), style, output, styles)
+    # Reject right away when a stage we need cannot even queue us
+    limiters = admission.admit(limited_stages(style))
+    return target_points, max_pixels, limiters
+
+async def render_upload(data: bytes, digest: str, style: str, request_key: str, target_points: int, max_pixels: int,
+                        limiters: dict, progress=None, output: str = "mesh"):
+    """
+    Decodes and renders an admitted upload, stores the mesh (or, for output='points', the GLB splat
+    cloud) and returns its artifact name. Releases the admission reservations.
+    """
+    try:
+        # Decode once, at no more than the working resolution; depth and style share the array
+        color_raw = await asyncio.to_thread(decode_image, data, max_pixels)
+        del data
+        points = output == "points"
+        output_filename = os.path.join(UPLOAD_FOLDER, f"upload_{os.urandom(8).hex()}{'.glb' if points else '.obj'}")
+        memory = MemoryRecorder(request_key)
+        targets = ("splat_path",) if points else ("saved_path", "colored_mesh", "depth", "styled_color")
+        result = await asyncio.to_thread(open_3d_from_array, color_raw, save_path=output_filename,
+                                         content_key=digest, style=style, target_points=target_points,
+                                         limiters=limiters, memory=memory, progress=progress,
+                                         output=output, targets=targets)
+    finally:
+        # Stages served from the cache never used their reservations
+        admission.release(limiters)
+    RECENT_RECORDS.append(memory.summary())
+    print(f'Processing complete. Peak RSS {memory.peak_mb()} MB')
+    name = artifact_store.put(output_filename, request_key=request_key)
+    if not points:
+        geometry = mesh_geometry(result["colored_mesh"], color_raw, result["depth"], result["styled_color"])
+        remember_geometry(name, geometry, digest, style)
+    return name
+
+def remember_geometry(name: str, geometry: dict, digest: str, style: str, projection: str = ""):
+    """
+    Keeps a rendered mesh's geometry for /restyle and /reproject. The artifact's request key is
+    f"{digest}:{style}{projection}", where projection is empty for the default projection parameters.
+    """
+    geometry_cache.put(name, {**geometry, "digest": digest, "style": style, "projection": projection})
+
+async def recover_geometry(names: dict, data: bytes, digest: str):
+    """
+    Recomputes the geometry of stored meshes that have dropped out of geometry_cache (or were rendered
+    before a restart), so uploading the image again makes them restylable for as long as the artifacts
+    are kept. Runs as a background task, after the stored meshes have been served. All the styles share
+    one render_styles call (depth and mesh once, one batched style transfer), and depth comes from the
+    stage cache when it is still there. Best effort: when it is refused or fails, the geometry stays
+    missing.
+
+    Args:
+        names (dict): Artifact names by style, all renders of the image in data.
+    """
+    names = {style: name for style, name in names.items()
+             if geometry_cache.get(name) is None and name not in recovering}
+    if not names:
+        return
+    recovering.update(names.values())
+    limiters = {}
+    try:
+        artistic = [style for style in names if style != "photorealistic"]
+        target_points, max_pixels, limiters = admit_upload(data, artistic[0] if artistic else "photorealistic",
+                                                           styles=max(1, len(artistic)))
+        color_raw = await asyncio.to_thread(decode_image, data, max_pixels)
+        geometries = await asyncio.to_thread(render_styles, color_raw, list(names), content_key=digest,
+                                             target_points=target_points, limiters=limiters)
+        for style, name in names.items():
+            remember_geometry(name, geometries[style], digest, style)
+    except Exception as e:
+        print(f"Could not recover the geometry of {', '.join(names.values())}: {e}")
+    finally:
+        admission.release(limiters)
+        recovering.difference_update(names.values())
+
 @app.post("/upload")  # Removed trailing slash to match frontend
-async def upload_file(file: UploadFile = File(...), style: str = Form(...), background_tasks: BackgroundTasks = None):
+async def upload_file(request: Request, file: UploadFile = File(...), style: str = Form(...), output: str = Form("mesh"),
+                      background_tasks: BackgroundTasks = None):
+    """output='points' returns a quantized GLB point cloud for splat rendering instead of a mesh."""
     try:
         if not file or not style:
-            return {"error": "Both file and style are required"}, 400
+            return JSONResponse({"error": "Both file and style are required"}, status_code=400)
             
         if not allowed_file(file.filename):
-            return {"error": "Invalid file format"}, 400
-
-        # Create a unique filename
-        file_extension = file.filename.rsplit('.', 1)[1].lower()
-        unique_file_first = f"upload_{os.urandom(8).hex()}"
-        unique_filename = f"{unique_file_first}.{file_extension}"
-        
-        # Save the uploaded file
-        file_location = os.path.join(UPLOAD_FOLDER, unique_filename)
-        with open(file_location, "wb+") as f:
-            shutil.copyfileobj(file.file, f)
-
-        print("File saved at: ", file_location)
+            return JSONResponse({"error": "Invalid file format"}, status_code=400)
+
+        if output not in OUTPUTS:
+            return JSONResponse({"error": f"output must be one of {OUTPUTS}"}, status_code=400)
+
+        # Stream the upload into memory while hashing it; nothing is written to uploads/
+        try:
+            data, digest = await read_upload(file, config.UPLOAD_MAX_BYTES)
+        except UploadTooLarge as e:
+            return JSONResponse({"error": str(e)}, status_code=413)
+
+        print("Upload received: ", file.filename, len(data), "bytes")
         print("Style: ", style)
 
-        output_filename = os.path.join(RENDERED_FOLDER, f"{unique_file_first}.obj")
-        await asyncio.to_thread(open_3d_main, file_location, save_path=output_filename, style=style)
-        print('Processing complete.')
+        # The same image with the same style has been rendered before: serve the stored mesh
+        request_key = upload_request_key(digest, style, output)
+        name = artifact_store.lookup(request_key)
+        if name is None:
+            target_points, max_pixels, limiters = admit_upload(data, style, output)
+            name = await render_upload(data, digest, style, request_key, target_points, max_pixels, limiters,
+                                       output=output)
+        elif output == "mesh" and geometry_cache.get(name) is None:
+            background_tasks.add_task(recover_geometry, {style: name}, data, digest)
 
-        # Clean up the uploaded file after processing
-        background_tasks.add_task(cleanup, file_location)
+        return artifact_response(name, request)
+    except Overloaded as e:
+        return overloaded_response(e)
+    except MemoryBudgetExceeded as e:
+        return JSONResponse({"error": str(e)}, status_code=413)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@app.post("/upload_styles")
+async def upload_styles(file: UploadFile = File(...), styles: str = Form(...), background_tasks: BackgroundTasks = None):
+    """
+    Renders one image in several styles (comma-separated names from nst_styles/, or 'photorealistic').
+    Depth and geometry are computed once and all styles share one batched style-transfer call.
+
+    Returns:
+        {style: {"artifact": name, "url": "/rendered_file/<name>"}}
+    """
+    try:
+        style_list = list(dict.fromkeys(style.strip() for style in styles.split(",") if style.strip()))
+        unknown = [style for style in style_list if not known_style(style)]
+        if not style_list or unknown:
+            return JSONResponse({"error": f"Unknown styles: {unknown}" if unknown else "No styles given"}, status_code=400)
+        if not allowed_file(file.filename):
+            return JSONResponse({"error": "Invalid file format"}, status_code=400)
+        try:
+            data, digest = await read_upload(file, config.UPLOAD_MAX_BYTES)
+        except UploadTooLarge as e:
+            return JSONResponse({"error": str(e)}, status_code=413)
+
+        # Styles rendered before are served from the store; the others share one pipeline run
+        names = {style: artifact_store.lookup(f"{digest}:{style}") for style in style_list}
+        missing = [style for style in style_list if names[style] is None]
+        cached = {style: name for style, name in names.items() if name is not None}
+        if any(geometry_cache.get(name) is None for name in cached.values()):
+            background_tasks.add_task(recover_geometry, cached, data, digest)
+        if missing:
+            artistic = [style for style in missing if style != "photorealistic"]
+            target_points, max_pixels, limiters = admit_upload(data, artistic[0] if artistic else "photorealistic",
+                                                               styles=max(1, len(artistic)))
+            try:
+                color_raw = await asyncio.to_thread(decode_image, data, max_pixels)
+            except Exception:
+                admission.release(limiters)
+                raise
+            del data
+            save_paths = [os.path.join(UPLOAD_FOLDER, f"upload_{os.urandom(8).hex()}.obj") for _ in missing]
+            memory = MemoryRecorder(f"{digest}:{','.join(missing)}")
+            try:
+                geometries = await asyncio.to_thread(render_styles, color_raw, missing, save_paths, content_key=digest,
+                                                     target_points=target_points, limiters=limiters, memory=memory)
+            finally:
+                admission.release(limiters)
+            RECENT_RECORDS.append(memory.summary())
+            for style, save_path in zip(missing, save_paths):
+                names[style] = artifact_store.put(save_path, request_key=f"{digest}:{style}")
+                remember_geometry(names[style], geometries[style], digest, style)
+
+        return {style: {"artifact": name, "url": f"/rendered_file/{name}"} for style, name in names.items()}
+    except Overloaded as e:
+        return overloaded_response(e)
+    except MemoryBudgetExceeded as e:
+        return JSONResponse({"error": str(e)}, status_code=413)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@app.post("/restyle")
+async def restyle(obj: dict, request: Request):
+    """
+    Re-renders a mesh from /upload or /upload_styles in another style, reusing its geometry:
+    {"artifact": "<name>", "style": "<style>"}. Only style transfer runs.
+    """
+    try:
+        name = obj.get("artifact")
+        style = obj.get("style")
+        if not name or not style or not known_style(style):
+            return JSONResponse({"error": "A rendered artifact and a known style are required"}, status_code=400)
+        geometry = geometry_cache.get(name)
+        if geometry is None:
+            return JSONResponse({"error": "The geometry of this mesh is no longer kept; upload the image again "
+                                          "in the style it was rendered in, and use the returned artifact"},
+                                status_code=404)
+
+        request_key = f"{geometry['digest']}:{style}{geometry['projection']}"
+        restyled = artifact_store.lookup(request_key)
+        if restyled is None:
+            reservations, max_pixels = {}, None
+            if style != "photorealistic":
+                height, width = geometry["color"].shape[:2]
+                max_pixels = plan_restyle(width, height)
+                reservations = admission.admit(["style"])
+            output_filename = os.path.join(UPLOAD_FOLDER, f"restyle_{os.urandom(8).hex()}.obj")
+            try:
+                restyled_geometry = await asyncio.to_thread(restyle_mesh, geometry, style, output_filename,
+                                                            limiter=reservations.get("style"), max_pixels=max_pixels)
+            finally:
+                admission.release(reservations)
+            restyled = artifact_store.put(output_filename, request_key=request_key)
+            remember_geometry(restyled, restyled_geometry, geometry["digest"], style, geometry["projection"])
+        return artifact_response(restyled, request)
+    except Overloaded as e:
+        return overloaded_response(e)
+    except MemoryBudgetExceeded as e:
+        return JSONResponse({"error": str(e)}, status_code=413)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@app.post("/reproject")
+async def reproject(obj: dict, request: Request):
+    """
+    Rebuilds a rendered mesh with another depth scale and/or vertical scale, from its stored depth map
+    and colors: {"artifact": "<name>", "scale": 1.5, "vertical_scale": 1.4}. Depth estimation and style
+    transfer do not run, so the viewer's sliders can call this interactively.
+    """
+    try:
+        name = obj.get("artifact")
+        geometry = geometry_cache.get(name) if name else None
+        if geometry is None:
+            return JSONResponse({"error": "The geometry of this mesh is no longer kept; upload the image again "
+                                          "in the style it was rendered in, and use the returned artifact"},
+                                status_code=404)
+        try:
+            scale = float(obj.get("scale", geometry["scale"]))
+            vertical_scale = float(obj.get("vertical_scale", geometry["vertical_scale"]))
+        except (TypeError, ValueError):
+            return JSONResponse({"error": "scale and vertical_scale must be numbers"}, status_code=400)
+        if not (0 < scale <= REPROJECT_MAX_SCALE and 0 < vertical_scale <= REPROJECT_MAX_SCALE):
+            return JSONResponse({"error": f"scale and vertical_scale must be in (0, {REPROJECT_MAX_SCALE}]"},
+                                status_code=400)
 
-        # Cleanup the rendered file after a certain time
-        background_tasks.add_task(cleanup, output_filename)
+        colors_key = f"{geometry['digest']}:{geometry['style']}"
+        projection = f":scale={scale:g}:vertical_scale={vertical_scale:g}"
+        request_key = colors_key + projection
+        reprojected = artifact_store.lookup(request_key)
+        if reprojected is None:
+            limiters = admission.admit(["mesh"])
+            output_filename = os.path.join(UPLOAD_FOLDER, f"reproject_{os.urandom(8).hex()}.obj")
+            try:
+                new_geometry = await asyncio.to_thread(reproject_mesh, geometry, output_filename, scale=scale,
+                                                       vertical_scale=vertical_scale,
+                                                       content_key=colors_key, limiters=limiters)
+            finally:
+                admission.release(limiters)
+            reprojected = artifact_store.put(output_filename, request_key=request_key)
+            remember_geometry(reprojected, new_geometry, geometry["digest"], geometry["style"], projection)
+        return artifact_response(reprojected, request)
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@app.post("/jobs")
+async def start_job(file: UploadFile = File(...), style: str = Form(...), output: str = Form("mesh"),
+                    background_tasks: BackgroundTasks = None):
+    """
+    Same as /upload, but answers at once with a job id; GET /jobs/{job_id}/events then streams the job's
+    stage events and the final artifact name. Refusals (413/503) are still immediate.
+    """
+    try:
+        if not allowed_file(file.filename):
+            return JSONResponse({"error": "Invalid file format"}, status_code=400)
+        if output not in OUTPUTS:
+            return JSONResponse({"error": f"output must be one of {OUTPUTS}"}, status_code=400)
+        try:
+            data, digest = await read_upload(file, config.UPLOAD_MAX_BYTES)
+        except UploadTooLarge as e:
+            return JSONResponse({"error": str(e)}, status_code=413)
 
-        return FileResponse(output_filename, media_type='application/octet-stream', filename=unique_file_first + '.obj')
+        job_id = os.urandom(8).hex()
+        request_key = upload_request_key(digest, style, output)
+        name = artifact_store.lookup(request_key)
+        if name is not None:
+            channel = jobs.create(job_id, asyncio.get_running_loop())
+            channel.publish("done", artifact=name, url=f"/rendered_file/{name}", cached=True)
+            if output == "mesh" and geometry_cache.get(name) is None:
+                background_tasks.add_task(recover_geometry, {style: name}, data, digest)
+        else:
+            # Refused requests get no channel: only admitted jobs take a place in the registry
+            target_points, max_pixels, limiters = admit_upload(data, style, output)
+            channel = jobs.create(job_id, asyncio.get_running_loop())
+
+            async def run():
+                try:
+                    name = await render_upload(data, digest, style, request_key, target_points, max_pixels,
+                                               limiters, progress=channel.publish, output=output)
+                    channel.publish("done", artifact=name, url=f"/rendered_file/{name}", cached=False)
+                except Exception as e:
+                    channel.publish("error", error=str(e))
+
+            channel.task = asyncio.create_task(run())
+        return JSONResponse({"job_id": job_id, "events": f"/jobs/{job_id}/events"}, status_code=202)
+    except Overloaded as e:
+        return overloaded_response(e)
+    except MemoryBudgetExceeded as e:
+        return JSONResponse({"error": str(e)}, status_code=413)
     except Exception as e:
-        return {"error": str(e)}, 500
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events of a job: stage start/finish/cached with counts and coarse previews, then done or error."""
+    channel = jobs.get(job_id)
+    if channel is None:
+        return JSONResponse({"error": "Job not found"}, status_code=404)
+
+    async def stream():
+        async for event in channel.subscribe():
+            yield sse_format(event)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.post("/generate")
-async def generate_from_prompt(obj: dict, background_tasks: BackgroundTasks = None):
+async def generate_from_prompt(obj: dict, request: Request, background_tasks: BackgroundTasks = None):
     try:
         prompt = obj.get("prompt")
         style = obj.get("style").lower()
         if not prompt or not style:
-            return {"error": "Prompt and style are required"}, 400
+            return JSONResponse({"error": "Prompt and style are required"}, status_code=400)
 
-        # Generate file paths
-        file_id = os.urandom(4).hex()
-        save_image_path = f"uploads/generated_{file_id}.png"
-        output_filename = f"rendered/generated_{file_id}.obj"
+        limiters = admission.admit(limited_stages("photorealistic"))
 
-        # NOTE: This uses the Hugging Face Inference API, which is not provided with the code
-        stable_diffusion.generate_image(prompt, style, save_image_path)
+        try:
+            # Generate file paths
+            file_id = os.urandom(4).hex()
+            save_image_path = f"uploads/generated_{file_id}.png"
+            output_filename = f"uploads/generated_{file_id}.obj"
 
-        # TODO: If you wish to run the generative model locally,
-        # uncomment the line below and comment the above line
-        # stable_diffusion.generate_image_local(prompt, style, save_image_path)
+            # NOTE: This uses the Hugging Face Inference API, which is not provided with the code
+            stable_diffusion.generate_image(prompt, style, save_image_path)
 
-        print(f"Image saved at: {save_image_path}")
+            # TODO: If you wish to run the generative model locally,
+            # uncomment the line below and comment the above line
+            # stable_diffusion.generate_image_local(prompt, style, save_image_path)
 
-        # Process the image to generate 3D object
-        await asyncio.to_thread(open_3d_main, save_image_path, save_path=output_filename, style="photorealistic")
-            
-        print(f"Processing complete. OBJ saved at: {output_filename}")
+            print(f"Image saved at: {save_image_path}")
+
+            # Process the image to generate 3D object
+            with open(save_image_path, "rb") as f:
+                target_points, _ = plan_memory(*image_size(f.read()), "photorealistic")
+            memory = MemoryRecorder(f"generated_{file_id}")
+            await asyncio.to_thread(open_3d_main, save_image_path, save_path=output_filename, style="photorealistic",
+                                    target_points=target_points, limiters=limiters, memory=memory)
+            RECENT_RECORDS.append(memory.summary())
+        finally:
+            admission.release(limiters)
+
+        name = artifact_store.put(output_filename)
+        print(f"Processing complete. OBJ stored as: {name}")
 
         # Clean up the generated image file after processing
         background_tasks.add_task(cleanup, save_image_path)
 
-        # Cleanup the rendered file after a certain time
-        background_tasks.add_task(cleanup, output_filename)
-
-        return FileResponse(output_filename, media_type='application/octet-stream', filename=f"generated_{file_id}.obj")
+        return artifact_response(name, request)
+    except Overloaded as e:
+        return overloaded_response(e)
+    except MemoryBudgetExceeded as e:
+        return JSONResponse({"error": str(e)}, status_code=413)
     except Exception as e:
-        return {"error": str(e)}, 500
+        return JSONResponse({"error": str(e)}, status_code=500)
 
 @app.get("/rendered_file/{file_name}")
-async def get_rendered_file(file_name: str):
-    file_path = os.path.join(RENDERED_FOLDER, file_name)
-    if os.path.exists(file_path):
-        return FileResponse(file_path, media_type='application/octet-stream', filename=file_name)
-    return {"error": "File not found"}, 404
+async def get_rendered_file(file_name: str, request: Request):
+    if artifact_store.get(file_name) is not None:
+        return artifact_response(file_name, request)
+    return JSONResponse({"error": "File not found"}, status_code=404)
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Queue depths, running counts and admission/rejection counters, for autoscaling, recent per-stage memory
+    and the memory held by the in-process caches.
+    """
+    return {"admission": admission.stats(), "memory": list(RECENT_RECORDS), "startup": warmup.STARTUP_REPORT,
+            "caches": {"stage": STAGE_CACHE.stats(), "geometry": geometry_cache.stats()}}
 
 # Background task to clean up the image file
 def cleanup(path: str):
@@ -0,0 +1,175 @@
+import os
+import time
+import threading
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+import config
+
+MB = 1024 ** 2
+
+# Rough per-element memory costs of the pipeline, used by estimate_peak_bytes. Refine them from the
+# per-stage records exposed on /metrics for the deployed models and meshers.
+DECODE_BYTES_PER_PIXEL = 3 + 4          # RGB image + a working copy during color conversion
+STYLE_BYTES_PER_PIXEL = 120             # TF activations of the Magenta network, per stylized pixel
+GUIDED_BYTES_PER_PIXEL = 80             # Full-resolution coefficients of the fast style mode's guided upsampling
+PROJECT_BYTES_PER_GRID_POINT = 96       # r, mask, pixel indices, theta, coordinates, points and colors
+CLOUD_BYTES_PER_POINT = 20              # float32 positions, uint8 colors and int32 pixel indices (geometry.Geometry)
+MESH_BYTES_PER_POINT = {"delaunay": 400, "slices": 300, "poisson": 900, "points": 40}
+DEPTH_BASE_BYTES = 600 * MB             # DPT_Large activations at 384x384, independent of image size
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when a request cannot be brought under the memory budget by downscaling."""
+
+
+def current_rss():
+    """Resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        # ru_maxrss is the lifetime peak (KiB on Linux), the best available fallback
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryRecorder:
+    """
+    Records, for every pipeline stage of one request, the peak RSS seen while it ran (sampled from a
+    background thread) and, when tracemalloc is enabled, the Python/numpy allocation delta and peak.
+
+    RSS is process-wide, so under concurrency a stage's peak also includes the other requests.
+    """
+
+    def __init__(self, request_id=None, sample_interval=0.005, trace=None):
+        self.request_id = request_id
+        self.sample_interval = sample_interval
+        self.trace = config.MEMORY_TRACE if trace is None else trace
+        self.stages = {}
+        if self.trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        start_rss = current_rss()
+        peak = [start_rss]
+        stop = threading.Event()
+
+        def sample():
+            while not stop.wait(self.sample_interval):
+                peak[0] = max(peak[0], current_rss())
+
+        sampler = threading.Thread(target=sample, name=f"memory-{name}", daemon=True)
+        sampler.start()
+        traced_before = tracemalloc.get_traced_memory()[0] if self.trace else 0
+        if self.trace:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stop.set()
+            sampler.join()
+            end_rss = current_rss()
+            record = {
+                "seconds": round(time.perf_counter() - start, 3),
+                "rss_start_mb": round(start_rss / MB, 1),
+                "rss_peak_mb": round(max(peak[0], end_rss) / MB, 1),
+                "rss_delta_mb": round((end_rss - start_rss) / MB, 1),
+            }
+            if self.trace:
+                traced_now, traced_peak = tracemalloc.get_traced_memory()
+                record["traced_delta_mb"] = round((traced_now - traced_before) / MB, 1)
+                record["traced_peak_mb"] = round((traced_peak - traced_before) / MB, 1)
+            self.stages[name] = record
+
+    def peak_mb(self):
+        return max((record["rss_peak_mb"] for record in self.stages.values()), default=0.0)
+
+    def summary(self):
+        return {"request_id": self.request_id, "peak_rss_mb": self.peak_mb(), "stages": self.stages}
+
+
+# Most recent per-request records, served on /metrics
+RECENT_RECORDS = deque(maxlen=50)
+
+
+def grid_points(height, width, target_points):
+    pixels = height * width
+    return pixels if target_points is None else min(pixels, target_points)
+
+
+def estimate_peak_bytes(height, width, target_points=None, bin_size=2, styled=False, method="delaunay",
+                        style_width=0, styles=1):
+    """
+    Predicts the extra memory a request needs on top of the loaded models.
+
+    Args:
+        height (int), width (int): Size of the decoded image.
+        target_points (int): Working resolution (see working_grid_shape).
+        bin_size (int): Grid binning block size.
+        styled (bool): Whether style transfer runs.
+        method (str): Meshing method.
+        style_width (int): Working width of style transfer (see neural_style_transfer.stylize_array).
+        styles (int): Number of styles stylized together in one batched call (see stylize_array_batch).
+
+    Returns:
+        int: Estimated peak bytes.
+    """
+    pixels = height * width
+    grid = grid_points(height, width, target_points)
+    cloud = grid / max(1, bin_size) ** 2
+
+    decoded = pixels * DECODE_BYTES_PER_PIXEL
+    if not styled:
+        style = 0
+    elif 0 < style_width < width:
+        style = (style_width * (style_width // 2)) * STYLE_BYTES_PER_PIXEL + pixels * GUIDED_BYTES_PER_PIXEL
+    else:
+        style = pixels * STYLE_BYTES_PER_PIXEL
+    # A batched call holds every style's activations and content copy at once
+    style *= max(1, styles)
+    stages = [
+        DEPTH_BASE_BYTES,
+        style,
+        grid * PROJECT_BYTES_PER_GRID_POINT + cloud * CLOUD_BYTES_PER_POINT,
+        cloud * (CLOUD_BYTES_PER_POINT + MESH_BYTES_PER_POINT.get(method, 400)),
+    ]
+    # Stages run one after another; the decoded image stays alive throughout
+    return int(decoded + max(stages))
+
+
+def plan_request(height, width, target_points, budget_bytes, min_target_points, bin_size=2, styled=False,
+                 method="delaunay", max_pixels=None, style_width=0, styles=1):
+    """
+    Fits a request into the memory budget before it runs.
+
+    The working resolution is halved, and if needed the decode size too, until the estimate fits.
+
+    Returns:
+        (int, int, int): (target_points, max_pixels, estimated bytes) to run the request with.
+
+    Raises:
+        MemoryBudgetExceeded: If the request does not fit even at min_target_points.
+    """
+    if max_pixels is not None and height * width > max_pixels:
+        scale = (max_pixels / (height * width)) ** 0.5
+        height, width = int(height * scale), int(width * scale)
+    max_pixels = height * width
+    target_points = grid_points(height, width, target_points)
+
+    estimate = estimate_peak_bytes(height, width, target_points, bin_size, styled, method, style_width, styles)
+    while estimate > budget_bytes:
+        if target_points > min_target_points:
+            target_points = max(min_target_points, target_points // 2)
+        elif max_pixels > min_target_points:
+            max_pixels = max(min_target_points, max_pixels // 2)
+            scale = (max_pixels / (height * width)) ** 0.5
+            height, width = max(1, int(height * scale)), max(1, int(width * scale))
+            target_points = min(target_points, height * width)
+        else:
+            raise MemoryBudgetExceeded(
+                f"Request needs an estimated {estimate / MB:.0f} MB, over the {budget_bytes / MB:.0f} MB budget")
+        estimate = estimate_peak_bytes(height, width, target_points, bin_size, styled, method, style_width, styles)
+    return target_points, max_pixels, estimate
@@ -0,0 +1,375 @@
+import io
+import os
+import json
+import struct
+from contextlib import contextmanager
+import numpy as np
+
+# Mesh export straight from numpy arrays: OBJ through chunked bulk string formatting, binary PLY and
+# GLB through raw buffer writes. Targets can be a path, a binary file-like object (e.g. io.BytesIO)
+# or a socket, so a mesh can be sent without touching the disk.
+
+FORMATS = ("obj", "ply", "glb")
+# Rows converted and written per call, which bounds the temporary copies
+CHUNK_ROWS = 1 << 16
+
+GLB_MAGIC = 0x46546C67
+GLB_JSON_CHUNK = 0x4E4F534A
+GLB_BIN_CHUNK = 0x004E4942
+# glTF enums
+GL_FLOAT = 5126
+GL_UNSIGNED_BYTE = 5121
+GL_SHORT = 5122
+GL_UNSIGNED_INT = 5125
+GL_ARRAY_BUFFER = 34962
+GL_ELEMENT_ARRAY_BUFFER = 34963
+GL_POINTS = 0
+GL_TRIANGLES = 4
+# Quantized positions use the symmetric int16 range
+QUANTIZED_MAX = 32767
+
+
+def format_for(target, format=None):
+    """The output format: format if given, else the extension of a path target, else OBJ."""
+    if format is None and isinstance(target, (str, os.PathLike)):
+        format = os.path.splitext(os.fspath(target))[1].lstrip(".")
+    format = (format or "obj").lower()
+    if format not in FORMATS:
+        raise ValueError(f"Unknown mesh format '{format}', expected one of {FORMATS}")
+    return format
+
+
+@contextmanager
+def binary_sink(target):
+    """Opens a path for writing, wraps a socket in a buffered writer, or passes a binary file-like through."""
+    if isinstance(target, (str, os.PathLike)):
+        with open(target, "wb") as f:
+            yield f
+    elif hasattr(target, "sendall"):
+        with target.makefile("wb") as f:
+            yield f
+    else:
+        yield target
+
+
+def colors_to_uint8(colors):
+    """Float colors in [0, 1] (as Open3D stores them) or uint8 colors, as uint8."""
+    if colors.dtype == np.uint8:
+        return colors
+    return (np.clip(colors, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+
+
+def _chunks(array, chunk_rows=CHUNK_ROWS):
+    for start in range(0, len(array), chunk_rows):
+        yield array[start:start + chunk_rows]
+
+
+def _write_rows(f, row_format, array):
+    # One % over a repeated format string per chunk is several times faster than per-row formatting
+    for chunk in _chunks(array):
+        f.write(((row_format * len(chunk)) % tuple(chunk.ravel().tolist())).encode("ascii"))
+
+
+def write_obj_vertices(f, vertices, colors=None, normals=None):
+    """Writes 'v' (with colors, if any) and 'vn' lines; can be called repeatedly to stream a mesh."""
+    if colors is not None:
+        if colors.dtype == np.uint8:
+            colors = colors.astype(np.float32) * np.float32(1.0 / 255.0)
+        _write_rows(f, "v %.6f %.6f %.6f %.6f %.6f %.6f\n", np.hstack([vertices, colors]))
+    else:
+        _write_rows(f, "v %.6f %.6f %.6f\n", vertices)
+    if normals is not None:
+        _write_rows(f, "vn %.6f %.6f %.6f\n", normals)
+
+
+def write_obj_faces(f, triangles, offset=0, normals=False):
+    """
+    Writes 'f' lines for 0-based triangles whose vertices start offset vertices into the file.
+    With normals, each corner also references the normal of the same index.
+    """
+    triangles = np.asarray(triangles, dtype=np.int64) + (offset + 1)
+    if normals:
+        _write_rows(f, "f %d//%d %d//%d %d//%d\n", np.repeat(triangles, 2, axis=1))
+    else:
+        _write_rows(f, "f %d %d %d\n", triangles)
+
+
+def write_obj(f, vertices, triangles=None, colors=None, normals=None):
+    write_obj_vertices(f, vertices, colors, normals)
+    if triangles is not None:
+        write_obj_faces(f, triangles, normals=normals is not None)
+
+
+def write_ply(f, vertices, triangles=None, colors=None, normals=None):
+    """Binary little-endian PLY; faces are written as uchar-counted int32 lists."""
+    fields = [("x", "<f4"), ("y", "<f4"), ("z", "<f4")]
+    if normals is not None:
+        fields += [("nx", "<f4"), ("ny", "<f4"), ("nz", "<f4")]
+    if colors is not None:
+        fields += [("red", "u1"), ("green", "u1"), ("blue", "u1")]
+    ply_types = {"<f4": "float", "u1": "uchar"}
+
+    header = ["ply", "format binary_little_endian 1.0", f"element vertex {len(vertices)}"]
+    header += [f"property {ply_types[dtype]} {name}" for name, dtype in fields]
+    if triangles is not None:
+        header += [f"element face {len(triangles)}", "property list uchar int vertex_indices"]
+    f.write(("\n".join(header + ["end_header"]) + "\n").encode("ascii"))
+
+    vertex_dtype = np.dtype(fields)
+    for start in range(0, len(vertices), CHUNK_ROWS):
+        stop = min(start + CHUNK_ROWS, len(vertices))
+        block = np.empty(stop - start, dtype=vertex_dtype)
+        block["x"], block["y"], block["z"] = vertices[start:stop].T
+        if normals is not None:
+            block["nx"], block["ny"], block["nz"] = normals[start:stop].T
+        if colors is not None:
+            block["red"], block["green"], block["blue"] = colors_to_uint8(colors[start:stop]).T
+        f.write(block.tobytes())
+
+    if triangles is not None:
+        face_dtype = np.dtype([("count", "u1"), ("indices", "<i4", (3,))])
+        for chunk in _chunks(triangles):
+            block = np.empty(len(chunk), dtype=face_dtype)
+            block["count"] = 3
+            block["indices"] = chunk
+            f.write(block.tobytes())
+
+
+def _write_converted(f, array, dtype):
+    for chunk in _chunks(array):
+        f.write(np.ascontiguousarray(chunk, dtype=dtype).tobytes())
+
+
+class GlbBuffer:
+    """Lays out the buffer views and accessors of a GLB and writes the container, streaming each view."""
+
+    def __init__(self):
+        self.views = []
+        self.accessors = []
+        self.writers = []
+        self.byte_length = 0
+
+    def add(self, byte_length, target, accessor, writer, byte_stride=None):
+        """Adds a view written by writer() and its accessor; returns the accessor index."""
+        view = {"buffer": 0, "byteOffset": self.byte_length, "byteLength": byte_length, "target": target}
+        if byte_stride is not None:
+            view["byteStride"] = byte_stride
+        self.views.append(view)
+        self.accessors.append({"bufferView": len(self.views) - 1, **accessor})
+        self.writers.append(writer)
+        self.byte_length += byte_length
+        return len(self.accessors) - 1
+
+    def write(self, f, primitive, node=None, extensions=()):
+        gltf = {
+            "asset": {"version": "2.0", "generator": "memorymake"},
+            "scene": 0,
+            "scenes": [{"nodes": [0]}],
+            "nodes": [{"mesh": 0, **(node or {})}],
+            "meshes": [{"primitives": [primitive]}],
+            "buffers": [{"byteLength": self.byte_length}],
+            "bufferViews": self.views,
+            "accessors": self.accessors,
+        }
+        if extensions:
+            gltf["extensionsUsed"] = gltf["extensionsRequired"] = list(extensions)
+        json_chunk = json.dumps(gltf, separators=(",", ":")).encode("utf-8")
+        json_chunk += b" " * (-len(json_chunk) % 4)
+        # Every view is a multiple of 4 bytes, so the binary chunk needs no padding
+        total = 12 + 8 + len(json_chunk) + 8 + self.byte_length
+        f.write(struct.pack("<III", GLB_MAGIC, 2, total))
+        f.write(struct.pack("<II", len(json_chunk), GLB_JSON_CHUNK))
+        f.write(json_chunk)
+        f.write(struct.pack("<II", self.byte_length, GLB_BIN_CHUNK))
+        for writer in self.writers:
+            writer()
+
+
+def _add_glb_colors(f, glb, colors):
+    def write_colors():
+        for chunk in _chunks(colors):
+            rgba = np.full((len(chunk), 4), 255, dtype=np.uint8)
+            rgba[:, :3] = colors_to_uint8(chunk)
+            f.write(rgba.tobytes())
+    return glb.add(4 * len(colors), GL_ARRAY_BUFFER,
+                   {"componentType": GL_UNSIGNED_BYTE, "normalized": True, "count": len(colors), "type": "VEC4"},
+                   write_colors)
+
+
+def write_glb(f, vertices, triangles=None, colors=None, normals=None):
+    """
+    Binary glTF 2.0 with one primitive: float32 positions and normals, normalized uint8 RGBA colors
+    (RGB padded to 4 bytes, as vertex attributes must be 4-byte aligned) and uint32 indices. Without
+    triangles the primitive is a point list.
+    """
+    count = len(vertices)
+    glb = GlbBuffer()
+    attributes = {}
+
+    # POSITION must declare its bounds
+    bounds = {"min": [0.0, 0.0, 0.0], "max": [0.0, 0.0, 0.0]}
+    if count:
+        bounds = {"min": vertices.min(axis=0).astype(np.float32).tolist(),
+                  "max": vertices.max(axis=0).astype(np.float32).tolist()}
+    attributes["POSITION"] = glb.add(12 * count, GL_ARRAY_BUFFER,
+                                     {"componentType": GL_FLOAT, "count": count, "type": "VEC3", **bounds},
+                                     lambda: _write_converted(f, vertices, "<f4"))
+    if normals is not None:
+        attributes["NORMAL"] = glb.add(12 * count, GL_ARRAY_BUFFER,
+                                       {"componentType": GL_FLOAT, "count": count, "type": "VEC3"},
+                                       lambda: _write_converted(f, normals, "<f4"))
+    if colors is not None:
+        attributes["COLOR_0"] = _add_glb_colors(f, glb, colors)
+
+    primitive = {"attributes": attributes, "mode": GL_POINTS if triangles is None else GL_TRIANGLES}
+    if triangles is not None:
+        primitive["indices"] = glb.add(12 * len(triangles), GL_ELEMENT_ARRAY_BUFFER,
+                                       {"componentType": GL_UNSIGNED_INT, "count": 3 * len(triangles),
+                                        "type": "SCALAR"},
+                                       lambda: _write_converted(f, triangles, "<u4"))
+    glb.write(f, primitive)
+
+
+def quantize_positions(positions):
+    """
+    Quantizes positions to int16 over their bounding box.
+
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray): Nx3 int16 positions, and the per-axis scale and offset
+        (float32) that restore them: positions ~= quantized * scale + offset.
+    """
+    if len(positions) == 0:
+        return np.empty((0, 3), dtype=np.int16), np.ones(3, dtype=np.float32), np.zeros(3, dtype=np.float32)
+    low, high = positions.min(axis=0), positions.max(axis=0)
+    offset = ((low + high) / 2).astype(np.float32)
+    scale = np.maximum((high - low) / (2 * QUANTIZED_MAX), 1e-12).astype(np.float32)
+    quantized = np.empty((len(positions), 3), dtype=np.int16)
+    for start in range(0, len(positions), CHUNK_ROWS):
+        chunk = positions[start:start + CHUNK_ROWS]
+        quantized[start:start + len(chunk)] = np.clip(np.rint((chunk - offset) / scale), -QUANTIZED_MAX, QUANTIZED_MAX)
+    return quantized, scale, offset
+
+
+def write_splat_ply(f, positions, colors=None, sizes=None):
+    """
+    Binary PLY point cloud with int16 positions; the dequantization is stored in the header as
+    'comment quantization_scale sx sy sz' and 'comment quantization_offset ox oy oz'.
+    """
+    quantized, scale, offset = quantize_positions(positions)
+    fields = [("x", "<i2"), ("y", "<i2"), ("z", "<i2")]
+    if colors is not None:
+        fields += [("red", "u1"), ("green", "u1"), ("blue", "u1")]
+    if sizes is not None:
+        fields += [("size", "<f4")]
+    ply_types = {"<i2": "short", "u1": "uchar", "<f4": "float"}
+
+    header = ["ply", "format binary_little_endian 1.0",
+              "comment quantization_scale " + " ".join(f"{value:.9g}" for value in scale),
+              "comment quantization_offset " + " ".join(f"{value:.9g}" for value in offset),
+              f"element vertex {len(positions)}"]
+    header += [f"property {ply_types[dtype]} {name}" for name, dtype in fields]
+    f.write(("\n".join(header + ["end_header"]) + "\n").encode("ascii"))
+
+    vertex_dtype = np.dtype(fields)
+    for start in range(0, len(positions), CHUNK_ROWS):
+        stop = min(start + CHUNK_ROWS, len(positions))
+        block = np.empty(stop - start, dtype=vertex_dtype)
+        block["x"], block["y"], block["z"] = quantized[start:stop].T
+        if colors is not None:
+            block["red"], block["green"], block["blue"] = colors_to_uint8(colors[start:stop]).T
+        if sizes is not None:
+            block["size"] = sizes[start:stop]
+        f.write(block.tobytes())
+
+
+def write_splat_glb(f, positions, colors=None, sizes=None):
+    """
+    GLB point list with int16 positions (KHR_mesh_quantization; the node's scale and translation
+    dequantize them) and, optionally, a float32 '_SIZE' attribute with each point's size in scene units.
+    """
+    quantized, scale, offset = quantize_positions(positions)
+    count = len(positions)
+    glb = GlbBuffer()
+
+    def write_positions():
+        # SHORT VEC3 elements are padded to 8 bytes, as vertex attributes must be 4-byte aligned
+        for chunk in _chunks(quantized):
+            padded = np.zeros((len(chunk), 4), dtype="<i2")
+            padded[:, :3] = chunk
+            f.write(padded.tobytes())
+
+    bounds = {"min": [0, 0, 0], "max": [0, 0, 0]}
+    if count:
+        bounds = {"min": quantized.min(axis=0).tolist(), "max": quantized.max(axis=0).tolist()}
+    attributes = {"POSITION": glb.add(8 * count, GL_ARRAY_BUFFER,
+                                      {"componentType": GL_SHORT, "count": count, "type": "VEC3", **bounds},
+                                      write_positions, byte_stride=8)}
+    if colors is not None:
+        attributes["COLOR_0"] = _add_glb_colors(f, glb, colors)
+    if sizes is not None:
+        attributes["_SIZE"] = glb.add(4 * count, GL_ARRAY_BUFFER,
+                                      {"componentType": GL_FLOAT, "count": count, "type": "SCALAR"},
+                                      lambda: _write_converted(f, sizes, "<f4"))
+    glb.write(f, {"attributes": attributes, "mode": GL_POINTS},
+              node={"scale": scale.tolist(), "translation": offset.tolist()},
+              extensions=("KHR_mesh_quantization",))
+
+
+WRITERS = {"obj": write_obj, "ply": write_ply, "glb": write_glb}
+SPLAT_WRITERS = {"ply": write_splat_ply, "glb": write_splat_glb}
+
+
+def write_arrays(target, vertices, triangles=None, colors=None, normals=None, format=None):
+    """
+    Writes a mesh (or, without triangles, a point set) from numpy arrays.
+
+    Args:
+        target: A path, a binary file-like object or a connected socket.
+        vertices (np.ndarray): Nx3 positions.
+        triangles (np.ndarray): Optional Mx3 0-based vertex indices.
+        colors (np.ndarray): Optional Nx3 colors, floats in [0, 1] or uint8.
+        normals (np.ndarray): Optional Nx3 vertex normals.
+        format (str): 'obj', 'ply' or 'glb' (default: from the path's extension, else OBJ).
+    """
+    writer = WRITERS[format_for(target, format)]
+    with binary_sink(target) as f:
+        writer(f, vertices, triangles, colors, normals)
+
+
+def write_triangle_mesh(target, mesh, format=None):
+    """
+    Writes an Open3D TriangleMesh. Its attributes are read as numpy views, without the intermediate
+    copies of o3d.io.write_triangle_mesh. See write_arrays for target and format.
+    """
+    write_arrays(target,
+                 np.asarray(mesh.vertices),
+                 np.asarray(mesh.triangles),
+                 colors=np.asarray(mesh.vertex_colors) if mesh.has_vertex_colors() else None,
+                 normals=np.asarray(mesh.vertex_normals) if mesh.has_vertex_normals() else None,
+                 format=format)
+
+
+def mesh_bytes(mesh, format="glb"):
+    """The encoded mesh, in memory."""
+    buffer = io.BytesIO()
+    write_triangle_mesh(buffer, mesh, format=format)
+    return buffer.getvalue()
+
+
+def write_splats(target, positions, colors=None, sizes=None, format=None):
+    """
+    Writes a compact point cloud for splat rendering: quantized positions, uint8 colors and optional
+    per-point size hints.
+
+    Args:
+        target: A path, a binary file-like object or a connected socket.
+        positions (np.ndarray): Nx3 positions.
+        colors (np.ndarray): Optional Nx3 colors, floats in [0, 1] or uint8.
+        sizes (np.ndarray): Optional N point sizes, in the units of positions.
+        format (str): 'ply' or 'glb' (default: from the path's extension, else GLB).
+    """
+    format = format_for(target, format or (None if isinstance(target, (str, os.PathLike)) else "glb"))
+    if format not in SPLAT_WRITERS:
+        raise ValueError(f"Point clouds are written as {tuple(SPLAT_WRITERS)}, not '{format}'")
+    with binary_sink(target) as f:
+        SPLAT_WRITERS[format](f, positions, colors, sizes)
@@ -1,23 +1,20 @@
-import torch
+# torch, torchvision and matplotlib are imported where they are used, so that importing this module
+# costs nothing until depth is first estimated
 import cv2
 import numpy as np
 import open3d as o3d
-import matplotlib.pyplot as plt
 import os
-from torchvision.transforms import Compose, Normalize, Resize, ToTensor, InterpolationMode
-import ssl
+from functools import lru_cache
 from urllib import request
 from PIL import Image
+from compute_mesh import backproject_pinhole, points_to_point_cloud
+from resources import configure_torch
+from model_store import build_midas
 
 
-
-
-# Create an SSL context that ignores certificate verification
-ssl._create_default_https_context = ssl._create_unverified_context
-
 def load_midas_model(model_type="DPT_Large", model_path="models/dpt_swin2_large_384.pt"):
     """
-    Loads the MiDaS model architecture and weights manually.
+    Loads the MiDaS model architecture and weights from the local model store (see model_store.py).
     
     Args:
         model_type (str): Type of MiDaS model to load. Options are 'DPT_Large', 'DPT_Hybrid', 'MiDaS_small'.
@@ -26,19 +23,10 @@ def load_midas_model(model_type="DPT_Large", model_path="models/dpt_swin2_large_
     Returns:
         model, transform: The loaded model and its corresponding transformation.
     """
-    # Import MiDaS architecture from the repository
-    # Ensure you have cloned the MiDaS repository or have access to the model definitions
-    # For simplicity, we can use torch.hub's implementation but load weights manually
-    
-    # Define the hub URL
-    hub_url = "intel-isl/MiDaS"
-    
-    model = torch.hub.load(hub_url, model_type, source='github', trust_repo=True)
-    print('finished')
-    # # Load the local weights
-    # state_dict = torch.load(model_path, map_location=torch.device('cpu'))
-    # model.load_state_dict(state_dict)
-    model.eval()
+    from torchvision.transforms import Compose, Normalize, Resize, ToTensor, InterpolationMode
+
+    # Architecture from a local MiDaS clone, weights memory-mapped from model_path; torch.hub only as a fallback
+    model = build_midas(model_type, model_path)
     
     # Define the appropriate transform
     if model_type in ["DPT_Large", "DPT_Hybrid"]:
@@ -60,12 +48,51 @@ def load_midas_model(model_type="DPT_Large", model_path="models/dpt_swin2_large_
     return model, transform
 
 
+@lru_cache(maxsize=None)
+def get_midas_model(model_type="DPT_Large", model_path="models/midas/dpt_large-midas-2f21e586.pt"):
+    """
+    Loads the MiDaS model once per (model_type, model_path) and keeps it on the best available device.
+
+    Returns:
+        model, transform, device: The cached model, its transformation and the device it lives on.
+    """
+    import torch
+    # Size torch's thread pools from the resource layout before the model first runs
+    configure_torch()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"Using device: {device}")
+    midas, transform = load_midas_model(model_type=model_type, model_path=model_path)
+    midas.to(device)
+    print("MiDaS model loaded.")
+    return midas, transform, device
+
+
+def depth_from_array(image_rgb, model_type="DPT_Large", model_path="models/midas/dpt_large-midas-2f21e586.pt",
+                     output_size=None):
+    """
+    Estimates the depth map of an already decoded RGB image with the cached MiDaS model.
+
+    Args:
+        image_rgb (numpy.ndarray): HxWx3 uint8 RGB image.
+        model_type (str): Type of MiDaS model ('DPT_Large', 'DPT_Hybrid', 'MiDaS_small').
+        model_path (str): Path to the downloaded model weights.
+        output_size (tuple): Optional (height, width) to resample the prediction to (default: image size).
+
+    Returns:
+        depth_map (numpy.ndarray): The estimated depth map.
+    """
+    midas, transform, device = get_midas_model(model_type=model_type, model_path=model_path)
+    depth_map, _ = estimate_depth(midas, transform, Image.fromarray(image_rgb), device, output_size=output_size)
+    return depth_map
+
+
 def save_depth_map_as_png(depth_map, output_path="depth_map_test.png"):
     # Normalize the depth map for visualization (0-255 range for 8-bit)
     depth_map_normalized = (depth_map - depth_map.min()) / (depth_map.max() - depth_map.min())
     depth_map_uint8 = (depth_map_normalized * 255).astype(np.uint8)
 
     # Save as PNG
+    import matplotlib.pyplot as plt
     plt.imsave(output_path, depth_map_uint8, cmap='plasma')
     return output_path
 
@@ -84,7 +111,7 @@ def save_depth_values_as_image(depth_array, output_path="panorama_depth.png"):
     cv2.imwrite(output_path, depth_array_16bit)
     return output_path
 
-def estimate_depth(midas, transform, image, device):
+def estimate_depth(midas, transform, image, device, output_size=None):
     """
     Estimates the depth map of an image using MiDaS.
     
@@ -93,19 +120,22 @@ def estimate_depth(midas, transform, image, device):
         transform: The transformation to apply to the image.
         image (PIL.Image): The input image (as a PIL.Image object).
         device: The device to run the model on.
+        output_size (tuple): Optional (height, width) of the returned map. The prediction is
+                             interpolated straight to it instead of to the full image size.
         
     Returns:
         depth_map (numpy.ndarray): The estimated depth map.
     """
+    import torch
     input_batch = transform(image).to(device).unsqueeze(0)
     
     with torch.no_grad():
         prediction = midas(input_batch)
     
-    # Interpolate to the original image size
+    # Interpolate to the requested working size (by default the original image size)
     prediction = torch.nn.functional.interpolate(
         prediction.unsqueeze(1),
-        size=image.size[::-1],  # Reverse (width, height) to (height, width)
+        size=tuple(output_size) if output_size is not None else image.size[::-1],  # Reverse (width, height) to (height, width)
         mode="bicubic",
         align_corners=False,
     ).squeeze()
@@ -121,6 +151,44 @@ def estimate_depth(midas, transform, image, device):
     return depth_map, depth_map_normalized
 
 
+def estimate_depth_batch(midas, transform, images, device, output_size):
+    """
+    Estimates the depth maps of several same-sized images with one forward pass.
+
+    Args:
+        midas: The MiDaS model.
+        transform: The transformation to apply to each image.
+        images (list): PIL.Image inputs.
+        device: The device to run the model on.
+        output_size (tuple): (height, width) of the returned maps.
+
+    Returns:
+        list: One depth map (numpy.ndarray) per image.
+    """
+    import torch
+    input_batch = torch.stack([transform(image) for image in images]).to(device)
+
+    with torch.no_grad():
+        prediction = midas(input_batch)
+
+    prediction = torch.nn.functional.interpolate(
+        prediction.unsqueeze(1),
+        size=tuple(output_size),
+        mode="bicubic",
+        align_corners=False,
+    ).squeeze(1)
+
+    return list(prediction.cpu().numpy())
+
+
+def depth_from_arrays(images_rgb, model_type="DPT_Large", model_path="models/midas/dpt_large-midas-2f21e586.pt",
+                      output_size=None):
+    """Batched depth_from_array for same-sized RGB images (e.g. video frames)."""
+    midas, transform, device = get_midas_model(model_type=model_type, model_path=model_path)
+    output_size = output_size if output_size is not None else images_rgb[0].shape[:2]
+    return estimate_depth_batch(midas, transform, [Image.fromarray(image) for image in images_rgb], device, output_size)
+
+
 def create_point_cloud(image, depth_map, focal_length=1.0):
     """
     Creates a point cloud from an image and its corresponding depth map.
@@ -134,27 +202,17 @@ def create_point_cloud(image, depth_map, focal_length=1.0):
         pcd (open3d.geometry.PointCloud): The generated point cloud.
     """
     height, width = depth_map.shape
-    i, j = np.meshgrid(np.arange(width), np.arange(height), indexing='xy')
-    
+
     # Assuming the principal point is at the center
-    i = i - width / 2
-    j = j - height / 2
-    
-    # Normalize the coordinates
-    X = i / focal_length * depth_map
-    Y = j / focal_length * depth_map
-    Z = depth_map
-    
-    # Stack into a (N, 3) array
-    points = np.stack((X, Y, Z), axis=-1).reshape(-1, 3)
-    
-    # Get colors from the image
-    colors = image.reshape(-1, 3) / 255.0  # Normalize to [0,1]
-    
+    intrinsic_matrix = np.array([
+        [focal_length, 0, width / 2],
+        [0, focal_length, height / 2],
+        [0, 0, 1]
+    ])
+    points, colors = backproject_pinhole(depth_map, intrinsic_matrix, color=image)
+
     # Create Open3D point cloud
-    pcd = o3d.geometry.PointCloud()
-    pcd.points = o3d.utility.Vector3dVector(points)
-    pcd.colors = o3d.utility.Vector3dVector(colors)
+    pcd = points_to_point_cloud(points, colors)
     
     return pcd
 
@@ -205,7 +263,7 @@ def visualize_depth_map(depth_map_normalized):
         depth_map_normalized (numpy.ndarray): The normalized depth map.
     """
     # Save as grayscale image
-    
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots()
     cax = ax.imshow(depth_map_normalized, cmap='plasma')
     fig.colorbar(cax)
@@ -224,14 +282,8 @@ def midas_main(input_image_path, output_mesh_path, model_type="DPT_Large", model
         model_type (str): Type of MiDaS model ('DPT_Large', 'DPT_Hybrid', 'MiDaS_small').
         model_path (str): Path to the downloaded model weights.
     """
-    # Check if CUDA is available
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print(f"Using device: {device}")
-
-    # Load MiDaS model with local weights
-    midas, transform = load_midas_model(model_type=model_type, model_path=model_path)
-    midas.to(device)
-    print("MiDaS model loaded with local weights.")
+    # Load MiDaS model with local weights (cached after the first call)
+    midas, transform, device = get_midas_model(model_type=model_type, model_path=model_path)
 
     # url, filename = ("https://github.com/pytorch/hub/raw/master/images/dog.jpg", "dog.jpg")
     # request.urlretrieve(url, filename)
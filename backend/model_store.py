@@ -0,0 +1,87 @@
+import os
+import config
+
+# Local model store: MiDaS weights are read from files under models/ and memory-mapped, so workers on
+# one host share the read-only weight pages through the page cache instead of each holding a copy.
+
+
+def find_weights(model_path):
+    """Returns the .safetensors twin of model_path if it exists, else model_path itself, else None."""
+    safetensors_path = os.path.splitext(model_path)[0] + ".safetensors"
+    for path in (safetensors_path, model_path):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def load_state_dict(path):
+    """
+    Loads a state dict without reading the weights into private memory.
+
+    Args:
+        path (str): A .safetensors file or a torch checkpoint (.pt/.pth).
+
+    Returns:
+        dict: Parameter name -> CPU tensor backed by the memory-mapped file.
+    """
+    if path.endswith(".safetensors"):
+        from safetensors.torch import load_file
+        return load_file(path, device="cpu")
+
+    import torch
+    state_dict = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    # Some checkpoints wrap the weights together with training state
+    if "state_dict" in state_dict:
+        state_dict = state_dict["state_dict"]
+    return state_dict
+
+
+def build_midas(model_type, model_path):
+    """
+    Builds the MiDaS network and loads its weights, without network access when the store is populated.
+
+    The architecture comes from a local clone of intel-isl/MiDaS (config.MIDAS_REPO_DIR) and the weights
+    from model_path (or its .safetensors twin). The parameters are assigned the memory-mapped tensors
+    instead of being copied into freshly allocated ones.
+
+    Args:
+        model_type (str): 'DPT_Large', 'DPT_Hybrid' or 'MiDaS_small'.
+        model_path (str): Path to the weights.
+
+    Returns:
+        torch.nn.Module: The model, in eval mode.
+    """
+    import torch
+
+    weights = find_weights(model_path)
+    if weights is not None and os.path.isdir(config.MIDAS_REPO_DIR):
+        model = torch.hub.load(config.MIDAS_REPO_DIR, model_type, source="local", pretrained=False)
+        model.load_state_dict(load_state_dict(weights), assign=True)
+        print(f"MiDaS weights memory-mapped from {weights}")
+    elif config.MODELS_OFFLINE:
+        raise FileNotFoundError(
+            f"Offline mode needs the MiDaS repository at {config.MIDAS_REPO_DIR} and weights at {model_path}")
+    else:
+        print(f"No local MiDaS store ({config.MIDAS_REPO_DIR}, {model_path}), downloading through torch.hub")
+        model = torch.hub.load("intel-isl/MiDaS", model_type, source="github", trust_repo=True)
+    model.eval()
+    return model
+
+
+def convert_to_safetensors(model_path):
+    """Writes the .safetensors twin of a torch checkpoint, which find_weights then prefers."""
+    from safetensors.torch import save_file
+    state_dict = load_state_dict(model_path)
+    output_path = os.path.splitext(model_path)[0] + ".safetensors"
+    save_file({name: tensor.contiguous() for name, tensor in state_dict.items()}, output_path)
+    return output_path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Prepare the local model store")
+    parser.add_argument("--to_safetensors", type=str, required=True, help="Torch checkpoint to convert to .safetensors")
+    args = parser.parse_args()
+
+    print(f"Wrote {convert_to_safetensors(args.to_safetensors)}")
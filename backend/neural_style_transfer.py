@@ -1,18 +1,18 @@
-import tensorflow as tf
-import tensorflow_hub as hub
+# TensorFlow, TF Hub and matplotlib are imported where they are used, so that importing this module
+# (and photorealistic-only servers) does not pay for them
 import numpy as np
-import matplotlib.pyplot as plt
 from PIL import Image
-import cv2, os
+import cv2, os, time
+from functools import lru_cache
+from resources import configure_tensorflow
+import config
 
-import ssl
-import urllib.request
-
-# Disable SSL verification
-ssl._create_default_https_context = ssl._create_unverified_context
-
-# Load the pre-trained Neural Style Transfer model from TensorFlow Hub
+# Load the pre-trained Neural Style Transfer model from TensorFlow Hub (once per process)
+@lru_cache(maxsize=None)
 def load_model():
+    # Size TensorFlow's thread pools from the resource layout before the runtime initializes
+    configure_tensorflow()
+    import tensorflow_hub as hub
     # Load the pre-trained model from tfhub (e.g., fast-style-transfer model)
     model = hub.load('https://tfhub.dev/google/magenta/arbitrary-image-stylization-v1-256/2')
     return model
@@ -48,7 +48,7 @@ def load_and_process_image(image_path, content_size):
     
     # Convert image to array and normalize to [0, 1]
     img = np.array(img) / 255.0
-    img = img[tf.newaxis, ...]  # Add batch dimension
+    img = img[np.newaxis, ...]  # Add batch dimension
     return img
 
 # Convert tensor to image for displaying
@@ -61,6 +61,7 @@ def tensor_to_image(tensor):
 
 # Perform Neural Style Transfer
 def neural_style_transfer(content_image, style_image, model):
+    import tensorflow as tf
     # Convert images to float32
     content_image = tf.cast(content_image, tf.float32)
     style_image = tf.cast(style_image, tf.float32)
@@ -72,6 +73,7 @@ def neural_style_transfer(content_image, style_image, model):
 
 # Display an image
 def display_image(image, title='Image'):
+    import matplotlib.pyplot as plt
     plt.imshow(image)
     plt.title(title)
     plt.axis('off')
@@ -106,47 +108,91 @@ def apply_style_transfer(content_image_path, style_image_path):
     # Save the output image
     output_image.save("output.jpg")
 
-def apply_style_transfer_from_array(color_raw, style, output_dir="uploads"):
+def stylize_array(color_raw, style, working_width=None):
     """
-    Applies style transfer to an image array and saves the result to the 'uploads/' directory.
+    Applies style transfer to an RGB image array.
+
+    With a working width smaller than the image, the model runs at working_width x working_width // 2
+    and full-resolution detail is restored by guided upsampling against the content image (see
+    guided_upsample), which costs far less than stylizing every pixel.
 
     Args:
-        color_raw (numpy.ndarray): The input content image as a NumPy array.
+        color_raw (numpy.ndarray): The input content image as a NumPy array (RGB).
         style (str): The name of the style image (assumes it's located in 'nst_styles/' directory).
-        output_dir (str): The directory where the output image will be saved (default: 'uploads/').
+        working_width (int): Width the model runs at; None uses config.STYLE_WORKING_WIDTH, and 0 the
+                             full image width.
 
     Returns:
-        str: The file path of the saved stylized image.
+        numpy.ndarray: The stylized RGB image, same size as color_raw.
+    """
+    return stylize_array_batch(color_raw, [style], working_width=working_width)[0]
+
+def stylize_array_batch(color_raw, styles, working_width=None):
+    """
+    Applies several styles to one RGB image array with a single batched model call.
+
+    Args:
+        color_raw (numpy.ndarray): The input content image as a NumPy array (RGB).
+        styles (list): Style names from 'nst_styles/'.
+        working_width (int): See stylize_array.
+
+    Returns:
+        list: One stylized RGB image per style, each the same size as color_raw.
     """
     # Get dimensions of the content image
     content_height, content_width, _ = color_raw.shape
+    if working_width is None:
+        working_width = config.STYLE_WORKING_WIDTH
+    fast = 0 < working_width < content_width
 
     # Dynamically calculate the target size with a 2:1 aspect ratio
-    target_width = content_width
-    target_height = content_width // 2  # Ensuring a 2:1 aspect ratio
+    target_width = working_width if fast else content_width
+    target_height = target_width // 2  # Ensuring a 2:1 aspect ratio
 
-    # Resize and normalize the content image
+    # Resize and normalize the content image, repeated once per style
     content_image = resize_and_normalize(color_raw, (target_width, target_height))
+    content_batch = np.repeat(content_image, len(styles), axis=0)
 
-    # Load the style image
-    style_image_path = f"nst_styles/{style}.jpg"
-    style_image = load_and_process_image(style_image_path, (target_width, target_height))
+    # Load the style images
+    style_batch = np.concatenate([
+        load_and_process_image(f"nst_styles/{style}.jpg", (target_width, target_height)) for style in styles
+    ])
 
     # Load the pre-trained model from TensorFlow Hub
     model = load_model()
 
     # Perform style transfer
-    stylized_image = neural_style_transfer(content_image, style_image, model)
+    stylized_images = neural_style_transfer(content_batch, style_batch, model)
+
+    results = []
+    for stylized_image in stylized_images:
+        # Convert stylized image tensor to array
+        stylized_image_array = np.array(stylized_image * 255, dtype=np.uint8)
+
+        if fast:
+            results.append(guided_upsample(stylized_image_array, content_image[0], color_raw))
+        else:
+            # Resize back to original dimensions
+            results.append(cv2.resize(
+                stylized_image_array,
+                (content_width, content_height),
+                interpolation=cv2.INTER_LANCZOS4
+            ))
+    return results
 
-    # Convert stylized image tensor to array
-    stylized_image_array = np.array(stylized_image[0] * 255, dtype=np.uint8)
+def apply_style_transfer_from_array(color_raw, style, output_dir="uploads"):
+    """
+    Applies style transfer to an image array and saves the result to the 'uploads/' directory.
 
-    # Resize back to original dimensions
-    stylized_image_array = cv2.resize(
-        stylized_image_array,
-        (content_width, content_height),
-        interpolation=cv2.INTER_LANCZOS4
-    )
+    Args:
+        color_raw (numpy.ndarray): The input content image as a NumPy array.
+        style (str): The name of the style image (assumes it's located in 'nst_styles/' directory).
+        output_dir (str): The directory where the output image will be saved (default: 'uploads/').
+
+    Returns:
+        str: The file path of the saved stylized image.
+    """
+    stylized_image_array = stylize_array(color_raw, style)
 
     # Convert back to BGR for saving with OpenCV
     stylized_image_array = cv2.cvtColor(stylized_image_array, cv2.COLOR_RGB2BGR)
@@ -157,6 +203,110 @@ def apply_style_transfer_from_array(color_raw, style, output_dir="uploads"):
 
     return output_file
 
+def guided_upsample(stylized_low, guide_low, guide_full, radius=2, eps=1e-2):
+    """
+    Upsamples a low-resolution stylization to the size of guide_full with a fast guided filter.
+
+    A local linear model from content color to stylized color (stylized = A @ rgb + b) is fitted over
+    (2 * radius + 1)^2 windows at low resolution. Its coefficients are smoothed, upsampled bilinearly
+    and applied to the full-resolution content, so the result follows the content's edges at full
+    resolution instead of being a blurry resize.
+
+    Args:
+        stylized_low (numpy.ndarray): hxwx3 uint8 stylized image.
+        guide_low (numpy.ndarray): hxwx3 content image in [0, 1] at the stylized size.
+        guide_full (numpy.ndarray): HxWx3 uint8 content image.
+        radius (int): Window radius in low-resolution pixels.
+        eps (float): Regularization; larger values keep more of the stylization's own texture.
+
+    Returns:
+        numpy.ndarray: HxWx3 uint8 stylized image.
+    """
+    height, width = guide_full.shape[:2]
+    low_h, low_w = stylized_low.shape[:2]
+    ksize = (2 * radius + 1, 2 * radius + 1)
+
+    def box(x):
+        return cv2.boxFilter(x, -1, ksize, borderType=cv2.BORDER_REFLECT)
+
+    guide = cv2.resize(guide_low.astype(np.float32), (low_w, low_h), interpolation=cv2.INTER_AREA)
+    target = stylized_low.astype(np.float32) / 255.0
+    mean_i = box(guide)
+    mean_p = box(target)
+
+    # Per-window 3x3 covariance of the guide and guide/target cross-covariance
+    cov_ii = np.empty((low_h, low_w, 3, 3), dtype=np.float32)
+    cov_ip = np.empty((low_h, low_w, 3, 3), dtype=np.float32)
+    for i in range(3):
+        for j in range(i, 3):
+            cov_ii[..., i, j] = cov_ii[..., j, i] = box(guide[..., i] * guide[..., j]) - mean_i[..., i] * mean_i[..., j]
+        cov_ip[..., i, :] = box(guide[..., i:i + 1] * target) - mean_i[..., i:i + 1] * mean_p
+    cov_ii += eps * np.eye(3, dtype=np.float32)
+
+    a = np.linalg.solve(cov_ii, cov_ip)
+    b = mean_p - np.einsum("hwi,hwic->hwc", mean_i, a)
+
+    # Averaged coefficients, taken to full resolution
+    a = cv2.resize(box(a.reshape(low_h, low_w, 9)), (width, height), interpolation=cv2.INTER_LINEAR)
+    b = cv2.resize(box(b), (width, height), interpolation=cv2.INTER_LINEAR)
+    content = guide_full.astype(np.float32) / 255.0
+
+    result = np.einsum("hwi,hwic->hwc", content, a.reshape(height, width, 3, 3)) + b
+    return (np.clip(result, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+
+
+def _psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else 10.0 * np.log10(255.0 ** 2 / mse)
+
+
+def _ssim(a, b):
+    """Mean SSIM of the luminance of two RGB images (Gaussian 11x11 windows)."""
+    a = cv2.cvtColor(a, cv2.COLOR_RGB2GRAY).astype(np.float64)
+    b = cv2.cvtColor(b, cv2.COLOR_RGB2GRAY).astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+
+    def blur(x):
+        return cv2.GaussianBlur(x, (11, 11), 1.5)
+
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a * a) - mu_a ** 2
+    var_b = blur(b * b) - mu_b ** 2
+    cov = blur(a * b) - mu_a * mu_b
+    ssim = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim.mean())
+
+
+def style_report(image_path, style, working_widths=(256, 512, 1024), repeats=2):
+    """
+    Compares the fast mode at several working widths with full-resolution stylization.
+
+    Returns:
+        list: (working width, seconds, PSNR, SSIM) rows, the full-resolution path first (width 0).
+    """
+    color_raw = cv2.cvtColor(cv2.imread(image_path), cv2.COLOR_BGR2RGB)
+    load_model()
+    stylize_array(color_raw, style, working_width=min(working_widths))  # Warm-up
+
+    rows = []
+    reference = None
+    for width in (0,) + tuple(w for w in working_widths if w < color_raw.shape[1]):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            result = stylize_array(color_raw, style, working_width=width)
+        seconds = (time.perf_counter() - start) / repeats
+        if reference is None:
+            reference = result
+        rows.append((width, seconds, _psnr(result, reference), _ssim(result, reference)))
+
+    full_seconds = rows[0][1]
+    print(f"Style '{style}' on {color_raw.shape[1]}x{color_raw.shape[0]}")
+    print(f"  {'width':>8} {'seconds':>9} {'speedup':>8} {'PSNR':>7} {'SSIM':>6}")
+    for width, seconds, psnr, ssim in rows:
+        print(f"  {width or 'full':>8} {seconds:9.3f} {full_seconds / seconds:7.1f}x {psnr:7.2f} {ssim:6.3f}")
+    return rows
+
+
 def resize_and_normalize(image_array, target_size):
     """
     Resize and normalize a NumPy image array.
@@ -170,8 +320,19 @@ def resize_and_normalize(image_array, target_size):
     """
     resized_image = cv2.resize(image_array, target_size, interpolation=cv2.INTER_LANCZOS4)
     normalized_image = np.array(resized_image) / 255.0
-    return normalized_image[tf.newaxis, ...]
+    return normalized_image[np.newaxis, ...]
 
 if __name__ == '__main__':
-    # Example usage (adjust the paths to your images)
-    apply_style_transfer('assets/web/temple_heaven.png', 'nst_styles/picasso.jpg')
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Neural style transfer")
+    parser.add_argument("--report", type=str, default=None, help="Image to compare fast-mode working widths against full resolution on")
+    parser.add_argument("--style", type=str, default="picasso", help="Style name from nst_styles/")
+    parser.add_argument("--widths", type=int, nargs="+", default=[256, 512, 1024], help="Working widths to compare")
+    args = parser.parse_args()
+
+    if args.report is not None:
+        style_report(args.report, args.style, working_widths=tuple(args.widths))
+    else:
+        # Example usage (adjust the paths to your images)
+        apply_style_transfer('assets/web/temple_heaven.png', 'nst_styles/picasso.jpg')
@@ -1,6 +1,7 @@
 import open3d as o3d
 import numpy as np
 import cv2
+from compute_mesh import choose_poisson_depth, orient_normals_towards_origin, remove_low_density_vertices, transfer_colors
 
 def cylindrical_projection(color_image_path, depth_image_path,
                           vertical_scale=1.0, depth_scale_factor=1.0):
@@ -75,34 +76,29 @@ def cylindrical_projection(color_image_path, depth_image_path,
     pcd.estimate_normals(
         search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=1.0, max_nn=30)
     )
-    pcd.orient_normals_consistent_tangent_plane(30)
+    # The camera sits at the origin of the cylinder, so orient every normal towards it
+    orient_normals_towards_origin(pcd)
 
     return pcd
 
-def compute_meshes(pcd, save_path=None):
+def compute_meshes(pcd, save_path=None, depth=None, time_budget=None):
     print('its getting here')
     # Estimate normals (important for Poisson)
 
     
     # Poisson reconstruction
+    if depth is None:
+        depth = choose_poisson_depth(len(pcd.points), time_budget=time_budget)
     mesh_poisson, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(
         pcd,
-        depth=10  # Might adjust based on density
+        depth=depth
     )
 
     # Filter low-density vertices
-    dens_thresh = np.quantile(densities, 0.1)  # Remove lowest 10%
-    vertices_to_remove = densities < dens_thresh
-    mesh_poisson.remove_vertices_by_mask(vertices_to_remove)
+    remove_low_density_vertices(mesh_poisson, densities, quantile=0.1)  # Remove lowest 10%
 
     # Transfer colors from the original point cloud to the mesh
-    pcd_tree = o3d.geometry.KDTreeFlann(pcd)
-    mesh_colors = []
-    for v in mesh_poisson.vertices:
-        [_, idx, _] = pcd_tree.search_knn_vector_3d(v, 1)
-        nearest_color = pcd.colors[idx[0]]
-        mesh_colors.append(nearest_color)
-    mesh_poisson.vertex_colors = o3d.utility.Vector3dVector(mesh_colors)
+    transfer_colors(mesh_poisson, pcd)
 
     if save_path:
         o3d.io.write_triangle_mesh(save_path, mesh_poisson)
@@ -1,10 +1,21 @@
 import open3d as o3d
 import numpy as np
 import cv2
-from scipy.spatial import Delaunay
-from midas_depth_map import midas_main
+from scipy.spatial import Delaunay, cKDTree
+from midas_depth_map import midas_main, depth_from_array
 from transformations import root_scaling
-from neural_style_transfer import apply_style_transfer_from_array
+from neural_style_transfer import stylize_array, stylize_array_batch
+from cylinder import create_cylindrical_mesh, cylindrical_mesh_arrays
+from compute_mesh import pixel_grid, working_grid_shape, sample_colors, bin_points, choose_poisson_depth, \
+    orient_normals_towards_origin, remove_low_density_vertices, transfer_colors
+from pipeline import Stage, StageCache, PipelineGraph, hash_file
+from resources import stage_context
+from progress import stage_listener
+from mesh_io import write_triangle_mesh, write_splats
+from geometry import Geometry, vertex_normals
+from contextlib import ExitStack, nullcontext
+from functools import lru_cache
+import config
 
 @DeprecationWarning
 def compute_point_cloud(color_image_path, scale=1.5):
@@ -61,7 +72,8 @@ def compute_point_cloud(color_image_path, scale=1.5):
 def cylindrical_projection(color_image_path,
                           depth_scale_factor=1.0, 
                           vertical_scale=1.4,
-                          style=None):
+                          style=None,
+                          target_points=None):
     """
     Convert a panoramic color + depth image into a point cloud wrapped in cylindrical space.
 
@@ -78,156 +90,660 @@ def cylindrical_projection(color_image_path,
 
     # Load images with OpenCV
     color_raw = cv2.imread(color_image_path, cv2.IMREAD_COLOR)   # BGR
+    if color_raw is None:
+        raise FileNotFoundError(f"Image not found at {color_image_path}")
     # Convert BGR -> RGB for Open3D consistency
     color_raw = cv2.cvtColor(color_raw, cv2.COLOR_BGR2RGB)
 
+    # Depth is estimated on the original content, before any styling
+    depth_raw = depth_from_array(color_raw, model_type="DPT_Large", model_path="models/midas/dpt_large-midas-2f21e586.pt",
+                                 output_size=working_grid_shape(color_raw.shape, target_points))
+    print('midas done')
+
     # apply style if applicable using neural_style_transfer.py
     if style is not None and style != "photorealistic":
-        styled_path = apply_style_transfer_from_array(color_raw, style)
-        color_raw = cv2.imread(styled_path, cv2.IMREAD_COLOR)
-        color_raw = cv2.cvtColor(color_raw, cv2.COLOR_BGR2RGB)
+        color_raw = stylize_array(color_raw, style)
 
-    depth_raw = midas_main(color_image_path, None, model_type="DPT_Large", model_path="models/midas/dpt_large-midas-2f21e586.pt")
-    print('midas done')
+    return project_cylindrical(color_raw, depth_raw,
+                               depth_scale_factor=depth_scale_factor,
+                               vertical_scale=vertical_scale)
+
+
+def project_cylindrical(color_raw, depth_raw,
+                        depth_scale_factor=1.0,
+                        vertical_scale=1.4,
+                        stride=1,
+                        mask=None,
+                        bin_size=2,
+                        voxel_size=None):
+    """
+    Wrap an already decoded RGB panorama and its MiDaS depth map into a downsampled cylindrical point cloud.
+
+    Returns:
+        pcd (o3d.geometry.PointCloud): The cylindrical-wrapped point cloud.
+    """
+    points, colors, pixel_index = cylindrical_points(color_raw, depth_raw,
+                                                     depth_scale_factor=depth_scale_factor,
+                                                     vertical_scale=vertical_scale,
+                                                     stride=stride,
+                                                     mask=mask,
+                                                     return_pixels=True)
+    return downsample_points(points, colors, pixel_index=pixel_index, grid_shape=depth_raw.shape,
+                             bin_size=bin_size, voxel_size=voxel_size)
+
+
+def cylindrical_points(color_raw, depth_raw,
+                       depth_scale_factor=1.0,
+                       vertical_scale=1.4,
+                       stride=1,
+                       mask=None,
+                       return_pixels=False):
+    """
+    Wrap an already decoded RGB panorama and its MiDaS depth map into cylindrical space.
+
+    The depth map may be on a coarser working grid than the image (see working_grid_shape): colors are
+    then averaged onto that grid, and coordinates stay in full-resolution pixel units so the geometry
+    does not change with the working resolution.
+
+    Args:
+        color_raw (np.ndarray): HxWx3 uint8 RGB image.
+        depth_raw (np.ndarray): hxw MiDaS depth map (inverse depth, larger = closer), h <= H and w <= W.
+        depth_scale_factor (float): Global multiplier on the depth values.
+        vertical_scale (float): Factor to scale the vertical axis in the output point cloud.
+        stride (int): Keep every stride-th pixel along both axes.
+        mask (np.ndarray): Optional boolean mask of depth-grid pixels to keep.
+        return_pixels (bool): Also return the flat depth-grid index of every point's source pixel.
 
+    Returns:
+        (np.ndarray, np.ndarray): Nx3 float32 points and Nx3 float32 colors in [0, 1]
+        (plus the N pixel indices when return_pixels is set).
+    """
     print(color_raw.shape, depth_raw.shape)
 
     # Convert depth to float; apply any scaling if needed
     depth_raw = depth_raw.astype(np.float32) * depth_scale_factor
 
     height, width, _ = color_raw.shape
+    grid_h, grid_w = depth_raw.shape
+    if (grid_h, grid_w) != (height, width):
+        color_raw = cv2.resize(color_raw, (grid_w, grid_h), interpolation=cv2.INTER_AREA)
 
-    # Prepare arrays for the 3D points and their colors
-    points = []
-    colors = []
-    half_w = width / 2.0
-    half_h = height / 2.0
-
-    # Loop through each pixel in the panorama
-    # Adjust this value to control the effect
-    bias = 30
     original_r = (np.max(depth_raw) - depth_raw) * 10
     r = root_scaling(original_r)
     # r = (np.max(depth_raw) - depth_raw) * 10
     valid_mask = r > 0  # Mask to skip invalid or zero depth
+    if mask is not None:
+        valid_mask &= mask
 
-    # Create a grid of x and y coordinates
-    x = np.arange(width)
-    y = np.arange(height)
-    x_grid, y_grid = np.meshgrid(x, y)
+    # Pixel selection is shared with the pinhole back-projection in compute_mesh
+    v, u = pixel_grid(r.shape, stride=stride, mask=valid_mask)
+    r = r[v, u]
+    colors = sample_colors(color_raw, v, u)
 
-    # Shift x and y coordinates to center
-    x_prime = x_grid - half_w
-    y_prime = y_grid - half_h
-    theta_max = np.pi / 2.0
-    # Compute theta and Cartesian coordinates
-    theta = (x_prime / half_w) * (np.pi / 2.0)
-    
-    exceed_mask = (theta < -theta_max) | (theta > theta_max)  # Logical OR for exceeding values
+    # Convert to Cartesian, where theta=0 is forward (+Z)
+    sin_theta, cos_theta, heights = projection_geometry(height, width, grid_h, grid_w, vertical_scale)
+    points = np.empty((len(r), 3), dtype=np.float32)
+    points[:, 0] = r * sin_theta[u]
+    points[:, 1] = heights[v]
+    points[:, 2] = r * cos_theta[u]
 
-    # Print the exceeding theta values
-    exceeding_thetas = theta[exceed_mask]
-    print("Theta values exceeding the limits:", exceeding_thetas)
+    if return_pixels:
+        return points, colors, v * grid_w + u
+    return points, colors
 
-    X = r * np.sin(theta)
-    Z = r * np.cos(theta)
-    Y = y_prime * vertical_scale
 
-    # Apply the valid mask
-    X = X[valid_mask]
-    Y = Y[valid_mask]
-    Z = Z[valid_mask]
+@lru_cache(maxsize=8)
+def projection_geometry(height, width, grid_h, grid_w, vertical_scale):
+    """
+    The parts of the cylindrical projection that only depend on the image and grid sizes: sin/cos of the
+    azimuth of every grid column and the height of every grid row. Cached, so same-sized images (e.g. the
+    frames of a video) do not recompute the trigonometry.
 
-    # Stack the points into a single array
-    points = np.vstack((X, Y, Z)).T
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray): Read-only sin(theta) and cos(theta) of length grid_w and
+        heights of length grid_h.
+    """
+    half_w = width / 2.0
+    half_h = height / 2.0
 
-    # Normalize colors and apply the mask
-    colors = (color_raw / 255.0).reshape(-1, 3)
-    colors = colors[valid_mask.flatten()]
+    # Grid cell centers in full-resolution pixel coordinates
+    x_full = (np.arange(grid_w) + 0.5) * (width / grid_w) - 0.5
+    y_full = (np.arange(grid_h) + 0.5) * (height / grid_h) - 0.5
 
-    # Convert arrays to Open3D format
-    points = np.array(points, dtype=np.float32)
-    colors = np.array(colors, dtype=np.float32)
-    print('before loading pcd')
-    pcd = o3d.geometry.PointCloud()
-    pcd.points = o3d.utility.Vector3dVector(points)
+    # Shift x and y coordinates to center and map x' in [-half_w, +half_w] to theta in [-pi/2, +pi/2]
+    theta = ((x_full - half_w) / half_w) * (np.pi / 2.0)
+    geometry = (np.sin(theta), np.cos(theta), (y_full - half_h) * vertical_scale)
+    for array in geometry:
+        array.setflags(write=False)
+    return geometry
 
-    # o3d.visualization.draw_geometries([pcd])
 
-    pcd.colors = o3d.utility.Vector3dVector(colors)
-    print('after loading pcd')
+def downsample_geometry(points, colors, pixel_index=None, grid_shape=None, bin_size=2, voxel_size=None):
+    """
+    Reduce the projected points into a Geometry. Normals are left to the meshers that need them.
 
-    pcd = pcd.voxel_down_sample(voxel_size=0.1)  # Adjust voxel size as needed
-    
+    Points are averaged over bin_size x bin_size blocks of the depth grid in numpy (bin_points). The
+    optional voxel pass goes through Open3D and loses the pixel indices.
+    """
+    if pixel_index is not None and bin_size > 1:
+        points, colors, pixel_index = bin_points(points, colors, pixel_index, grid_shape, bin_size=bin_size)
 
-    pcd.estimate_normals(
-        search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=1.0, max_nn=30)
-    )
-    
-    # pcd.orient_normals_consistent_tangent_plane(30)
+    cloud = Geometry(points, colors, pixel_index=pixel_index)
+    if voxel_size:
+        cloud = Geometry.from_open3d(cloud.to_point_cloud().voxel_down_sample(voxel_size=voxel_size))
+    return cloud
 
-    return pcd
 
+def downsample_points(points, colors, pixel_index=None, grid_shape=None, bin_size=2, voxel_size=None):
+    """downsample_geometry as an Open3D cloud."""
+    return downsample_geometry(points, colors, pixel_index=pixel_index, grid_shape=grid_shape,
+                               bin_size=bin_size, voxel_size=voxel_size).to_point_cloud()
 
-def delauny_method(pcd, save_path=None):
-    # Extract points from the point cloud
-    points = np.asarray(pcd.points)
-    print('after points, before triangulation')
 
+def triangulate_geometry(cloud):
+    """
+    Triangulate the cloud in the xy-plane, cluster vertices and flip the faces towards the camera.
+    The returned mesh has neither colors nor normals yet (see color_geometry). Only the vertex
+    clustering goes through Open3D.
+    """
+    # Perform Delaunay triangulation in 2D (xy-plane)
+    triangulation = Delaunay(cloud.positions[:, :2])
+    mesh = Geometry(cloud.positions, indices=triangulation.simplices).to_triangle_mesh()
+    mesh = mesh.simplify_vertex_clustering(voxel_size=0.5)
 
-    # Perform Delaunay triangulation
-    triangulation = Delaunay(points[:, :2])  # Perform Delaunay triangulation in 2D (xy-plane)
-    # # For 3D, you may need to use a more sophisticated triangulation method like Delaunay in 3D
-    # # triangulation = Delaunay(points) # This can be computationally expensive for large datasets
+    # Flip the orientation of the mesh by reversing the order of the triangles
+    return Geometry(np.asarray(mesh.vertices), indices=np.asarray(mesh.triangles)[:, ::-1])
 
 
-    vertices = points
-    triangles = triangulation.simplices  # The simplices (triangles) from Delaunay
+def delaunay_triangulate(pcd):
+    """triangulate_geometry for an Open3D cloud."""
+    return triangulate_geometry(Geometry.from_open3d(pcd)).to_triangle_mesh()
 
-    # # Create the mesh using Open3D
-    mesh = o3d.geometry.TriangleMesh()
-    mesh.vertices = o3d.utility.Vector3dVector(vertices)
-    mesh.triangles = o3d.utility.Vector3iVector(triangles)
-    print('finish loading mesh')
-    # # Optionally, compute vertex normals
-    mesh = mesh.simplify_vertex_clustering(voxel_size=0.5)
-    mesh.compute_vertex_normals()
 
-    # # Assign colors from point cloud to mesh vertices
-    pcd_tree = o3d.geometry.KDTreeFlann(pcd)
-    mesh_colors = []
-    for v in mesh.vertices:
-        [_, idx, _] = pcd_tree.search_knn_vector_3d(v, 1)
-        nearest_color = pcd.colors[idx[0]]
-        mesh_colors.append(nearest_color)
+def color_geometry(mesh, cloud):
+    """
+    Color the mesh vertices that have no colors with their nearest cloud point's color (one batched
+    KD-tree query), and compute the vertex normals once, after every topology change. Meshes that
+    already have both (poisson_method colors its own) are passed through.
+    """
+    if mesh.colors is not None and mesh.normals is not None:
+        return mesh
+    colors = mesh.colors
+    if colors is None and cloud.colors is not None:
+        _, idx = cKDTree(cloud.positions).query(mesh.positions, k=1)
+        colors = cloud.colors[idx]
+    return Geometry(mesh.positions, colors, mesh.indices, mesh.pixel_index,
+                    vertex_normals(mesh.positions, mesh.indices))
 
-    # # Assign vertex colors to the mesh
-    mesh.vertex_colors = o3d.utility.Vector3dVector(mesh_colors)
 
-    # # Smooth the mesh (optional)
-    # print(f"Before smoothing: Vertices = {len(mesh.vertices)}, Faces = {len(mesh.triangles)}")
-    # mesh.filter_smooth_laplacian(number_of_iterations=10)
-    # print(f"After smoothing: Vertices = {len(mesh.vertices)}, Faces = {len(mesh.triangles)}")
+def color_mesh(mesh, pcd):
+    """
+    Assign colors from the point cloud to mesh vertices that have none, and compute the vertex
+    normals once, after every topology change.
+    """
+    if not mesh.has_vertex_colors():
+        transfer_colors(mesh, pcd)
+    mesh.compute_vertex_normals()
+    return mesh
 
-    # # Flip the orientation of the mesh by reversing the order of the triangles (if necessary)
-    mesh.triangles = o3d.utility.Vector3iVector(np.asarray(mesh.triangles)[..., ::-1])
 
-    # # Recompute vertex normals after flipping the triangles
-    mesh.compute_vertex_normals()
+def delauny_method(pcd, save_path=None, visualize=False):
+    mesh = color_mesh(delaunay_triangulate(pcd), pcd)
 
     if save_path:
-        o3d.io.write_triangle_mesh(save_path, mesh)
+        write_triangle_mesh(save_path, mesh)
         print(f"Mesh saved to {save_path}")
 
     # Visualize the mesh
-    o3d.visualization.draw_geometries([mesh])
-        
+    if visualize:
+        o3d.visualization.draw_geometries([mesh])
+
+    return mesh
+
+
+def slice_method(pcd, save_path=None, num_slices=64):
+    """
+    Mesh the cylindrical point cloud by triangulating angular slices in parallel
+    (see cylinder.create_cylindrical_mesh), as a cheaper alternative to delauny_method
+    on large clouds.
+
+    Args:
+        pcd (o3d.geometry.PointCloud): The cylindrical-wrapped point cloud.
+        save_path (str): Optional path to write the mesh to.
+        num_slices (int): Number of angular slices around the vertical (Y) axis.
+
+    Returns:
+        mesh (o3d.geometry.TriangleMesh): The colored mesh.
+    """
+    colors = np.asarray(pcd.colors) if pcd.has_colors() else None
+    mesh = create_cylindrical_mesh(np.asarray(pcd.points), num_slices=num_slices, colors=colors, up_axis=1)
+    print(f"Slice mesh: Vertices = {len(mesh.vertices)}, Faces = {len(mesh.triangles)}")
+
+    if save_path:
+        write_triangle_mesh(save_path, mesh)
+        print(f"Mesh saved to {save_path}")
+
+    return mesh
+
+
+def poisson_method(pcd, save_path=None, time_budget=10.0, density_quantile=0.1):
+    """
+    Mesh the cylindrical point cloud with screened Poisson reconstruction.
+
+    Args:
+        pcd (o3d.geometry.PointCloud): The cylindrical-wrapped point cloud.
+        save_path (str): Optional path to write the mesh to.
+        time_budget (float): Seconds the reconstruction may take; bounds the octree depth.
+        density_quantile (float): Fraction of lowest-density vertices to prune (surface hallucinated
+                                  far from any point).
+
+    Returns:
+        mesh (o3d.geometry.TriangleMesh): The colored mesh.
+    """
+    # The camera sits at the origin of the cylinder, so normals can simply face it
+    orient_normals_towards_origin(pcd)
+
+    depth = choose_poisson_depth(len(pcd.points), time_budget=time_budget)
+    print(f"Poisson reconstruction of {len(pcd.points)} points at depth {depth}")
+    mesh, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(pcd, depth=depth)
+    remove_low_density_vertices(mesh, densities, quantile=density_quantile)
+    # Open3D interpolates the point colors onto the Poisson vertices itself
+    mesh = color_mesh(mesh, pcd)
+
+    if save_path:
+        write_triangle_mesh(save_path, mesh)
+        print(f"Mesh saved to {save_path}")
+
+    return mesh
+
+
+# Pipeline stages. Each returns a dict of the outputs it declares in build_graph.
+
+def _decode_stage(image_path):
+    color_raw = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if color_raw is None:
+        raise FileNotFoundError(f"Image not found at {image_path}")
+    return {"color": cv2.cvtColor(color_raw, cv2.COLOR_BGR2RGB)}
+
+
+def _depth_stage(color, model_type="DPT_Large", target_points=None):
+    # Predict depth directly on the working grid rather than upsampling it to the full image first
+    output_size = working_grid_shape(color.shape, target_points)
+    return {"depth": depth_from_array(color, model_type=model_type, output_size=output_size)}
+
+
+def _style_stage(color, style=None):
+    if style is not None and style != "photorealistic":
+        color = stylize_array(color, style)
+    return {"styled_color": color}
+
 
-def open_3d_main(color_image_path, save_path, scale=1.5, style=None):
-    pcd = cylindrical_projection(color_image_path, depth_scale_factor=scale, style=style)
-    delauny_method(pcd, save_path=save_path)
+def _project_stage(styled_color, depth, scale=1.5, vertical_scale=1.4):
+    points, colors, pixel_index = cylindrical_points(styled_color, depth, depth_scale_factor=scale,
+                                                     vertical_scale=vertical_scale, return_pixels=True)
+    return {"points": points, "colors": colors, "pixel_index": pixel_index, "grid_shape": depth.shape}
+
+
+# Stages pass clouds and meshes as Geometry and only build Open3D objects around Open3D algorithms.
+
+def _downsample_stage(points, colors, pixel_index, grid_shape, bin_size=2, voxel_size=None):
+    return {"cloud": downsample_geometry(points, colors, pixel_index=pixel_index, grid_shape=grid_shape,
+                                         bin_size=bin_size, voxel_size=voxel_size)}
+
+
+def _normals_stage(cloud):
+    oriented = cloud.to_point_cloud()
+    orient_normals_towards_origin(oriented)
+    return {"oriented_pcd": oriented}
+
+
+def _delaunay_stage(cloud):
+    return {"mesh": triangulate_geometry(cloud)}
+
+
+def _slices_stage(cloud, num_slices=64):
+    vertex_index, triangles = cylindrical_mesh_arrays(cloud.positions, num_slices=num_slices, up_axis=1)
+    print(f"Slice mesh: Vertices = {len(vertex_index)}, Faces = {len(triangles)}")
+    return {"mesh": Geometry(cloud.positions[vertex_index],
+                             None if cloud.colors is None else cloud.colors[vertex_index],
+                             triangles,
+                             None if cloud.pixel_index is None else cloud.pixel_index[vertex_index])}
+
+
+def _poisson_stage(oriented_pcd):
+    return {"mesh": Geometry.from_open3d(poisson_method(oriented_pcd))}
+
+
+def _color_stage(mesh, cloud):
+    return {"colored_mesh": color_geometry(mesh, cloud)}
+
+
+def _export_stage(colored_mesh, save_path):
+    colored_mesh.write(save_path)
+    print(f"Mesh saved to {save_path}")
+    return {"saved_path": save_path}
+
+
+def point_sizes(positions, image_shape, grid_shape, vertical_scale=1.4, bin_size=2):
+    """
+    Splat size hint of every point: the spacing of the binned grid around it, i.e. the larger of the
+    arc one bin spans at the point's radius and the height of one bin.
+    """
+    height = image_shape[0]
+    grid_h, grid_w = grid_shape
+    step = max(bin_size, 1)
+    radius = np.hypot(positions[:, 0], positions[:, 2])
+    # The panorama's width spans pi radians of azimuth (see projection_geometry)
+    arc = radius * np.float32(np.pi / grid_w * step)
+    return np.maximum(arc, np.float32(height / grid_h * vertical_scale * step))
+
+
+def _splat_stage(cloud, styled_color, depth, save_path, vertical_scale=1.4, bin_size=2, size_hints=True):
+    # styled_color and depth are only read for the image and grid sizes
+    sizes = None
+    if size_hints:
+        sizes = point_sizes(cloud.positions, styled_color.shape, depth.shape, vertical_scale, bin_size)
+    write_splats(save_path, cloud.positions, cloud.colors, sizes)
+    print(f"Point cloud saved to {save_path}")
+    return {"splat_path": save_path}
+
+
+MESH_STAGES = {
+    "delaunay": Stage("mesh", _delaunay_stage, inputs=("cloud",), outputs=("mesh",)),
+    "slices": Stage("mesh", _slices_stage, inputs=("cloud",), outputs=("mesh",)),
+    "poisson": Stage("mesh", _poisson_stage, inputs=("oriented_pcd",), outputs=("mesh",)),
+}
+
+# Intermediates shared across requests, so e.g. a different style reuses depth and a different
+# mesher reuses the downsampled cloud
+STAGE_CACHE = StageCache(max_entries=8, max_bytes=config.STAGE_CACHE_MAX_BYTES)
+
+
+def build_graph(method="delaunay"):
+    """
+    The cylindrical pipeline: decode -> depth -> style -> project -> downsample -> mesh -> color -> export.
+    The splat stage writes the downsampled cloud instead, for the point output, and skips meshing.
+    """
+    if method not in MESH_STAGES:
+        raise ValueError(f"Unknown meshing method: {method}")
+    return PipelineGraph([
+        Stage("decode", _decode_stage, inputs=("image_path",), outputs=("color",), cacheable=True),
+        Stage("depth", _depth_stage, inputs=("color",), outputs=("depth",), params=("model_type", "target_points"),
+              cacheable=True),
+        Stage("style", _style_stage, inputs=("color",), outputs=("styled_color",), params=("style",), cacheable=True),
+        Stage("project", _project_stage, inputs=("styled_color", "depth"),
+              outputs=("points", "colors", "pixel_index", "grid_shape"), params=("scale", "vertical_scale")),
+        Stage("downsample", _downsample_stage, inputs=("points", "colors", "pixel_index", "grid_shape"),
+              outputs=("cloud",), params=("bin_size", "voxel_size"), cacheable=True),
+        Stage("normals", _normals_stage, inputs=("cloud",), outputs=("oriented_pcd",)),
+        MESH_STAGES[method],
+        Stage("color", _color_stage, inputs=("mesh", "cloud"), outputs=("colored_mesh",)),
+        Stage("export", _export_stage, inputs=("colored_mesh", "save_path"), outputs=("saved_path",)),
+        Stage("splat", _splat_stage, inputs=("cloud", "styled_color", "depth", "save_path"), outputs=("splat_path",),
+              params=("vertical_scale", "bin_size", "size_hints")),
+    ])
+
+
+def run_pipeline(sources, source_keys, save_path, scale=1.5, style=None, method="delaunay",
+                 vertical_scale=1.4, bin_size=2, voxel_size=None, target_points=None, cache=STAGE_CACHE,
+                 limiters=None, memory=None, progress=None, output="mesh", size_hints=True, targets=None):
+    """
+    Runs the cylindrical pipeline from either an image path or an already decoded image.
+
+    Args:
+        sources (dict): {"image_path": ...} or {"color": HxWx3 uint8 RGB array}.
+        source_keys (dict): Content keys of the sources, used for the stage cache.
+        save_path (str): Where the mesh is written.
+        target_points (int): Working resolution as a point count: depth is resampled to (and points are
+                             projected from) a grid of about this many cells. None uses every pixel.
+        bin_size (int): Side, in grid pixels, of the blocks averaged into one point before meshing.
+        voxel_size (float): Optional extra Open3D voxel downsampling of the binned cloud.
+        limiters (dict): Optional admission limiters by stage name (see admission.AdmissionController).
+        memory (memory_guard.MemoryRecorder): Optional recorder of per-stage peak memory.
+        progress (callable): Optional progress(event_type, **data), called from this thread as stages start
+                             and finish, with point/triangle counts and coarse previews (see progress.py).
+        output (str): 'mesh' writes a mesh to save_path; 'points' writes the downsampled cloud as a
+                      quantized splat cloud (.glb or .ply, see mesh_io.write_splats) and skips meshing.
+        size_hints (bool): Store a per-point size with the 'points' output (see point_sizes).
+        targets (tuple): Values to compute and return; stages nothing in targets depends on do not run.
+                         Defaults to the path of the requested output.
+    """
+    if output not in ("mesh", "points"):
+        raise ValueError(f"Unknown output: {output}")
+    if targets is None:
+        targets = ("splat_path",) if output == "points" else ("saved_path",)
+    params = {
+        "model_type": "DPT_Large",
+        "target_points": target_points,
+        "style": style,
+        "scale": scale,
+        "vertical_scale": vertical_scale,
+        "bin_size": bin_size,
+        "voxel_size": voxel_size,
+        "size_hints": size_hints,
+    }
+    return build_graph(method).run(
+        targets,
+        sources={**sources, "save_path": save_path},
+        params=params,
+        cache=cache,
+        source_keys=source_keys,
+        limiters=limiters,
+        stage_context=stage_context if memory is None else _recorded_stage_context(memory),
+        listener=None if progress is None else stage_listener(progress),
+    )
+
+
+def _recorded_stage_context(memory):
+    """Wraps each stage in both its CPU pinning and the memory recorder."""
+    def context(name):
+        stack = ExitStack()
+        stack.enter_context(stage_context(name))
+        stack.enter_context(memory.stage(name))
+        return stack
+    return context
+
+
+def open_3d_main(color_image_path, save_path, scale=1.5, style=None, method="delaunay", **kwargs):
+    run_pipeline({"image_path": color_image_path}, {"image_path": hash_file(color_image_path)},
+                 save_path, scale=scale, style=style, method=method, **kwargs)
     return None
 
+
+def open_3d_from_array(color_raw, save_path, content_key=None, scale=1.5, style=None, method="delaunay", **kwargs):
+    """
+    Same as open_3d_main for an image decoded once by the caller (see ingest.decode_image), which the
+    depth and style stages then share. content_key (e.g. the upload's hash) enables the stage cache.
+
+    Returns:
+        dict: The pipeline targets (see run_pipeline).
+    """
+    source_keys = {}
+    if content_key is not None:
+        source_keys["color"] = f"{content_key}:{color_raw.shape}"
+    return run_pipeline({"color": color_raw}, source_keys, save_path,
+                        scale=scale, style=style, method=method, **kwargs)
+
+
+# The mesh geometry only depends on the depth map, so other styles recolor it instead of re-meshing.
+
+def panorama_coordinates(vertices, image_shape, vertical_scale=1.4):
+    """
+    Inverts the cylindrical projection: the full-resolution panorama pixel (x, y) every vertex comes from.
+
+    Args:
+        vertices (np.ndarray): Nx3 mesh vertices.
+        image_shape (tuple): Shape of the panorama the mesh was projected from.
+        vertical_scale (float): The vertical scale used by the projection.
+
+    Returns:
+        np.ndarray: Nx2 float32 pixel coordinates.
+    """
+    height, width = image_shape[:2]
+    half_w = width / 2.0
+    half_h = height / 2.0
+    theta = np.arctan2(vertices[:, 0], vertices[:, 2])
+    coords = np.empty((len(vertices), 2), dtype=np.float32)
+    coords[:, 0] = theta / (np.pi / 2.0) * half_w + half_w
+    coords[:, 1] = vertices[:, 1] / vertical_scale + half_h
+    return coords
+
+
+def sample_panorama(color, coords):
+    """Bilinearly samples an RGB image at Nx2 (x, y) pixel coordinates; returns Nx3 float colors in [0, 1]."""
+    height, width = color.shape[:2]
+    x = np.clip(coords[:, 0], 0, width - 1)
+    y = np.clip(coords[:, 1], 0, height - 1)
+    x0 = np.minimum(x.astype(np.int32), width - 2) if width > 1 else np.zeros(len(x), dtype=np.int32)
+    y0 = np.minimum(y.astype(np.int32), height - 2) if height > 1 else np.zeros(len(y), dtype=np.int32)
+    x1 = np.minimum(x0 + 1, width - 1)
+    y1 = np.minimum(y0 + 1, height - 1)
+    wx = (x - x0)[:, None]
+    wy = (y - y0)[:, None]
+    top = color[y0, x0] * (1 - wx) + color[y0, x1] * wx
+    bottom = color[y1, x0] * (1 - wx) + color[y1, x1] * wx
+    return (top * (1 - wy) + bottom * wy) * (1.0 / 255.0)
+
+
+def recolor_mesh(mesh, coords, color):
+    """Returns mesh (a Geometry) with vertex colors sampled from color at the vertices' panorama coordinates."""
+    return mesh.with_colors(sample_panorama(color, coords))
+
+
+def mesh_geometry(mesh, color_raw, depth=None, styled_color=None, scale=1.5, vertical_scale=1.4):
+    """
+    What restyling or re-projecting a rendered mesh needs: the mesh, its vertices' panorama coordinates
+    (see panorama_coordinates), the unstyled content image, the working-grid depth map, the colors the
+    mesh was projected with and the projection parameters.
+    """
+    return {
+        "mesh": mesh,
+        "coords": panorama_coordinates(mesh.positions, color_raw.shape, vertical_scale),
+        "color": color_raw,
+        "depth": depth,
+        "styled_color": color_raw if styled_color is None else styled_color,
+        "scale": scale,
+        "vertical_scale": vertical_scale,
+    }
+
+
+def render_geometry(color_raw, content_key=None, scale=1.5, vertical_scale=1.4, **kwargs):
+    """
+    Runs the pipeline up to the mesh, without exporting it.
+
+    Returns:
+        dict: The mesh geometry (see mesh_geometry).
+    """
+    result = open_3d_from_array(color_raw, None, content_key=content_key, scale=scale, vertical_scale=vertical_scale,
+                                targets=("colored_mesh", "depth", "styled_color"), **kwargs)
+    return mesh_geometry(result["colored_mesh"], color_raw, result["depth"], result["styled_color"],
+                         scale=scale, vertical_scale=vertical_scale)
+
+
+def restyle_mesh(geometry, style, save_path, limiter=None, max_pixels=None):
+    """
+    Writes the mesh of an earlier render in another style: only style transfer runs, and the vertex colors
+    are resampled through the stored panorama coordinates.
+
+    Args:
+        geometry (dict): See mesh_geometry.
+        style (str): Style name from nst_styles/, or 'photorealistic'.
+        save_path (str): Where the mesh is written.
+        limiter (admission.StageLimiter): Optional limiter of the style stage.
+        max_pixels (int): Optional upper bound on the size style transfer runs at (see memory_guard.plan_request);
+                          a larger stored image is stylized downscaled and the result resized back.
+
+    Returns:
+        dict: The geometry of the restyled mesh.
+    """
+    color = geometry["color"]
+    if style not in (None, "photorealistic"):
+        height, width = color.shape[:2]
+        content = color
+        if max_pixels is not None and width * height > max_pixels:
+            factor = (max_pixels / (width * height)) ** 0.5
+            size = (max(1, int(width * factor)), max(1, int(height * factor)))
+            content = cv2.resize(color, size, interpolation=cv2.INTER_AREA)
+        with limiter.slot() if limiter is not None else nullcontext(), stage_context("style"):
+            color = stylize_array(content, style)
+        if content is not geometry["color"]:
+            color = cv2.resize(color, (width, height), interpolation=cv2.INTER_LINEAR)
+    mesh = recolor_mesh(geometry["mesh"], geometry["coords"], color)
+    mesh.write(save_path)
+    print(f"Mesh saved to {save_path}")
+    return {**geometry, "mesh": mesh, "styled_color": color}
+
+
+def reproject_mesh(geometry, save_path, scale=None, vertical_scale=None, content_key=None, limiters=None,
+                   **kwargs):
+    """
+    Rebuilds the mesh of an earlier render with other projection parameters. The stored depth map and
+    colors are fed to the pipeline in place of depth estimation and style transfer, so only projection,
+    downsampling and meshing run.
+
+    Args:
+        geometry (dict): See mesh_geometry; must hold the depth map.
+        save_path (str): Where the mesh is written.
+        scale (float): Depth scale factor (default: the one the mesh was rendered with).
+        vertical_scale (float): Vertical scale of the projection (default: the one the mesh was rendered with).
+        content_key (str): Optional identity of the stored depth and colors, which enables the stage cache.
+        limiters (dict): Optional admission limiters by stage name.
+        **kwargs: Passed to the pipeline (method, bin_size, ...).
+
+    Returns:
+        dict: The geometry of the new mesh.
+    """
+    if geometry.get("depth") is None:
+        raise ValueError("The geometry holds no depth map to re-project")
+    scale = geometry["scale"] if scale is None else scale
+    vertical_scale = geometry["vertical_scale"] if vertical_scale is None else vertical_scale
+    source_keys = {}
+    if content_key is not None:
+        source_keys = {"depth": f"{content_key}:depth", "styled_color": f"{content_key}:styled_color"}
+    result = run_pipeline({"depth": geometry["depth"], "styled_color": geometry["styled_color"]}, source_keys,
+                          save_path, scale=scale, vertical_scale=vertical_scale, limiters=limiters,
+                          targets=("saved_path", "colored_mesh"), **kwargs)
+    return mesh_geometry(result["colored_mesh"], geometry["color"], geometry["depth"], geometry["styled_color"],
+                         scale=scale, vertical_scale=vertical_scale)
+
+
+def render_styles(color_raw, styles, save_paths=None, content_key=None, limiters=None, **kwargs):
+    """
+    Renders one image in several styles: depth and geometry are computed once, all artistic styles run
+    in a single batched style-transfer call, and each style's mesh is the shared geometry recolored.
+
+    Args:
+        color_raw (np.ndarray): HxWx3 uint8 RGB image.
+        styles (list): Style names from nst_styles/, or 'photorealistic'.
+        save_paths (list): Where each style's mesh is written; None only returns the geometries.
+        limiters (dict): Optional admission limiters; the batched style call holds one 'style' slot.
+        **kwargs: Passed to the pipeline (scale, method, target_points, ...).
+
+    Returns:
+        dict: The geometry of each style's mesh by style (see mesh_geometry).
+    """
+    limiters = limiters or {}
+    geometry = render_geometry(color_raw, content_key=content_key,
+                               limiters={name: limiter for name, limiter in limiters.items() if name != "style"},
+                               **kwargs)
+
+    artistic = [style for style in styles if style not in (None, "photorealistic")]
+    styled = {}
+    if artistic:
+        limiter = limiters.get("style")
+        with limiter.slot() if limiter is not None else nullcontext(), stage_context("style"):
+            styled = dict(zip(artistic, stylize_array_batch(color_raw, artistic)))
+
+    geometries = {}
+    for style, save_path in zip(styles, save_paths or [None] * len(styles)):
+        color = styled.get(style, color_raw)
+        mesh = recolor_mesh(geometry["mesh"], geometry["coords"], color)
+        if save_path is not None:
+            mesh.write(save_path)
+            print(f"Mesh saved to {save_path}")
+        geometries[style] = {**geometry, "mesh": mesh, "styled_color": color}
+    return geometries
+
 if __name__ == "__main__":
     color_image_path = "assets/web/temple.jpg"
     depth_image_path = "depth_map.png"
@@ -0,0 +1,274 @@
+# Cap BLAS/OpenMP thread pools before numpy, scipy and Open3D are imported
+import resources
+resources.apply_thread_limits()
+
+import numpy as np
+import cv2
+from PIL import Image
+from scipy.spatial import Delaunay, QhullError
+from midas_depth_map import depth_from_array
+from transformations import root_scaling
+from compute_mesh import working_grid_shape, bin_points
+from open_3d import projection_geometry
+from mesh_io import write_obj_vertices, write_obj_faces
+from geometry import accumulate_normals
+
+# Out-of-core meshing of panoramas too large for the in-memory pipeline. The image is read in horizontal
+# strips, each strip is projected, binned and triangulated on its own, and the mesh is written strip by
+# strip, so peak memory depends on the strip size and the working grid, not on the image size.
+
+# Bytes of full-resolution RGB rows read per strip
+STRIP_BYTES = 256 * 1024 ** 2
+# Size of the reduced image MiDaS runs on
+DEPTH_INPUT_PIXELS = 2048 * 1024
+# Uncompressed pixel layouts that can be memory-mapped, and whether their channels are reversed
+RAW_MODES = {"RGB": False, "BGR": True}
+
+
+class StripImage:
+    """
+    Row-range access to a large RGB image.
+
+    .npy arrays and uncompressed PPM, TIFF and BMP files are memory-mapped, so reading a strip only
+    touches its rows. Compressed formats (JPEG, PNG, compressed TIFF) cannot be decoded by row range
+    and are decoded whole once; convert those to one of the formats above (e.g. with vips or
+    ImageMagick) when even their 8-bit RGB does not fit in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._array = None
+        self._tiles = None
+        if path.lower().endswith(".npy"):
+            self._array = np.load(path, mmap_mode="r")
+            if self._array.ndim != 3 or self._array.shape[2] < 3 or self._array.dtype != np.uint8:
+                raise ValueError(f"{path} must hold an HxWx3 uint8 RGB array")
+        else:
+            self._tiles = self._map_raw_tiles(path)
+            if self._tiles is None:
+                print(f"{path} is compressed; decoding it whole")
+                color = cv2.imread(path, cv2.IMREAD_COLOR)
+                if color is None:
+                    raise FileNotFoundError(f"Image not found at {path}")
+                self._array = cv2.cvtColor(color, cv2.COLOR_BGR2RGB)
+        if self._array is not None:
+            self.height, self.width = self._array.shape[:2]
+
+    def _map_raw_tiles(self, path):
+        """Memory-maps the raw tiles PIL reports for the file, or returns None if it is not uncompressed RGB."""
+        max_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            with Image.open(path) as image:
+                self.width, self.height = image.size
+                tiles = list(image.tile)
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_pixels
+
+        mapped = []
+        for codec, (x0, y0, x1, y1), offset, args in tiles:
+            rawmode, stride, orientation = (args, 0, 1) if isinstance(args, str) else (tuple(args) + (0, 1))[:3]
+            if codec != "raw" or rawmode not in RAW_MODES or (x0, x1) != (0, self.width):
+                return None
+            stride = stride or self.width * 3
+            rows = np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(y1 - y0, stride))
+            rows = rows[:, :self.width * 3].reshape(y1 - y0, self.width, 3)
+            if orientation < 0:
+                rows = rows[::-1]
+            if RAW_MODES[rawmode]:
+                rows = rows[..., ::-1]
+            mapped.append((y0, y1, rows))
+        return mapped
+
+    def rows(self, start, stop):
+        """Returns rows [start, stop) as a (stop - start)xWx3 uint8 RGB array."""
+        if self._array is not None:
+            return np.ascontiguousarray(self._array[start:stop, :, :3])
+        strip = np.empty((stop - start, self.width, 3), dtype=np.uint8)
+        for y0, y1, tile in self._tiles:
+            lo, hi = max(start, y0), min(stop, y1)
+            if lo < hi:
+                strip[lo - start:hi - start] = tile[lo - y0:hi - y0]
+        return strip
+
+
+def reduced_image(image, max_pixels=DEPTH_INPUT_PIXELS, strip_bytes=STRIP_BYTES):
+    """
+    Area-downscales the whole image by an integer factor, strip by strip, to at most max_pixels pixels.
+    """
+    factor = max(1, int(np.ceil((image.height * image.width / max_pixels) ** 0.5)))
+    out_w, out_h = image.width // factor, image.height // factor
+    rows_per_strip = max(1, strip_bytes // (image.width * 3 * factor)) * factor
+    reduced = np.empty((out_h, out_w, 3), dtype=np.uint8)
+    for start in range(0, out_h * factor, rows_per_strip):
+        stop = min(start + rows_per_strip, out_h * factor)
+        strip = image.rows(start, stop)[:, :out_w * factor]
+        reduced[start // factor:stop // factor] = cv2.resize(strip, (out_w, (stop - start) // factor),
+                                                             interpolation=cv2.INTER_AREA)
+    return reduced
+
+
+def iter_strip_points(image, depth, depth_scale_factor=1.5, vertical_scale=1.4, bin_size=2,
+                      strip_bytes=STRIP_BYTES):
+    """
+    Projects the image strip by strip onto the working grid of depth, as cylindrical_points does for a
+    whole image, and bins each strip (see compute_mesh.bin_points).
+
+    Strips are a multiple of bin_size grid rows, so no bin straddles two strips, and the depth
+    normalization uses the range of the whole map, so strips match at their seams.
+
+    Args:
+        image (StripImage): The panorama.
+        depth (np.ndarray): MiDaS depth on the working grid (grid_h x grid_w).
+        depth_scale_factor (float): Global multiplier on the depth values.
+        vertical_scale (float): Factor to scale the vertical axis.
+        bin_size (int): Side, in grid pixels, of the blocks averaged into one point.
+        strip_bytes (int): Bytes of full-resolution rows read at a time.
+
+    Yields:
+        (np.ndarray, np.ndarray, np.ndarray): The strip's binned float32 points and colors in [0, 1],
+        and their grid pixel indices, in grid row-major order.
+    """
+    grid_h, grid_w = depth.shape
+    rows_per_cell = image.height / grid_h
+    depth_max = float(depth.max()) * depth_scale_factor
+    max_r = (depth_max - float(depth.min()) * depth_scale_factor) * 10
+    sin_theta, cos_theta, heights = projection_geometry(image.height, image.width, grid_h, grid_w, vertical_scale)
+
+    cells_per_strip = max(1, int(strip_bytes // (rows_per_cell * image.width * 3)) // bin_size) * bin_size
+    for g0 in range(0, grid_h, cells_per_strip):
+        g1 = min(g0 + cells_per_strip, grid_h)
+        start = int(g0 * rows_per_cell)
+        stop = max(start + 1, int(np.ceil(g1 * rows_per_cell)))
+        colors_grid = cv2.resize(image.rows(start, stop), (grid_w, g1 - g0), interpolation=cv2.INTER_AREA)
+
+        r = root_scaling((depth_max - depth[g0:g1].astype(np.float32) * depth_scale_factor) * 10, max_r=max_r)
+        v, u = np.nonzero(r > 0)
+        r = r[v, u]
+        colors = colors_grid[v, u].astype(np.float32) * np.float32(1.0 / 255.0)
+        v = v + g0
+
+        points = np.empty((len(r), 3), dtype=np.float32)
+        points[:, 0] = r * sin_theta[u]
+        points[:, 1] = heights[v]
+        points[:, 2] = r * cos_theta[u]
+        yield bin_points(points, colors, v * grid_w + u, (grid_h, grid_w), bin_size=bin_size)
+
+
+def _triangulate(points):
+    """Delaunay in the xy-plane, faces flipped towards the camera as in open_3d.triangulate_geometry."""
+    if len(points) < 3:
+        return np.empty((0, 3), dtype=np.int64)
+    try:
+        return Delaunay(points[:, :2]).simplices[:, ::-1]
+    except QhullError:
+        return np.empty((0, 3), dtype=np.int64)
+
+
+def write_strip_mesh(strips, out_path, grid_width, bin_size=2):
+    """
+    Triangulates the binned strips one at a time and writes a single OBJ with vertex colors and normals.
+
+    Each strip is triangulated together with the first bin row of the next strip, so the seam band is
+    covered and the two strips share the seam vertices. A strip's faces are written after the next
+    strip's vertices, which they reference, so only two strips are held at a time. The vertex clustering
+    of the in-memory Delaunay method is not applied, as it would move the shared seam vertices.
+
+    Args:
+        strips (iterable): (points, colors, pixel_index) per strip (see iter_strip_points).
+        out_path (str): The OBJ file to write.
+        grid_width (int): Width of the working grid the pixel indices refer to.
+        bin_size (int): The bin size the strips were binned with.
+
+    Returns:
+        (int, int): Number of vertices and triangles written.
+    """
+    strips = iter(strips)
+    current = next(strips, None)
+    pending_faces = None
+    carried_normals = None
+    vertex_count = triangle_count = 0
+
+    with open(out_path, "wb") as f:
+        while current is not None:
+            points, colors, pixel_index = current
+            upcoming = next(strips, None)
+            seam = 0
+            if upcoming is not None and len(upcoming[2]):
+                bin_rows = upcoming[2] // grid_width // max(bin_size, 1)
+                seam = int(np.searchsorted(bin_rows, bin_rows[0], side="right"))
+            region = np.concatenate([points, upcoming[0][:seam]]) if seam else points
+
+            triangles = _triangulate(region)
+            normals = np.zeros((len(region), 3), dtype=np.float64)
+            if carried_normals is not None:
+                normals[:len(carried_normals)] += carried_normals
+            accumulate_normals(region, triangles, normals)
+            carried_normals = normals[len(points):]
+
+            own = normals[:len(points)]
+            own /= np.maximum(np.linalg.norm(own, axis=1, keepdims=True), 1e-12)
+            write_obj_vertices(f, points, colors, own)
+            if pending_faces is not None:
+                write_obj_faces(f, *pending_faces, normals=True)
+
+            pending_faces = (triangles, vertex_count)
+            vertex_count += len(points)
+            triangle_count += len(triangles)
+            print(f"Strip written: {vertex_count} vertices, {triangle_count} triangles so far")
+            current = upcoming
+
+        if pending_faces is not None:
+            write_obj_faces(f, *pending_faces, normals=True)
+    return vertex_count, triangle_count
+
+
+def out_of_core_main(image_path, save_path, target_points=8_000_000, scale=1.5, vertical_scale=1.4, bin_size=2,
+                     strip_bytes=STRIP_BYTES, model_type="DPT_Large"):
+    """
+    Meshes a panorama of any size with bounded memory.
+
+    Depth is estimated once on an area-downscaled copy (see reduced_image) and resampled to the working
+    grid of about target_points cells, which bounds the only whole-image arrays; the full-resolution
+    pixels are only ever read strip by strip.
+
+    Args:
+        image_path (str): The panorama (see StripImage for the formats read without decoding it whole).
+        save_path (str): The OBJ file to write.
+        target_points (int): Working resolution as a point count.
+        scale (float): Depth scale factor.
+        vertical_scale (float): Factor to scale the vertical axis.
+        bin_size (int): Side, in grid pixels, of the blocks averaged into one point.
+        strip_bytes (int): Bytes of full-resolution rows read at a time.
+
+    Returns:
+        (int, int): Number of vertices and triangles written.
+    """
+    image = StripImage(image_path)
+    grid_h, grid_w = working_grid_shape((image.height, image.width), target_points)
+    print(f"{image.width}x{image.height} panorama, working grid {grid_w}x{grid_h}")
+    depth = depth_from_array(reduced_image(image, strip_bytes=strip_bytes), model_type=model_type,
+                             output_size=(grid_h, grid_w))
+    strips = iter_strip_points(image, depth, depth_scale_factor=scale, vertical_scale=vertical_scale,
+                               bin_size=bin_size, strip_bytes=strip_bytes)
+    counts = write_strip_mesh(strips, save_path, grid_w, bin_size=bin_size)
+    print(f"Mesh saved to {save_path}")
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert a very large panorama into a 3D mesh with bounded memory")
+    parser.add_argument("--input", type=str, required=True, help="Panorama (.npy, or uncompressed PPM/TIFF/BMP to avoid a full decode)")
+    parser.add_argument("--output", type=str, required=True, help="OBJ file to write")
+    parser.add_argument("--target_points", type=int, default=8_000_000, help="Working resolution as a point count")
+    parser.add_argument("--scale", type=float, default=1.5, help="Depth scale factor")
+    parser.add_argument("--vertical_scale", type=float, default=1.4, help="Vertical scale of the projection")
+    parser.add_argument("--bin_size", type=int, default=2, help="Grid pixels per side averaged into one point")
+    parser.add_argument("--strip_mb", type=int, default=STRIP_BYTES // 1024 ** 2, help="Megabytes of full-resolution rows per strip")
+    args = parser.parse_args()
+
+    out_of_core_main(args.input, args.output, target_points=args.target_points, scale=args.scale,
+                     vertical_scale=args.vertical_scale, bin_size=args.bin_size,
+                     strip_bytes=args.strip_mb * 1024 ** 2)
@@ -0,0 +1,275 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+import numpy as np
+
+
+class Stage:
+    """
+    One step of a pipeline graph.
+
+    Args:
+        name (str): Stage name, used in logs and cache keys.
+        fn (callable): Called as fn(**inputs, **params); returns a dict holding every name in outputs.
+        inputs (tuple): Names of the values the stage consumes.
+        outputs (tuple): Names of the values the stage produces.
+        params (tuple): Names of the run parameters the outputs depend on.
+        cacheable (bool): Whether the outputs may be kept in a StageCache and reused by later runs.
+                          Cached values are shared, so consumers of a cacheable stage must not mutate them.
+    """
+
+    def __init__(self, name, fn, inputs=(), outputs=(), params=(), cacheable=False):
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.params = tuple(params)
+        self.cacheable = cacheable
+
+
+# Array attributes of the Open3D geometries stage outputs can hold
+OPEN3D_ARRAYS = ("points", "colors", "normals", "vertices", "triangles", "vertex_colors", "vertex_normals",
+                 "triangle_normals")
+
+
+def resident_bytes(value):
+    """
+    Memory held by the arrays in a stage output: numpy arrays and anything else with nbytes (geometry.Geometry),
+    Open3D point clouds and meshes, and dicts, lists and tuples of them. Other values count as nothing.
+    """
+    if isinstance(value, dict):
+        return sum(resident_bytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(resident_bytes(item) for item in value)
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    if type(value).__module__.startswith("open3d"):
+        return sum(np.asarray(getattr(value, name)).nbytes for name in OPEN3D_ARRAYS if hasattr(value, name))
+    return 0
+
+
+class StageCache:
+    """
+    Thread-safe LRU of stage outputs, keyed by stage, parameters and upstream inputs.
+
+    Args:
+        max_entries (int): Entries kept at most.
+        max_bytes (int): Memory the entries' arrays may hold at most (see resident_bytes), None for no bound.
+                         An entry larger than that on its own is not kept.
+    """
+
+    def __init__(self, max_entries=16, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, outputs):
+        size = resident_bytes(outputs)
+        with self._lock:
+            self.bytes += size - self._sizes.get(key, 0)
+            self._entries[key] = outputs
+            self._sizes[key] = size
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                evicted, _ = self._entries.popitem(last=False)
+                self.bytes -= self._sizes.pop(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+
+class PipelineGraph:
+    """
+    A set of stages wired together by the names of the values they consume and produce.
+
+    Running the graph computes only the stages the requested targets transitively depend on, so an
+    output nobody consumes is never computed.
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self.producers = {}
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError(f"'{output}' is produced by both {self.producers[output].name} and {stage.name}")
+                self.producers[output] = stage
+
+    def plan(self, targets, sources):
+        """
+        Returns the stages needed to produce targets from sources, in execution order.
+
+        Args:
+            targets (iterable): Names of the values to produce.
+            sources (iterable): Names of the values supplied by the caller.
+        """
+        sources = set(sources)
+        order = []
+        visiting = set()
+
+        def visit(name):
+            if name in sources:
+                return
+            if name not in self.producers:
+                raise KeyError(f"Nothing produces '{name}'")
+            stage = self.producers[name]
+            if stage in order:
+                return
+            if stage.name in visiting:
+                raise ValueError(f"Cycle through stage {stage.name}")
+            visiting.add(stage.name)
+            for dependency in stage.inputs:
+                visit(dependency)
+            visiting.discard(stage.name)
+            order.append(stage)
+
+        for target in targets:
+            visit(target)
+        return order
+
+    def run(self, targets, sources, params=None, cache=None, source_keys=None, limiters=None, stage_context=None,
+            listener=None):
+        """
+        Computes targets lazily.
+
+        Cache keys are derived from parameters and source keys alone, so a cached stage is found
+        before anything upstream of it runs, and the stages that only feed it are skipped.
+
+        Args:
+            targets (iterable): Names of the values to return.
+            sources (dict): Values supplied by the caller (e.g. {"image_path": ...}).
+            params (dict): Run parameters; each stage receives the ones it declares.
+            cache (StageCache): Optional cache for the outputs of cacheable stages.
+            source_keys (dict): Stable identities of the sources (e.g. a content hash). A cacheable
+                                stage is only cached when every source it depends on has a key.
+            limiters (dict): Optional stage name -> admission.StageLimiter; the stage only runs while
+                             holding one of the limiter's slots.
+            stage_context (callable): Optional stage_context(stage_name) -> context manager entered
+                                      around every stage that runs (e.g. resources.stage_context).
+            listener (callable): Optional listener(event, stage_name, outputs=None, seconds=None), called
+                                 with "start" and "finish" around every stage that runs and with
+                                 "cached" for cache hits, from the thread running the graph.
+
+        Returns:
+            dict: The requested values by name.
+        """
+        targets = list(targets)
+        params = params or {}
+        limiters = limiters or {}
+        source_keys = source_keys or {}
+        stages = self.plan(targets, sources)
+
+        # Keys identify a value by everything it was computed from
+        value_keys = {name: source_keys.get(name) for name in sources}
+        stage_keys = {}
+        for stage in stages:
+            input_keys = [value_keys.get(name) for name in stage.inputs]
+            key = None
+            if None not in input_keys:
+                key = _stage_key(stage, self._stage_params(stage, params), input_keys)
+            for name in stage.outputs:
+                value_keys[name] = None if key is None else f"{key}:{name}"
+            stage_keys[stage.name] = key if stage.cacheable else None
+
+        # Walk back from the targets, stopping at sources and cache hits
+        cached = {}
+        required = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name in sources:
+                continue
+            stage = self.producers[name]
+            if stage.name in required or stage.name in cached:
+                continue
+            key = stage_keys[stage.name]
+            outputs = cache.get(key) if cache is not None and key is not None else None
+            if outputs is not None:
+                cached[stage.name] = outputs
+                continue
+            required.add(stage.name)
+            pending.extend(stage.inputs)
+
+        # Count the remaining consumers of every value so intermediates can be dropped early
+        consumers = {}
+        for stage in stages:
+            if stage.name in required:
+                for name in stage.inputs:
+                    consumers[name] = consumers.get(name, 0) + 1
+
+        values = dict(sources)
+        for stage in stages:
+            if stage.name in cached:
+                print(f"[{stage.name}] cached")
+                outputs = cached[stage.name]
+                if listener is not None:
+                    listener("cached", stage.name, outputs=outputs)
+            elif stage.name in required:
+                limiter = limiters.get(stage.name)
+                with limiter.slot() if limiter is not None else nullcontext(), \
+                        stage_context(stage.name) if stage_context is not None else nullcontext():
+                    if listener is not None:
+                        listener("start", stage.name)
+                    start = time.perf_counter()
+                    outputs = stage.fn(**{name: values[name] for name in stage.inputs},
+                                       **self._stage_params(stage, params))
+                    seconds = time.perf_counter() - start
+                    print(f"[{stage.name}] {seconds:.2f}s")
+                if listener is not None:
+                    listener("finish", stage.name, outputs=outputs, seconds=seconds)
+                key = stage_keys[stage.name]
+                if cache is not None and key is not None:
+                    cache.put(key, outputs)
+                for name in stage.inputs:
+                    consumers[name] -= 1
+                    if consumers[name] == 0 and name not in targets:
+                        values.pop(name, None)
+            else:
+                continue
+            for name in stage.outputs:
+                values[name] = outputs[name]
+
+        return {name: values[name] for name in targets}
+
+    @staticmethod
+    def _stage_params(stage, params):
+        return {name: params[name] for name in stage.params if name in params}
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """Returns the SHA-256 hex digest of a file's contents, for use as a source key or artifact name."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _stage_key(stage, stage_params, input_keys):
+    digest = hashlib.sha1(repr((stage.name, sorted(stage_params.items()), input_keys)).encode())
+    return digest.hexdigest()
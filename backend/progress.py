@@ -0,0 +1,155 @@
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+import numpy as np
+import cv2
+
+# Size of the coarse previews sent with stage events
+PREVIEW_POINTS = 4096
+PREVIEW_DEPTH_ROWS = 32
+
+# Terminal events: nothing is published after them
+FINAL_EVENTS = ("done", "error")
+
+
+def preview_points(points, colors=None, max_points=PREVIEW_POINTS):
+    """An evenly strided subset of a cloud as JSON-ready lists (rounded positions, 8-bit colors)."""
+    step = max(1, len(points) // max_points)
+    preview = {"positions": np.round(points[::step], 3).tolist()}
+    if colors is not None and len(colors):
+        preview["colors"] = (np.clip(colors[::step], 0, 1) * 255).astype(np.uint8).tolist()
+    return preview
+
+
+def describe_outputs(outputs):
+    """
+    Counts (and coarse previews) of a stage's outputs, for progress events.
+
+    Args:
+        outputs (dict): A pipeline stage's outputs.
+
+    Returns:
+        dict: JSON-ready description.
+    """
+    info = {}
+    for name, value in outputs.items():
+        if name == "depth":
+            rows = min(PREVIEW_DEPTH_ROWS, value.shape[0])
+            cols = max(1, round(value.shape[1] * rows / value.shape[0]))
+            small = cv2.resize(value.astype(np.float32), (cols, rows), interpolation=cv2.INTER_AREA)
+            info["depth_shape"] = list(value.shape)
+            info["depth_preview"] = np.round(small, 3).tolist()
+        elif name == "points":
+            info["points"] = int(len(value))
+        elif hasattr(value, "positions"):
+            # A geometry.Geometry
+            if value.is_mesh:
+                info["vertices"] = len(value)
+                info["triangles"] = len(value.indices)
+            else:
+                info["points"] = len(value)
+                info["preview"] = preview_points(value.positions, value.float_colors())
+        elif hasattr(value, "triangles"):
+            info["vertices"] = len(value.vertices)
+            info["triangles"] = len(value.triangles)
+        elif hasattr(value, "points"):
+            points = np.asarray(value.points)
+            colors = np.asarray(value.colors) if value.has_colors() else None
+            info["points"] = int(len(points))
+            info["preview"] = preview_points(points, colors)
+    return info
+
+
+def stage_listener(publish):
+    """
+    Adapts publish(event_type, **data) into a PipelineGraph.run listener that describes stage outputs.
+    """
+    def listener(event, stage, outputs=None, seconds=None):
+        data = {"stage": stage}
+        if seconds is not None:
+            data["seconds"] = round(seconds, 3)
+        if outputs is not None:
+            data.update(describe_outputs(outputs))
+        publish(event, **data)
+    return listener
+
+
+class ProgressChannel:
+    """
+    The events of one job. Worker threads publish; any number of subscribers on the event loop replay
+    the events so far and then follow new ones until the job is done.
+    """
+
+    def __init__(self, loop):
+        self.events = []
+        self.closed = False
+        self.finished_at = None
+        # The asyncio task running the job, referenced so it is not garbage collected
+        self.task = None
+        self._loop = loop
+        self._changed = asyncio.Event()
+
+    def publish(self, event_type, **data):
+        """Thread-safe: appends an event on the event loop."""
+        event = {"type": event_type, "time": round(time.time(), 3), **data}
+        self._loop.call_soon_threadsafe(self._append, event)
+
+    def _append(self, event):
+        if self.closed:
+            return
+        self.events.append(event)
+        if event["type"] in FINAL_EVENTS:
+            self.closed = True
+            self.finished_at = time.monotonic()
+        self._changed.set()
+
+    async def subscribe(self):
+        """Yields every event of the job, from the first one, until the final event."""
+        index = 0
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.closed:
+                return
+            self._changed.clear()
+            await self._changed.wait()
+
+
+class JobRegistry:
+    """Progress channels by job id; finished jobs are kept for ttl_seconds so late subscribers can replay them."""
+
+    def __init__(self, ttl_seconds=600, max_jobs=256):
+        self.ttl_seconds = ttl_seconds
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, job_id, loop):
+        channel = ProgressChannel(loop)
+        with self._lock:
+            self._prune()
+            self._jobs[job_id] = channel
+        return channel
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        now = time.monotonic()
+        for job_id, channel in list(self._jobs.items()):
+            if channel.finished_at is not None and now - channel.finished_at > self.ttl_seconds:
+                del self._jobs[job_id]
+        # Over max_jobs, finished jobs are evicted, the earliest created first; running jobs are never evicted, as their
+        # subscribers would lose the channel (admission control bounds how many there are)
+        finished = [job_id for job_id, channel in self._jobs.items() if channel.finished_at is not None]
+        for job_id in finished[:max(0, len(self._jobs) - self.max_jobs + 1)]:
+            del self._jobs[job_id]
+
+
+def sse_format(event):
+    """Encodes an event as a server-sent-events message."""
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
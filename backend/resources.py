@@ -0,0 +1,264 @@
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+from contextlib import contextmanager
+import config
+
+# Environment variables read by OpenMP (Open3D), OpenBLAS/MKL (numpy, scipy) and friends. They only take
+# effect if set before those libraries are imported, so apply_thread_limits() must run first thing.
+BLAS_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "BLIS_NUM_THREADS",
+                 "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+_torch_configured = False
+_tf_configured = False
+
+
+def parse_cpu_list(spec):
+    """Parses a CPU list such as '0-3,6' into a set of core ids."""
+    cpus = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def parse_affinity(spec):
+    """Parses 'depth=0-3;style=4-5;mesh=6-7' into {stage: set of cores}."""
+    affinity = {}
+    for entry in spec.split(";"):
+        if "=" in entry:
+            stage, cpus = entry.split("=", 1)
+            affinity[stage.strip()] = parse_cpu_list(cpus)
+    return affinity
+
+
+def default_layout():
+    """The resource layout from config; 0 means 'leave the library default'."""
+    return {
+        "torch_threads": config.TORCH_THREADS,
+        "torch_interop_threads": config.TORCH_INTEROP_THREADS,
+        "tf_intra_threads": config.TF_INTRA_THREADS,
+        "tf_inter_threads": config.TF_INTER_THREADS,
+        "blas_threads": config.BLAS_THREADS,
+        "affinity": parse_affinity(config.STAGE_AFFINITY),
+    }
+
+
+def apply_thread_limits(layout=None):
+    """
+    Caps BLAS/OpenMP thread pools. Call before numpy, scipy or Open3D are imported; if they already
+    are, the BLAS pools are also limited at runtime through threadpoolctl.
+    """
+    layout = layout or default_layout()
+    threads = layout["blas_threads"]
+    if not threads:
+        return
+    for name in BLAS_ENV_VARS:
+        os.environ[name] = str(threads)
+    if "numpy" in sys.modules:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=threads)
+
+
+def configure_torch(layout=None):
+    """Sets torch's intra- and inter-op thread counts, once per process, before the first model runs."""
+    global _torch_configured
+    if _torch_configured:
+        return
+    layout = layout or default_layout()
+    import torch
+    if layout["torch_threads"]:
+        torch.set_num_threads(layout["torch_threads"])
+    if layout["torch_interop_threads"]:
+        try:
+            torch.set_num_interop_threads(layout["torch_interop_threads"])
+        except RuntimeError as e:
+            # Only possible before any inter-op parallel work has started
+            print(f"Could not set torch inter-op threads: {e}")
+    _torch_configured = True
+
+
+def configure_tensorflow(layout=None):
+    """Sets TensorFlow's intra- and inter-op thread counts, once per process, before TF initializes."""
+    global _tf_configured
+    if _tf_configured:
+        return
+    layout = layout or default_layout()
+    import tensorflow as tf
+    try:
+        if layout["tf_intra_threads"]:
+            tf.config.threading.set_intra_op_parallelism_threads(layout["tf_intra_threads"])
+        if layout["tf_inter_threads"]:
+            tf.config.threading.set_inter_op_parallelism_threads(layout["tf_inter_threads"])
+    except RuntimeError as e:
+        print(f"Could not set TensorFlow threads: {e}")
+    _tf_configured = True
+
+
+@contextmanager
+def pinned(cpus):
+    """Pins the calling thread (and the threads it starts) to cpus for the duration of the block."""
+    if not cpus or not hasattr(os, "sched_setaffinity"):
+        yield
+        return
+    previous = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, cpus)
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, previous)
+
+
+def stage_context(stage, layout=None):
+    """Context manager for PipelineGraph.run: pins a stage to its configured cores, if any."""
+    layout = layout or default_layout()
+    return pinned(layout["affinity"].get(stage))
+
+
+# Benchmark mode: each candidate layout runs in a fresh process, since torch and TF thread pools can
+# only be sized once per process.
+
+def candidate_layouts(cores):
+    """Splits the host's cores between 1, 2, 4, ... concurrent workers, shared or pinned."""
+    layouts = []
+    workers = 1
+    while workers <= cores:
+        per_worker = max(1, cores // workers)
+        for pin in (False, True) if workers > 1 else (False,):
+            layouts.append({
+                "workers": workers,
+                "pin_workers": pin,
+                "torch_threads": per_worker,
+                "torch_interop_threads": 1,
+                "tf_intra_threads": per_worker,
+                "tf_inter_threads": 1,
+                "blas_threads": per_worker,
+                "affinity": {},
+            })
+        workers *= 2
+    return layouts
+
+
+def _synthetic_item():
+    """A stand-in for one request: a conv stack on a 384x384 input (depth) and a 2D Delaunay (mesh)."""
+    import numpy as np
+    from scipy.spatial import Delaunay
+    try:
+        import torch
+        x = torch.randn(1, 3, 384, 384)
+        conv = torch.nn.Conv2d(3, 64, 3, padding=1)
+        conv2 = torch.nn.Conv2d(64, 64, 3, padding=1)
+        with torch.no_grad():
+            for _ in range(4):
+                conv2(conv(x))
+    except ImportError:
+        a = np.random.rand(1024, 1024)
+        for _ in range(4):
+            a @ a
+    Delaunay(np.random.rand(200_000, 2))
+
+
+def _run_layout(layout, items, image_path=None):
+    """Runs items requests over layout['workers'] threads in this process; returns images/min."""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    apply_thread_limits(layout)
+    try:
+        configure_torch(layout)
+    except ImportError:
+        pass  # The synthetic load falls back to numpy
+
+    if image_path is not None:
+        import tempfile
+        import cv2
+        from open_3d import open_3d_from_array
+        color = cv2.cvtColor(cv2.imread(image_path), cv2.COLOR_BGR2RGB)
+        out_dir = tempfile.mkdtemp()
+
+        def work(index):
+            open_3d_from_array(color, os.path.join(out_dir, f"{index}.obj"), target_points=config.TARGET_POINTS, cache=None)
+    else:
+        def work(index):
+            _synthetic_item()
+
+    work(-1)  # Warm-up: model loading and first-run allocations are not part of the throughput
+    counter = iter(range(items))
+    lock = threading.Lock()
+    workers = layout["workers"]
+    block = max(1, len(cores) // workers)
+
+    def worker(index):
+        cpus = set(cores[index * block:(index + 1) * block]) if layout.get("pin_workers") else None
+        with pinned(cpus):
+            while True:
+                with lock:
+                    item = next(counter, None)
+                if item is None:
+                    return
+                work(item)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return 60.0 * items / (time.perf_counter() - start)
+
+
+def benchmark(items=8, image_path=None):
+    """
+    Sweeps candidate layouts for this host and prints their throughput, best first.
+
+    Returns:
+        list: (images_per_minute, layout) tuples, best first.
+    """
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    results = []
+    for layout in candidate_layouts(cores):
+        cmd = [sys.executable, __file__, "--run_layout", json.dumps(layout), "--items", str(items)]
+        if image_path is not None:
+            cmd += ["--image", image_path]
+        output = subprocess.run(cmd, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        try:
+            throughput = json.loads(output.stdout.strip().splitlines()[-1])["images_per_minute"]
+        except (IndexError, ValueError, KeyError):
+            print(f"Layout failed: {layout}\n{output.stderr}")
+            continue
+        results.append((throughput, layout))
+        print(f"workers={layout['workers']:<3} threads/worker={layout['torch_threads']:<3} "
+              f"pinned={str(layout['pin_workers']):<5} {throughput:8.2f} images/min")
+
+    results.sort(key=lambda result: result[0], reverse=True)
+    if results:
+        best_throughput, best = results[0]
+        print(f"\nBest layout on {cores} cores: {best_throughput:.2f} images/min")
+        print(f"  MEMORYMAKE_TORCH_THREADS={best['torch_threads']} MEMORYMAKE_TORCH_INTEROP_THREADS={best['torch_interop_threads']} "
+              f"MEMORYMAKE_TF_INTRA_THREADS={best['tf_intra_threads']} MEMORYMAKE_TF_INTER_THREADS={best['tf_inter_threads']} "
+              f"MEMORYMAKE_BLAS_THREADS={best['blas_threads']} with {best['workers']} concurrent pipelines")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Sweep CPU partitions between torch, TensorFlow and BLAS/Open3D")
+    parser.add_argument("--benchmark", action="store_true", help="Sweep candidate layouts and report the best one")
+    parser.add_argument("--items", type=int, default=8, help="Requests processed per layout")
+    parser.add_argument("--image", type=str, default=None, help="Benchmark the real pipeline on this image instead of a synthetic load")
+    parser.add_argument("--run_layout", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_layout is not None:
+        layout = json.loads(args.run_layout)
+        print(json.dumps({"images_per_minute": _run_layout(layout, args.items, args.image)}))
+    else:
+        benchmark(items=args.items, image_path=args.image)
@@ -1,8 +1,6 @@
 from huggingface_hub import InferenceClient
 from dotenv import load_dotenv
 import os
-from diffusers import StableDiffusionPipeline
-import torch
 
 # Load environment variables (ensure your HF_TOKEN is stored in a .env file)
 load_dotenv()
@@ -68,7 +66,9 @@ def generate_image_local(prompt: str, style: str, save_path: str) -> None:
 
     final_prompt = f"Create a {style} style image of {prompt}. {base_prompt}"
 
-    # Load the locally stored Stable Diffusion XL model and pipeline
+    # Load the locally stored Stable Diffusion XL model and pipeline (diffusers and torch are only needed here)
+    import torch
+    from diffusers import StableDiffusionPipeline
     pipe = StableDiffusionPipeline.from_pretrained("stabilityai/stable-diffusion-xl-base-1.0", 
                                                    torch_dtype=torch.float16)  # For faster inference on supported hardware
     pipe.to("cuda")  # Use GPU if available
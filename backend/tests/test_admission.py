@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, Overloaded, StageLimiter
+
+
+def test_queue_is_bounded_by_reservations():
+    limiter = StageLimiter("mesh", max_concurrent=1, max_queue=1)
+    first, second = limiter.reserve(), limiter.reserve()
+    with pytest.raises(Overloaded) as error:
+        limiter.reserve()
+    assert error.value.stage == "mesh" and error.value.retry_after >= 1
+
+    # A released place can be taken again, and releasing twice gives back only one
+    second.release()
+    second.release()
+    assert limiter.stats()["reserved"] == 1
+    limiter.reserve()
+    assert limiter.stats()["rejected"] == 1
+    first.release()
+
+
+def test_admitted_requests_wait_instead_of_being_rejected():
+    admission = AdmissionController({"mesh": (1, 1)})
+    requests = [admission.admit(["mesh"]) for _ in range(2)]
+    order = []
+
+    def run(i):
+        with requests[i]["mesh"].slot():
+            order.append(("start", i))
+            time.sleep(0.05)
+            order.append(("end", i))
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # One at a time, and nobody is rejected once admitted
+    assert [event for event, _ in order] == ["start", "end", "start", "end"]
+    stats = admission.stats()["stages"]["mesh"]
+    assert stats["admitted"] == 2 and stats["rejected"] == 0 and stats["reserved"] == 0
+
+
+def test_admit_takes_every_stage_or_none():
+    admission = AdmissionController({"depth": (1, 1), "style": (1, 0)})
+    held = admission.admit(["style"])
+    with pytest.raises(Overloaded):
+        admission.admit(["depth", "style"])
+    # The depth place taken before style was refused is given back
+    assert admission.limiters["depth"].stats()["reserved"] == 0
+    assert admission.stats()["requests"] == {"admitted": 1, "rejected": 1}
+
+    admission.release(held)
+    assert set(admission.admit(["depth", "style", "unlimited"])) == {"depth", "style"}
+
+
+def test_slot_without_reservation_is_rejected_when_full():
+    limiter = StageLimiter("depth", max_concurrent=1, max_queue=0)
+    with limiter.slot():
+        with pytest.raises(Overloaded):
+            with limiter.slot():
+                pass
+    with limiter.slot():
+        pass
@@ -0,0 +1,74 @@
+import gzip
+import os
+import time
+
+from artifact_store import ArtifactStore, ENCODING_SUFFIXES, choose_encoding
+
+
+def rendered(tmp_path, content):
+    path = tmp_path / f"upload_{os.urandom(4).hex()}.obj"
+    path.write_bytes(content)
+    return str(path)
+
+
+def settle(store):
+    """Waits for the background compression submitted so far (one worker, so in order)."""
+    store._compressor.submit(lambda: None).result()
+
+
+def age(store, name, seconds):
+    """Backdates an artifact's last access, and its variants'."""
+    past = time.time() - seconds
+    for path in [store.path(name)] + [store.path(name) + suffix for suffix in ENCODING_SUFFIXES.values()]:
+        if os.path.exists(path):
+            os.utime(path, (past, past))
+
+
+def test_put_names_by_content_and_serves_repeated_requests(tmp_path):
+    store = ArtifactStore(str(tmp_path / "rendered"), max_bytes=10 ** 6, ttl_seconds=3600)
+    name = store.put(rendered(tmp_path, b"v 0 0 0\n"), request_key="digest:monet")
+    assert store.put(rendered(tmp_path, b"v 0 0 0\n")) == name
+    assert store.lookup("digest:monet") == name
+    assert store.lookup("digest:other") is None
+    settle(store)
+
+    path, encoding = store.variant(name, "gzip, deflate")
+    assert encoding == "gzip" and gzip.decompress(open(path, "rb").read()) == b"v 0 0 0\n"
+    assert store.variant(name, "identity") == (store.path(name), None)
+
+
+def test_artifacts_expire_after_their_last_access(tmp_path):
+    store = ArtifactStore(str(tmp_path / "rendered"), max_bytes=10 ** 6, ttl_seconds=60)
+    name = store.put(rendered(tmp_path, b"expired"), request_key="key")
+    settle(store)
+    age(store, name, 120)
+
+    assert store.lookup("key") is None
+    assert store.get(name) is None
+    # The variants go with the artifact
+    assert os.listdir(store.root) == []
+
+
+def test_least_recently_used_artifacts_are_evicted_with_their_variants(tmp_path):
+    content = os.urandom(1000)  # Incompressible: the artifacts and their variants all have the same sizes
+    store = ArtifactStore(str(tmp_path / "rendered"), max_bytes=10 ** 6, ttl_seconds=3600)
+    names = []
+    for i in range(2):
+        names.append(store.put(rendered(tmp_path, content + bytes([i]))))
+        settle(store)
+        age(store, names[-1], 100 - i)
+    store.get(names[0])
+
+    # Room for two artifacts with their variants: storing a third evicts the least recently used one
+    store.max_bytes = sum(entry.stat().st_size for entry in os.scandir(store.root)) * 5 // 4
+    names.append(store.put(rendered(tmp_path, content + b"\x02")))
+    settle(store)
+    assert store.get(names[1]) is None
+    assert store.get(names[0]) is not None and store.get(names[2]) is not None
+    assert not any(entry.startswith(names[1]) for entry in os.listdir(store.root))
+
+
+def test_choose_encoding_follows_quality_values():
+    assert choose_encoding("gzip;q=0.5, br", ["br", "gzip"]) == "br"
+    assert choose_encoding("br;q=0, gzip", ["br", "gzip"]) == "gzip"
+    assert choose_encoding("identity", ["br", "gzip"]) is None
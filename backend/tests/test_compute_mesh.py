@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("open3d", exc_type=ImportError)
+from compute_mesh import bin_points
+
+
+def test_bin_points_averages_each_block():
+    # A 3x5 grid with one missing pixel; 2x2 blocks, the last column and row are partial blocks
+    height, width = 3, 5
+    pixel_index = np.delete(np.arange(height * width), 6)
+    v, u = np.divmod(pixel_index, width)
+    points = np.column_stack((u, v, u * v)).astype(np.float64)
+    colors = np.column_stack((u / 4, v / 2, np.ones(len(u))))
+
+    binned_points, binned_colors, first_pixel = bin_points(points, colors, pixel_index, (height, width), bin_size=2)
+
+    assert binned_points.dtype == np.float32 and binned_colors.dtype == np.float32
+    assert len(binned_points) == 6
+    cells = (v // 2) * 3 + u // 2
+    for block, pixel in enumerate(first_pixel):
+        members = cells == cells[pixel_index == pixel][0]
+        np.testing.assert_allclose(binned_points[block], points[members].mean(axis=0), rtol=1e-6)
+        np.testing.assert_allclose(binned_colors[block], colors[members].mean(axis=0), rtol=1e-6)
+    assert first_pixel.tolist() == [0, 2, 4, 10, 12, 14]
+    # The block of the missing pixel averages the other three
+    np.testing.assert_allclose(binned_points[0], [1 / 3, 1 / 3, 0.0], rtol=1e-6)
+
+
+def test_bin_points_without_binning_or_points_is_unchanged():
+    points = np.zeros((4, 3))
+    pixel_index = np.arange(4)
+    binned_points, binned_colors, first_pixel = bin_points(points, None, pixel_index, (2, 2), bin_size=1)
+    assert binned_points is points and binned_colors is None and first_pixel is pixel_index
+    empty = np.empty((0, 3))
+    assert bin_points(empty, None, np.empty(0, int), (2, 2))[0] is empty
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+pytest.importorskip("open3d", exc_type=ImportError)
+from cylinder import cylindrical_mesh_arrays
+
+
+def cylinder_points(radius=5.0, rows=40, cols=120, noise=0.0):
+    """A y-up grid of points on half a cylinder, as open_3d projects a panorama."""
+    theta, height = np.meshgrid(np.linspace(-np.pi / 2, np.pi / 2, cols), np.linspace(-1, 1, rows))
+    r = radius + np.random.default_rng(0).normal(0, noise, theta.shape)
+    return np.column_stack(((r * np.sin(theta)).ravel(), height.ravel(), (r * np.cos(theta)).ravel()))
+
+
+def mesh_stats(points, vertex_index, triangles):
+    vertices = points[vertex_index]
+    a, b, c = (vertices[triangles[:, i]] for i in range(3))
+    area = 0.5 * np.linalg.norm(np.cross(b - a, c - a), axis=1).sum()
+    longest = max(np.linalg.norm(b - a, axis=1).max(), np.linalg.norm(c - b, axis=1).max(),
+                  np.linalg.norm(a - c, axis=1).max())
+    edges = np.concatenate((triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]))
+    graph = coo_matrix((np.ones(len(edges)), (edges[:, 0], edges[:, 1])), shape=(len(vertex_index),) * 2)
+    return area, longest, connected_components(graph, directed=False)[0]
+
+
+@pytest.mark.parametrize("noise", [0.0, 1e-3])
+def test_slices_cover_the_cylinder_once(noise):
+    # Constant-radius slices are flat in (r, h): they must still triangulate, without folded slivers
+    points = cylinder_points(noise=noise)
+    vertex_index, triangles = cylindrical_mesh_arrays(points, num_slices=16, up_axis=1)
+    area, longest, components = mesh_stats(points, vertex_index, triangles)
+
+    assert sorted(vertex_index) == list(range(len(points)))
+    assert area == pytest.approx(5.0 * np.pi * 2.0, rel=0.02)
+    assert longest < 0.2
+    # Seams join the slices into one surface
+    assert components == 1
+
+
+def test_degenerate_slices_are_skipped():
+    # Every slice's points are collinear once unrolled
+    theta = np.linspace(-1, 1, 64)
+    points = np.column_stack((np.sin(theta), np.zeros_like(theta), np.cos(theta)))
+    vertex_index, triangles = cylindrical_mesh_arrays(points, num_slices=8, up_axis=1)
+    assert len(triangles) == 0
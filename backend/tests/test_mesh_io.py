@@ -0,0 +1,72 @@
+import io
+import json
+import struct
+
+import numpy as np
+import pytest
+
+from mesh_io import (GLB_BIN_CHUNK, GLB_JSON_CHUNK, GLB_MAGIC, QUANTIZED_MAX, quantize_positions, write_arrays,
+                     write_splats)
+
+
+def read_glb(data):
+    """Checks the GLB container and returns its glTF JSON and binary chunk."""
+    magic, version, total = struct.unpack_from("<III", data, 0)
+    assert (magic, version, total) == (GLB_MAGIC, 2, len(data))
+    json_length, json_type = struct.unpack_from("<II", data, 12)
+    assert json_type == GLB_JSON_CHUNK and json_length % 4 == 0
+    gltf = json.loads(data[20:20 + json_length])
+    bin_length, bin_type = struct.unpack_from("<II", data, 20 + json_length)
+    assert bin_type == GLB_BIN_CHUNK and bin_length == gltf["buffers"][0]["byteLength"]
+    return gltf, data[28 + json_length:28 + json_length + bin_length]
+
+
+def accessor_array(gltf, binary, index, dtype, components):
+    accessor = gltf["accessors"][index]
+    view = gltf["bufferViews"][accessor["bufferView"]]
+    data = binary[view["byteOffset"]:view["byteOffset"] + view["byteLength"]]
+    stride = view.get("byteStride", np.dtype(dtype).itemsize * components) // np.dtype(dtype).itemsize
+    return np.frombuffer(data, dtype=dtype).reshape(accessor["count"], stride)[:, :components]
+
+
+def test_glb_mesh_round_trips():
+    rng = np.random.default_rng(0)
+    vertices = rng.normal(size=(50, 3))
+    triangles = rng.integers(0, 50, size=(30, 3))
+    colors = rng.random((50, 3))
+    target = io.BytesIO()
+    write_arrays(target, vertices, triangles, colors, format="glb")
+    gltf, binary = read_glb(target.getvalue())
+
+    primitive = gltf["meshes"][0]["primitives"][0]
+    positions = accessor_array(gltf, binary, primitive["attributes"]["POSITION"], "<f4", 3)
+    np.testing.assert_allclose(positions, vertices, rtol=1e-6)
+    assert gltf["accessors"][primitive["attributes"]["POSITION"]]["min"] == pytest.approx(vertices.min(axis=0))
+    indices = accessor_array(gltf, binary, primitive["indices"], "<u4", 1).reshape(-1, 3)
+    np.testing.assert_array_equal(indices, triangles)
+    rgba = accessor_array(gltf, binary, primitive["attributes"]["COLOR_0"], "u1", 4)
+    np.testing.assert_array_equal(rgba[:, 3], 255)
+    assert np.abs(rgba[:, :3] / 255.0 - colors).max() <= 0.5 / 255 + 1e-9
+
+
+def test_quantized_positions_dequantize_within_half_a_step():
+    positions = np.random.default_rng(1).uniform(-20, 5, size=(1000, 3)).astype(np.float32)
+    quantized, scale, offset = quantize_positions(positions)
+    assert np.abs(quantized).max() == QUANTIZED_MAX
+    assert np.all(np.abs(quantized * scale + offset - positions) <= scale * 0.5 + 1e-5)
+
+
+def test_splat_glb_node_dequantizes_positions():
+    positions = np.random.default_rng(2).uniform(0, 3, size=(100, 3))
+    sizes = np.full(100, 0.01)
+    target = io.BytesIO()
+    write_splats(target, positions, sizes=sizes, format="glb")
+    gltf, binary = read_glb(target.getvalue())
+
+    assert gltf["extensionsRequired"] == ["KHR_mesh_quantization"]
+    node = gltf["nodes"][0]
+    attributes = gltf["meshes"][0]["primitives"][0]["attributes"]
+    quantized = accessor_array(gltf, binary, attributes["POSITION"], "<i2", 3)
+    restored = quantized * np.array(node["scale"]) + np.array(node["translation"])
+    np.testing.assert_allclose(restored, positions, atol=3 / QUANTIZED_MAX)
+    np.testing.assert_allclose(accessor_array(gltf, binary, attributes["_SIZE"], "<f4", 1)[:, 0], sizes)
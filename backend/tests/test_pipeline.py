@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from pipeline import Stage, StageCache, PipelineGraph
+
+
+def counting_graph():
+    """image -> depth -> cloud -> mesh, plus a preview stage of the image nobody needs for the mesh."""
+    calls = []
+
+    def stage(name, inputs, output, cacheable=True, params=()):
+        def fn(**kwargs):
+            calls.append(name)
+            return {output: (name, tuple(kwargs[key] for key in sorted(kwargs)))}
+        return Stage(name, fn, inputs=inputs, outputs=(output,), params=params, cacheable=cacheable)
+
+    graph = PipelineGraph([
+        stage("depth", ("image",), "depth", params=("model",)),
+        stage("preview", ("image",), "preview"),
+        stage("project", ("image", "depth"), "cloud"),
+        stage("mesh", ("cloud",), "mesh", cacheable=False),
+    ])
+    return graph, calls
+
+
+def test_plan_keeps_only_the_stages_targets_depend_on():
+    graph, _ = counting_graph()
+    assert [stage.name for stage in graph.plan(["mesh"], ["image"])] == ["depth", "project", "mesh"]
+    assert [stage.name for stage in graph.plan(["cloud"], ["image", "depth"])] == ["project"]
+
+
+def test_plan_rejects_unknown_values_and_duplicate_producers():
+    graph, _ = counting_graph()
+    with pytest.raises(KeyError):
+        graph.plan(["mesh"], [])
+    with pytest.raises(ValueError):
+        PipelineGraph([Stage("a", None, outputs=("x",)), Stage("b", None, outputs=("x",))])
+
+
+def test_run_reuses_cached_stages_and_skips_what_only_feeds_them():
+    graph, calls = counting_graph()
+    cache = StageCache()
+    first = graph.run(["mesh"], {"image": 1}, params={"model": "dpt"}, cache=cache, source_keys={"image": "a"})
+    assert calls == ["depth", "project", "mesh"]
+
+    # The cloud is cached: depth is not recomputed, the uncacheable mesh is
+    calls.clear()
+    again = graph.run(["mesh"], {"image": 1}, params={"model": "dpt"}, cache=cache, source_keys={"image": "a"})
+    assert calls == ["mesh"]
+    assert again == first
+
+    # Other parameters, other source or no source key: nothing is reused
+    for params, source_keys in (({"model": "small"}, {"image": "a"}), ({"model": "dpt"}, {"image": "b"}),
+                                ({"model": "dpt"}, None)):
+        calls.clear()
+        graph.run(["mesh"], {"image": 1}, params=params, cache=cache, source_keys=source_keys)
+        assert calls == ["depth", "project", "mesh"]
+
+
+def test_cache_evicts_least_recently_used_entries_by_count_and_bytes():
+    cache = StageCache(max_entries=2, max_bytes=1000)
+    cache.put("a", {"x": np.zeros(100, np.uint8)})
+    cache.put("b", {"x": np.zeros(100, np.uint8)})
+    cache.get("a")
+    cache.put("c", {"x": np.zeros(100, np.uint8)})
+    assert cache.get("b") is None and cache.get("a") is not None
+
+    cache.put("d", {"x": [np.zeros(900, np.uint8)]})
+    assert cache.get("c") is None and cache.get("d") is not None
+    assert cache.stats()["bytes"] == 1000
+
+    # An entry over the byte bound on its own is not kept
+    cache.put("e", {"x": np.zeros(2000, np.uint8)})
+    assert cache.get("e") is None and cache.stats()["bytes"] == 0
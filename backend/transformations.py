@@ -2,7 +2,7 @@ import open3d as o3d
 import numpy as np
 import math
 
-def root_scaling(depth_raw, steepness=10):
+def root_scaling(depth_raw, steepness=10, max_r=None):
     """
     Apply sigmoid scaling to depth values to emphasize middle-range depths.
 
@@ -11,11 +11,14 @@ def root_scaling(depth_raw, steepness=10):
         midpoint (float): The midpoint of the sigmoid (default is the mean depth).
         steepness (float): Controls the steepness of the sigmoid curve (higher = steeper).
         scale (float): A scaling factor to stretch the output values.
+        max_r (float): Maximum of the whole depth map, when depth_raw is only a part of it
+                       (default: the maximum of depth_raw).
 
     Returns:
         np.ndarray: The scaled depth values.
     """
-    max_r = np.max(depth_raw) # Use mean depth as the default midpoint
+    if max_r is None:
+        max_r = np.max(depth_raw) # Use mean depth as the default midpoint
 
     # Scale the result to the desired range
     scale2 = np.sqrt(depth_raw / max_r) + 0.7  # Optional: apply a square root to the sigmoid result
@@ -0,0 +1,235 @@
+# Cap BLAS/OpenMP thread pools before numpy, scipy and Open3D are imported
+import resources
+resources.apply_thread_limits()
+
+import os
+import cv2
+import numpy as np
+from midas_depth_map import depth_from_arrays
+from neural_style_transfer import stylize_array
+from compute_mesh import working_grid_shape
+from open_3d import project_cylindrical, delauny_method, slice_method, poisson_method
+from batch_process import collect_inputs
+from mesh_io import write_triangle_mesh
+
+VIDEO_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv', 'webm'}
+
+
+def iter_frames(source, every=1, max_pixels=None):
+    """
+    Decodes the frames of a video file or an image sequence lazily, one at a time.
+
+    Args:
+        source (str): A video file, a directory of frames or a manifest (see batch_process.collect_inputs).
+                      Frames of a sequence are read in sorted order.
+        every (int): Keep every n-th frame.
+        max_pixels (int): Optional upper bound on width * height; larger frames are area-downscaled.
+
+    Yields:
+        (int, numpy.ndarray): Frame index and HxWx3 uint8 RGB frame.
+    """
+    def fit(frame):
+        height, width = frame.shape[:2]
+        if max_pixels is not None and width * height > max_pixels:
+            scale = (max_pixels / (width * height)) ** 0.5
+            frame = cv2.resize(frame, (max(1, int(width * scale)), max(1, int(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    if os.path.isfile(source) and source.rsplit('.', 1)[-1].lower() in VIDEO_EXTENSIONS:
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            raise FileNotFoundError(f"Could not open video {source}")
+        try:
+            index = 0
+            while True:
+                # grab() skips decoding of the frames that are dropped
+                if not capture.grab():
+                    break
+                if index % every == 0:
+                    ok, frame = capture.retrieve()
+                    if ok:
+                        yield index, fit(frame)
+                index += 1
+        finally:
+            capture.release()
+        return
+
+    for index, (_, path) in enumerate(collect_inputs(source)):
+        if index % every:
+            continue
+        frame = cv2.imread(path, cv2.IMREAD_COLOR)
+        if frame is None:
+            raise FileNotFoundError(f"Image not found at {path}")
+        yield index, fit(frame)
+
+
+def batched(frames, batch_size):
+    """Groups consecutive same-sized frames into lists of at most batch_size."""
+    batch = []
+    for frame in frames:
+        if batch and (len(batch) == batch_size or frame[1].shape != batch[0][1].shape):
+            yield batch
+            batch = []
+        batch.append(frame)
+    if batch:
+        yield batch
+
+
+class TemporalDepthSmoother:
+    """
+    Reduces frame-to-frame flicker of MiDaS depth.
+
+    MiDaS predicts relative inverse depth, with a scale and shift that change from frame to frame. The
+    running estimate is first moved along with the camera: the frame-to-frame shift is measured by phase
+    correlation of the (downscaled, grayscale) frames, which for pans is close to a global translation,
+    and the estimate is translated by it. Each new map is then aligned to the moved estimate by least
+    squares (scale and shift) and blended into it with an exponential moving average. Pixels that came
+    into view, and frames with no reliable shift (cuts), take the new depth as is; alpha=1 only aligns.
+    """
+
+    def __init__(self, alpha=0.6, sample_step=8, min_response=0.05):
+        """
+        Args:
+            alpha (float): Weight of the new frame in the moving average.
+            sample_step (int): Pixel step of the grid the alignment is fitted on.
+            min_response (float): Phase-correlation peak below which the previous frame is not trusted.
+        """
+        self.alpha = alpha
+        self.sample_step = sample_step
+        self.min_response = min_response
+        self.state = None
+        self.gray = None
+
+    def motion(self, gray):
+        """The previous estimate and a mask of its valid pixels, translated onto the new frame, or None."""
+        if self.gray is None or gray is None:
+            return self.state, np.ones(self.state.shape, dtype=bool)
+        window = cv2.createHanningWindow(gray.shape[::-1], cv2.CV_32F)
+        (dx, dy), response = cv2.phaseCorrelate(self.gray, gray, window)
+        if response < self.min_response:
+            return None
+        height, width = gray.shape
+        shift = np.float32([[1, 0, dx], [0, 1, dy]])
+        state = cv2.warpAffine(self.state, shift, (width, height), flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_REPLICATE)
+        valid = cv2.warpAffine(np.ones((height, width), dtype=np.uint8), shift, (width, height),
+                               flags=cv2.INTER_NEAREST, borderMode=cv2.BORDER_CONSTANT, borderValue=0) > 0
+        return state, valid
+
+    def __call__(self, depth, color=None):
+        """
+        Args:
+            depth (numpy.ndarray): The new frame's depth map.
+            color (numpy.ndarray): The new RGB frame, for motion compensation (any size); None assumes
+                                   a static camera.
+        """
+        depth = depth.astype(np.float32)
+        gray = None
+        if color is not None:
+            gray = cv2.resize(cv2.cvtColor(color, cv2.COLOR_RGB2GRAY), depth.shape[::-1],
+                              interpolation=cv2.INTER_AREA).astype(np.float32)
+        moved = None
+        if self.state is not None and self.state.shape == depth.shape:
+            moved = self.motion(gray)
+        self.gray = gray
+        if moved is None:
+            self.state = depth
+            return depth
+
+        state, valid = moved
+        step = self.sample_step
+        sampled = valid[::step, ::step].ravel()
+        x = depth[::step, ::step].ravel()[sampled]
+        y = state[::step, ::step].ravel()[sampled]
+        if len(x) < 2:
+            self.state = depth
+            return depth
+        scale, shift = np.polyfit(x, y, 1) if x.std() > 0 else (1.0, float(y.mean() - x.mean()))
+        aligned = depth * np.float32(scale) + np.float32(shift)
+
+        self.state = np.where(valid, self.alpha * aligned + (1.0 - self.alpha) * state, aligned).astype(np.float32)
+        return self.state
+
+
+def stream_meshes(source, style=None, scale=1.5, method="delaunay", batch_size=4, every=1,
+                  target_points=None, max_pixels=None, smoothing=0.6,
+                  model_type="DPT_Large", model_path="models/midas/dpt_large-midas-2f21e586.pt"):
+    """
+    Turns a panning clip into one mesh per frame, as a generator.
+
+    Frames are decoded lazily and depth runs on batches of batch_size same-sized frames, so at most one
+    batch of frames and depth maps is alive at a time whatever the clip length. The projection geometry
+    is cached across same-sized frames (see open_3d.projection_geometry).
+
+    Args:
+        source (str): Video file, directory of frames or manifest (see iter_frames).
+        style (str): Style name from nst_styles/ or 'photorealistic'.
+        scale (float): Depth scale factor.
+        method (str): 'delaunay', 'slices' or 'poisson'.
+        batch_size (int): Frames per depth forward pass.
+        every (int): Keep every n-th frame.
+        target_points (int): Working resolution as a point count (default: every pixel).
+        max_pixels (int): Optional frame downscale bound.
+        smoothing (float): Temporal smoothing weight of the new frame (see TemporalDepthSmoother,
+                           motion-compensated for pans); None disables smoothing.
+
+    Yields:
+        (int, open3d.geometry.TriangleMesh): Frame index and its mesh.
+    """
+    styled = style is not None and style != "photorealistic"
+    smoother = TemporalDepthSmoother(alpha=smoothing) if smoothing is not None else None
+
+    for batch in batched(iter_frames(source, every=every, max_pixels=max_pixels), batch_size):
+        colors = [frame for _, frame in batch]
+        depths = depth_from_arrays(colors, model_type=model_type, model_path=model_path,
+                                   output_size=working_grid_shape(colors[0].shape, target_points))
+        for (index, color_raw), depth_raw in zip(batch, depths):
+            if smoother is not None:
+                depth_raw = smoother(depth_raw, color_raw)
+            if styled:
+                color_raw = stylize_array(color_raw, style)
+            pcd = project_cylindrical(color_raw, depth_raw, depth_scale_factor=scale)
+            if method == "slices":
+                yield index, slice_method(pcd)
+            elif method == "poisson":
+                yield index, poisson_method(pcd)
+            else:
+                yield index, delauny_method(pcd)
+
+
+def write_meshes(source, output_dir, **kwargs):
+    """
+    Writes stream_meshes(source, **kwargs) to output_dir/frame_<index>.obj as the meshes are produced.
+
+    Returns:
+        int: Number of meshes written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    count = 0
+    for index, mesh in stream_meshes(source, **kwargs):
+        out_path = os.path.join(output_dir, f"frame_{index:05d}.obj")
+        write_triangle_mesh(out_path, mesh)
+        count += 1
+        print(f"Frame {index} -> {out_path}")
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert a panning clip or a frame sequence into a sequence of 3D meshes")
+    parser.add_argument("--input", type=str, required=True, help="Video file, directory of frames or manifest file")
+    parser.add_argument("--output", type=str, required=True, help="Directory to write the OBJ meshes to")
+    parser.add_argument("--style", type=str, default="photorealistic", help="Style name from nst_styles/ or 'photorealistic'")
+    parser.add_argument("--scale", type=float, default=1.5, help="Depth scale factor")
+    parser.add_argument("--method", type=str, default="delaunay", choices=["delaunay", "slices", "poisson"], help="Meshing method")
+    parser.add_argument("--batch_size", type=int, default=4, help="Frames per depth inference batch")
+    parser.add_argument("--every", type=int, default=1, help="Keep every n-th frame")
+    parser.add_argument("--target_points", type=int, default=None, help="Working resolution as a point count (default: every pixel)")
+    parser.add_argument("--smoothing", type=float, default=0.6, help="Weight of the new frame in the temporal depth average (1 disables blending)")
+    args = parser.parse_args()
+
+    write_meshes(args.input, args.output, style=args.style, scale=args.scale, method=args.method,
+                 batch_size=args.batch_size, every=args.every, target_points=args.target_points,
+                 smoothing=args.smoothing)
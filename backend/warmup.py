@@ -0,0 +1,62 @@
+import time
+import importlib
+
+# Seconds spent on each import or model load during startup, served on /metrics
+STARTUP_REPORT = {}
+
+
+def _load_midas():
+    from midas_depth_map import get_midas_model
+    get_midas_model()
+
+
+def _load_style_model():
+    from neural_style_transfer import load_model
+    load_model()
+
+
+# What can be preloaded at startup (MEMORYMAKE_PRELOAD); anything not listed is loaded by the first
+# request that needs it
+PRELOADERS = {
+    "open3d": lambda: importlib.import_module("open3d"),
+    "torch": lambda: importlib.import_module("torch"),
+    "tensorflow": lambda: importlib.import_module("tensorflow"),
+    "midas": _load_midas,
+    "style_model": _load_style_model,
+}
+
+
+def timed(name, fn):
+    """Runs fn and records how long it took under name in STARTUP_REPORT."""
+    start = time.perf_counter()
+    result = fn()
+    STARTUP_REPORT[name] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def preload(names):
+    """
+    Imports frameworks and loads models ahead of the first request, timing each one.
+
+    Args:
+        names (iterable): Keys of PRELOADERS, in load order.
+
+    Returns:
+        dict: STARTUP_REPORT.
+    """
+    for name in names:
+        if name not in PRELOADERS:
+            print(f"Unknown preload entry '{name}', expected one of {sorted(PRELOADERS)}")
+            continue
+        try:
+            timed(name, PRELOADERS[name])
+        except Exception as e:
+            # A missing framework must not keep the server from starting; the request path reports it
+            print(f"Preloading {name} failed: {e}")
+    return STARTUP_REPORT
+
+
+def report():
+    """Prints the startup report, slowest first."""
+    for name, seconds in sorted(STARTUP_REPORT.items(), key=lambda item: item[1], reverse=True):
+        print(f"  {name:<16} {seconds:8.3f}s")